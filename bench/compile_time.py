@@ -0,0 +1,262 @@
+# Copyright (C) 2023 FEniCS Project
+#
+# This file is part of FFCx. (https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Benchmark the time and memory of compiling the demo forms, per compiler stage.
+
+Every form file in demo/, and a few forms with runtime quadrature rules,
+are compiled with the degrees of their Lagrange elements raised by each
+of the given degree shifts. Each case is compiled in a new Python
+process, such that no case benefits from caches filled by another. The
+wall-clock time and peak memory of the stages analysis, IR, codegen,
+formatting and C compile are written to a JSON file, which can be
+compared against a baseline to find regressions.
+
+Example::
+
+    python bench/compile_time.py --degree-shifts 0 1 2 --output baseline.json
+    python bench/compile_time.py --degree-shifts 0 1 2 --output new.json --compare baseline.json
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+demo_dir = Path(__file__).parent.parent.joinpath("demo")
+
+# Forms with runtime quadrature rules, which no demo has since the
+# command line compiler cannot provide the quadrature points
+runtime_cases = {
+    "RuntimePoisson": """
+from ufl import (Coefficient, FiniteElement, Measure, TestFunction, TrialFunction,
+                 grad, inner, triangle)
+element = FiniteElement("Lagrange", triangle, 1)
+u, v = TrialFunction(element), TestFunction(element)
+f = Coefficient(element)
+dx = Measure("dx", metadata={"quadrature_rule": "runtime"})
+a = inner(grad(u), grad(v)) * dx
+L = f * v * dx
+""",
+    "RuntimeHyperElasticity": """
+from ufl import (Coefficient, Constant, FiniteElement, Identity, Measure, TestFunction,
+                 TrialFunction, VectorElement, derivative, det, diff, exp, grad, inner, ln,
+                 tetrahedron, tr, variable)
+element = VectorElement("Lagrange", tetrahedron, 1)
+K = FiniteElement("Lagrange", tetrahedron, 1)
+v, du = TestFunction(element), TrialFunction(element)
+u, mu = Coefficient(element), Coefficient(K)
+c = Constant(tetrahedron)
+F = variable(Identity(3) + grad(u))
+C = F.T * F
+J = det(F)
+psi = mu / 2 * (tr(C) - 3) - mu * ln(J) + c / 2 * ln(J) ** 2 + exp(tr(C) - 3)
+dx = Measure("dx", metadata={"quadrature_rule": "runtime"})
+L = inner(diff(psi, F), grad(v)) * dx
+a = derivative(L, u, du)
+""",
+}
+
+# Declaration of the function of the runtime quadrature support library
+# that tabulates basis functions. Compiling does not need its definition.
+call_basix_h = """
+#pragma once
+void call_basix(double***** FE, int num_points, const double* points, int nd, int family,
+                int cell_type, int degree, int lattice_type, int gdim);
+"""
+
+_lagrange_re = re.compile(r"""((?:Finite|Vector|Tensor)Element\(\s*(["'])"""
+                          r"""(?:Lagrange|CG|P|Q|DG|Discontinuous Lagrange)\2\s*,"""
+                          r"""\s*[^,()]+(?:\([^()]*\))?\s*,\s*)(\d+)""")
+
+
+def raise_degrees(source: str, shift: int) -> str:
+    """Raise the degrees of the Lagrange elements in UFL source code."""
+    return _lagrange_re.sub(lambda m: m.group(1) + str(int(m.group(3)) + shift), source)
+
+
+def cases():
+    """Return the names and UFL source code of the benchmarked form files."""
+    sources = {f.stem: f.read_text() for f in sorted(demo_dir.glob("*.py")) if f.stem != "test_demos"}
+    sources.update(runtime_cases)
+    return sources
+
+
+def compile_case(name: str, source: str, shift: int, trace_memory: bool):
+    """Compile UFL source code stage by stage.
+
+    Returns a dictionary mapping stage names to the wall-clock time in
+    seconds and, if trace_memory, the peak memory in bytes.
+    """
+    import ufl
+    from ffcx.analysis import analyze_ufl_objects
+    from ffcx.codegeneration import get_include_path
+    from ffcx.codegeneration.codegeneration import generate_code
+    from ffcx.codegeneration.jit import _c_compiler
+    from ffcx.formatting import format_code
+    from ffcx.ir.representation import compute_ir
+    from ffcx.options import get_options
+
+    results = {}
+
+    def stage(name, function, *args):
+        if trace_memory:
+            tracemalloc.start()
+        t = time.perf_counter()
+        value = function(*args)
+        results[name] = {"time": time.perf_counter() - t}
+        if trace_memory:
+            results[name]["peak_memory"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        return value
+
+    with tempfile.TemporaryDirectory() as build_dir:
+        build_dir = Path(build_dir)
+        filename = build_dir.joinpath(f"{name}.py")
+        filename.write_text(raise_degrees(source, shift))
+        ufd = ufl.algorithms.load_ufl_file(str(filename))
+        options = get_options({"ir_cache_dir": ""})
+
+        analysis = stage("analysis", analyze_ufl_objects, ufd.forms + ufd.expressions + ufd.elements, options)
+        ir = stage("ir", compute_ir, analysis, ufd.object_names, name, options, False)
+        code = stage("codegen", generate_code, ir, options)
+        has_runtime_qr = any(integral.has_runtime_qr for integral in ir.integrals)
+        code_h, code_c = stage("formatting", format_code, code, options, has_runtime_qr)
+
+        # The C compiler runs in a child process, whose peak memory is
+        # reported by the operating system
+        build_dir.joinpath(f"{name}.h").write_text(code_h)
+        build_dir.joinpath(f"{name}.c").write_text(code_c)
+        build_dir.joinpath("call_basix.h").write_text(call_basix_h)
+        command = _c_compiler() + [f"-I{get_include_path()}", f"-I{build_dir}", "-c", f"{name}.c"]
+        with open(build_dir.joinpath("compile.log"), "w+") as log:
+            t = time.perf_counter()
+            process = subprocess.Popen(command, cwd=build_dir, stdout=log, stderr=subprocess.STDOUT)
+            _, status, usage = os.wait4(process.pid, 0)
+            results["c_compile"] = {"time": time.perf_counter() - t}
+            if not (os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0):
+                log.seek(0)
+                raise RuntimeError(f"Compiling {name}.c failed:\n{log.read()}")
+        if trace_memory:
+            results["c_compile"]["peak_memory"] = usage.ru_maxrss * 1024
+
+    return results
+
+
+def run_case(name: str, shift: int, repeat: int):
+    """Compile a case in new processes.
+
+    Returns the minimum time of each stage over repeat processes, and
+    the peak memory in another process with memory tracing, which slows
+    down the compiler.
+    """
+    def run(trace_memory):
+        code = "import json, sys; sys.path.insert(0, {!r}); import compile_time as b; " \
+            "print(json.dumps(b.compile_case({!r}, b.cases()[{!r}], {}, {})))"
+        code = code.format(str(Path(__file__).parent), name, name, shift, trace_memory)
+        out = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             text=True)
+        if out.returncode != 0:
+            raise RuntimeError(out.stderr.strip().splitlines()[-1])
+        return json.loads(out.stdout.splitlines()[-1])
+
+    results = run(True)
+    for i in range(repeat):
+        timed = run(False)
+        for s, r in timed.items():
+            if i == 0 or r["time"] < results[s]["time"]:
+                results[s]["time"] = r["time"]
+    return results
+
+
+def compare(results, baseline, tolerance: float, min_time: float):
+    """Return the stages that take more time or memory than in the baseline.
+
+    A stage regresses if it takes more than (1 + tolerance) times its
+    baseline time, and at least min_time seconds more, or more than
+    (1 + tolerance) times its baseline peak memory.
+    """
+    base = {(r["case"], r["degree_shift"]): r for r in baseline["results"]}
+    regressions = []
+    for r in results["results"]:
+        b = base.get((r["case"], r["degree_shift"]))
+        if b is None or "stages" not in b or "stages" not in r:
+            continue
+        for s, new in r["stages"].items():
+            old = b["stages"].get(s)
+            if old is None:
+                continue
+            if new["time"] > (1 + tolerance) * old["time"] and new["time"] - old["time"] > min_time:
+                regressions.append((r["case"], r["degree_shift"], s, "time", old["time"], new["time"]))
+            if new.get("peak_memory", 0) > (1 + tolerance) * old.get("peak_memory", float("inf")):
+                regressions.append((r["case"], r["degree_shift"], s, "peak_memory", old["peak_memory"],
+                                    new["peak_memory"]))
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("cases", nargs="*", help="cases to compile, by default all demos and runtime cases")
+    parser.add_argument("--degree-shifts", type=int, nargs="+", default=[0, 1],
+                        help="amounts to raise the degrees of Lagrange elements by")
+    parser.add_argument("--repeat", type=int, default=1, help="number of timed processes per case")
+    parser.add_argument("--output", default="compile_time.json", help="file to write the results to")
+    parser.add_argument("--compare", help="results file of a baseline to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative increase over the baseline")
+    parser.add_argument("--min-time", type=float, default=0.01,
+                        help="allowed absolute increase of time over the baseline in seconds")
+    xargs = parser.parse_args(args)
+
+    all_cases = cases()
+    names = xargs.cases or list(all_cases)
+    for name in names:
+        if name not in all_cases:
+            parser.error(f"unknown case {name}, choose from {', '.join(all_cases)}")
+
+    import ffcx
+    results = {"metadata": {"ffcx": ffcx.__version__, "python": platform.python_version(),
+                            "machine": platform.machine(), "processor": platform.processor(),
+                            "date": time.strftime("%Y-%m-%dT%H:%M:%S")},
+               "results": []}
+    t0 = time.perf_counter()
+    for name in names:
+        for shift in xargs.degree_shifts:
+            result = {"case": name, "degree_shift": shift}
+            try:
+                result["stages"] = run_case(name, shift, xargs.repeat)
+            except RuntimeError as e:
+                result["error"] = str(e)
+                print(f"{name} +{shift}: failed: {e}")
+            else:
+                print(f"{name} +{shift}: " + ", ".join(
+                    f"{s} {1e3 * r['time']:.1f} ms {r['peak_memory'] / 2**20:.1f} MiB"
+                    for s, r in result["stages"].items()))
+            results["results"].append(result)
+    print(f"Total benchmark time {time.perf_counter() - t0:.1f} s")
+
+    with open(xargs.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    if xargs.compare:
+        with open(xargs.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, xargs.tolerance, xargs.min_time)
+        for case, shift, stage, quantity, old, new in regressions:
+            print(f"Regression: {case} +{shift} {stage} {quantity} {old:.4g} -> {new:.4g}")
+        if regressions:
+            return 1
+        print(f"No regressions against {xargs.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+# Copyright (C) 2023 FEniCS Project
+#
+# This file is part of FFCx. (https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Benchmark the time to import FFCx modules in a new Python process.
+
+Worker processes that only load cached JIT modules pay this time, so
+importing ffcx.codegeneration.jit should not import UFL, Basix or NumPy.
+
+Example::
+
+    python bench/import_time.py --repeat 20 ffcx.codegeneration.jit ffcx.compiler
+
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+
+def import_time(module: str, repeat: int):
+    """Return wall-clock times of importing a module in new processes, in seconds."""
+    # Only the import is timed, not the interpreter startup
+    code = "import time, sys; t = time.perf_counter(); {}; sys.stdout.write(str(time.perf_counter() - t))"
+    times = []
+    for i in range(repeat):
+        out = subprocess.run([sys.executable, "-c", code.format(f"import {module}")],
+                             check=True, stdout=subprocess.PIPE, text=True).stdout
+        times.append(float(out))
+    return times
+
+
+def imported_modules(module: str):
+    """Return the top-level packages, except private ones, imported by importing a module."""
+    code = f"import sys; before = set(sys.modules); import {module}; print(' '.join(set(sys.modules) - before))"
+    out = subprocess.run([sys.executable, "-c", code], check=True, stdout=subprocess.PIPE, text=True).stdout
+    return sorted({name.split(".")[0] for name in out.split() if not name.startswith("_")})
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("modules", nargs="*", default=["ffcx.codegeneration.jit"], help="modules to import")
+    parser.add_argument("--repeat", type=int, default=10, help="number of processes per module")
+    xargs = parser.parse_args(args)
+
+    t0 = time.perf_counter()
+    for module in xargs.modules:
+        times = import_time(module, xargs.repeat)
+        print(f"{module}: min {1e3 * min(times):.1f} ms, median {1e3 * statistics.median(times):.1f} ms "
+              f"over {len(times)} processes")
+        print(f"  imports: {' '.join(imported_modules(module))}")
+    print(f"Total benchmark time {time.perf_counter() - t0:.1f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,325 @@
+# Copyright (C) 2023 FEniCS Project
+#
+# This file is part of FFCx. (https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Benchmark the execution time of generated tabulate_tensor kernels.
+
+A form is compiled with compile_forms, and the kernel of each integral
+is called in a native loop over many cells with random, valid cell
+geometries and coefficients. For cell integrals, the kernel with
+runtime quadrature and pretabulated basis function tables is also run,
+at the points of a quadrature rule of the same degree as the compiled
+one. With --cell-batch-size W, the interleaved kernels taking the data
+of W cells per call are run too. The throughput is reported in cells per second, nanoseconds per
+cell and floating point operations per second, counted by count_flops.
+
+Example::
+
+    python bench/kernel_time.py laplace --cell tetrahedron --degree 1 2 3 --num-cells 10000000
+    python bench/kernel_time.py elasticity --cell-batch-size 4 --cflags="-O3 -march=native"
+    python bench/kernel_time.py coefficients --degree 3 --loop-fusion-registers 0
+
+"""
+
+import argparse
+import importlib.util
+import sys
+import tempfile
+import time
+
+import cffi
+import numpy as np
+
+import basix
+import ffcx.codegeneration.jit
+import ufl
+from ffcx.analysis import analyze_ufl_objects
+from ffcx.codegeneration import get_include_path
+from ffcx.codegeneration.flop_count import count_flops
+from ffcx.ir.representation import compute_ir
+from ffcx.options import get_options
+
+
+def mass(element, dx, ds):
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    return ufl.inner(u, v) * dx
+
+
+def laplace(element, dx, ds):
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    return ufl.inner(ufl.grad(u), ufl.grad(v)) * dx
+
+
+def robin(element, dx, ds):
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    f = ufl.Coefficient(element)
+    return ufl.inner(ufl.grad(u), ufl.grad(v)) * dx + f * u * v * ds
+
+
+def elasticity(element, dx, ds):
+    element = ufl.VectorElement(element.family(), element.cell(), element.degree())
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    mu, lmbda = ufl.Coefficient(ufl.FiniteElement("DG", element.cell(), 0)), ufl.Constant(element.cell())
+
+    def sigma(u):
+        return 2 * mu * ufl.sym(ufl.grad(u)) + lmbda * ufl.tr(ufl.sym(ufl.grad(u))) * ufl.Identity(len(u))
+    return ufl.inner(sigma(u), ufl.sym(ufl.grad(v))) * dx
+
+
+def hyperelasticity(element, dx, ds):
+    element = ufl.VectorElement(element.family(), element.cell(), element.degree())
+    v, du, u = ufl.TestFunction(element), ufl.TrialFunction(element), ufl.Coefficient(element)
+    mu, lmbda = ufl.Constant(element.cell()), ufl.Constant(element.cell())
+    F = ufl.variable(ufl.Identity(len(u)) + ufl.grad(u))
+    C = F.T * F
+    J = ufl.det(F)
+    psi = mu / 2 * (ufl.tr(C) - len(u)) - mu * ufl.ln(J) + lmbda / 2 * ufl.ln(J) ** 2
+    L = ufl.inner(ufl.diff(psi, F), ufl.grad(v)) * dx
+    return ufl.derivative(L, u, du)
+
+
+def coefficients(element, dx, ds):
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    fs = [ufl.Coefficient(element) for i in range(12)]
+    return sum(f * ufl.inner(ufl.grad(f), ufl.grad(u)) for f in fs) * v * dx
+
+
+forms = {f.__name__: f for f in (mass, laplace, robin, elasticity, hyperelasticity, coefficients)}
+
+# Loops calling a kernel for num_cells cells, cycling through the data
+# of num_distinct cells. The kernels are passed as void pointers, such
+# that the ufcx declarations are not needed.
+runner_source = """
+#include <stdint.h>
+#include <time.h>
+#include <ufcx.h>
+
+static double now(void)
+{
+  struct timespec t;
+  clock_gettime(CLOCK_MONOTONIC, &t);
+  return t.tv_sec + 1e-9 * t.tv_nsec;
+}
+
+double run_kernel(void* kernel, int num_cells, int num_distinct, double* A, int A_size, const double* w,
+                  int w_size, const double* c, const double* x, int x_size, const int* entity_local_index,
+                  const uint8_t* quadrature_permutation)
+{
+  ufcx_tabulate_tensor_float64* tabulate = (ufcx_tabulate_tensor_float64*)kernel;
+  double t = now();
+  for (int i = 0; i < num_cells; i += num_distinct)
+    for (int j = 0; j < num_distinct; ++j)
+      tabulate(A + j * A_size, w + j * w_size, c, x + j * x_size, entity_local_index, quadrature_permutation);
+  return now() - t;
+}
+
+double run_runtime_kernel(void* kernel, int num_cells, int num_distinct, double* A, int A_size, const double* w,
+                          int w_size, const double* c, const double* x, int x_size, int num_points,
+                          const double* points, const double* weights, const double* const* tables)
+{
+  ufcx_tabulate_tensor_runtime_tables_float64* tabulate = (ufcx_tabulate_tensor_runtime_tables_float64*)kernel;
+  double t = now();
+  for (int i = 0; i < num_cells; i += num_distinct)
+    for (int j = 0; j < num_distinct; ++j)
+      tabulate(A + j * A_size, w + j * w_size, c, x + j * x_size, NULL, NULL, num_points, points, weights,
+               NULL, tables);
+  return now() - t;
+}
+
+double run_interleaved_kernel(void* kernel, int num_cells, int num_distinct, double* A, const double* w,
+                              const double* c, const double* x, const int* entity_local_index,
+                              const uint8_t* quadrature_permutation)
+{
+  ufcx_tabulate_tensor_interleaved_float64* tabulate = (ufcx_tabulate_tensor_interleaved_float64*)kernel;
+  double t = now();
+  for (int i = 0; i < num_cells; i += num_distinct)
+    tabulate(A, w, c, x, entity_local_index, quadrature_permutation, num_distinct);
+  return now() - t;
+}
+"""
+
+runner_decl = """
+double run_kernel(void* kernel, int num_cells, int num_distinct, double* A, int A_size, const double* w,
+                  int w_size, const double* c, const double* x, int x_size, const int* entity_local_index,
+                  const uint8_t* quadrature_permutation);
+double run_runtime_kernel(void* kernel, int num_cells, int num_distinct, double* A, int A_size, const double* w,
+                          int w_size, const double* c, const double* x, int x_size, int num_points,
+                          const double* points, const double* weights, const double* const* tables);
+double run_interleaved_kernel(void* kernel, int num_cells, int num_distinct, double* A, const double* w,
+                              const double* c, const double* x, const int* entity_local_index,
+                              const uint8_t* quadrature_permutation);
+"""
+
+
+def compile_runner(build_dir: str, extra_compile_args):
+    """Compile the loops calling the kernels, and return their cffi module."""
+    ffi = cffi.FFI()
+    ffi.cdef(runner_decl)
+    ffi.set_source("ffcx_kernel_time", runner_source, include_dirs=[get_include_path()],
+                   extra_compile_args=extra_compile_args)
+    library = ffi.compile(tmpdir=build_dir)
+    spec = importlib.util.spec_from_file_location("ffcx_kernel_time", library)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def random_geometry(cell: str, num_cells: int, rng):
+    """Return coordinate dofs of random affine images of the reference cell, padded to 3D.
+
+    The maps are perturbations of the identity small enough to keep the
+    cells valid and positively oriented.
+    """
+    X = basix.geometry(basix.cell.string_to_type(cell))
+    tdim = X.shape[1]
+    x = np.zeros((num_cells, X.shape[0], 3))
+    for i in range(num_cells):
+        M = np.identity(tdim) + rng.uniform(-0.25 / tdim, 0.25 / tdim, (tdim, tdim))
+        x[i, :, :tdim] = X @ M.T + rng.uniform(-1.0, 1.0, tdim)
+    return x.reshape(num_cells, -1)
+
+
+def interleave(x, width: int):
+    """Return the data of cells, by rows, interleaved in blocks of width cells."""
+    num_blocks = -(-x.shape[0] // width)
+    y = np.zeros((num_blocks * width, x.shape[1]), dtype=x.dtype)
+    y[:x.shape[0]] = x
+    return np.ascontiguousarray(y.reshape(num_blocks, width, -1).transpose(0, 2, 1))
+
+
+def kernel_flops(form: ufl.Form, options: dict):
+    """Return the number of flops of each integral of a form, by integral name, and the form IR."""
+    ir = compute_ir(analyze_ufl_objects([form], options), {}, "flops", options, False)
+    return {integral.name: flops for integral, flops in zip(ir.integrals, count_flops(form, options))}, ir
+
+
+def benchmark(name: str, cell: str, degree: int, num_cells: int, num_distinct: int, extra_compile_args, runner,
+              cell_batch_size: int = 0, sum_factorization: bool = True, loop_fusion_registers: int = 16):
+    """Run the kernels of a form and return a row of results for each kernel."""
+    rng = np.random.default_rng(0)
+    element = ufl.FiniteElement("Lagrange", getattr(ufl, cell), degree)
+    options = get_options({"runtime_pretabulated_tables": True, "cell_batch_size": cell_batch_size,
+                           "sum_factorization": sum_factorization, "loop_fusion_registers": loop_fusion_registers})
+    qdegree = 2 * degree
+    dx = ufl.Measure("dx", metadata={"quadrature_degree": qdegree})
+    ds = ufl.Measure("ds", metadata={"quadrature_degree": qdegree})
+    form = forms[name](element, dx, ds)
+    flops, ir = kernel_flops(form, options)
+    integrals = {integral.name: integral for integral in ir.integrals}
+
+    # The same form with runtime quadrature on cells, whose flops are
+    # counted for the compiled rule with the same number of points
+    dx_runtime = ufl.Measure("dx", metadata={"quadrature_rule": "runtime"})
+    runtime_form = forms[name](element, dx_runtime, ds)
+
+    compiled_forms, module, _ = ffcx.codegeneration.jit.compile_forms(
+        [form, runtime_form], options=options, cffi_extra_compile_args=extra_compile_args)
+    ffi = module.ffi
+
+    c = np.ones(sum(int(np.prod(constant.ufl_shape)) for constant in form.constants()) or 1)
+    x = random_geometry(cell, num_distinct, rng)
+    entity_local_index = np.zeros(2, dtype=np.intc)
+    perm = np.zeros(2, dtype=np.uint8)
+    points, weights = basix.make_quadrature(basix.cell.string_to_type(cell), qdegree)
+    num_cells = num_distinct * max(1, num_cells // num_distinct)
+
+    def ptr(array, ctype="double *"):
+        return runner.ffi.cast(ctype, array.ctypes.data)
+
+    rows = []
+    for integral_type in ("cell", "exterior_facet", "interior_facet"):
+        names = ir.forms[0].integral_names.get(integral_type, [])
+        for i, integral_name in enumerate(names):
+            integral_ir = integrals[integral_name]
+            sides = 2 if integral_type == "interior_facet" else 1
+            A_size = int(np.prod(integral_ir.tensor_shape)) * sides ** integral_ir.rank
+            w_size = max(1, sides * integral_ir.coefficients_size)
+            A = np.zeros((num_distinct, A_size))
+            w = rng.uniform(0.1, 0.2, (num_distinct, w_size))
+            xs = np.repeat(x, sides, axis=1)
+
+            kernels = []
+            compiled = compiled_forms[0].integrals(getattr(module.lib, integral_type))[i]
+            address = int(ffi.cast("uintptr_t", compiled.tabulate_tensor_float64))
+            kernels.append(("compiled", lambda: runner.lib.run_kernel(
+                runner.ffi.cast("void *", address), num_cells, num_distinct, ptr(A), A_size, ptr(w), w_size,
+                ptr(c), ptr(xs), xs.shape[1], ptr(entity_local_index, "int *"), ptr(perm, "uint8_t *"))))
+
+            if cell_batch_size > 0:
+                A_i, w_i, x_i = (interleave(v, cell_batch_size) for v in (A, w, xs))
+                entities_i = np.zeros(A_i.shape[0] * sides * cell_batch_size, dtype=np.intc)
+                perms_i = np.zeros(entities_i.shape, dtype=np.uint8)
+                interleaved_address = int(ffi.cast("uintptr_t", compiled.tabulate_tensor_interleaved_float64))
+                kernels.append(("interleaved", lambda: runner.lib.run_interleaved_kernel(
+                    runner.ffi.cast("void *", interleaved_address), num_cells, num_distinct, ptr(A_i), ptr(w_i),
+                    ptr(c), ptr(x_i), ptr(entities_i, "int *"), ptr(perms_i, "uint8_t *"))))
+
+            if integral_type == "cell":
+                runtime = compiled_forms[1].integrals(module.lib.cell)[i]
+                tables = []
+                for k in range(runtime.num_runtime_tables):
+                    desc = runtime.runtime_tables[k]
+                    e = basix.create_element(basix.ElementFamily(desc.family), basix.CellType(desc.cell_type),
+                                             desc.degree, basix.LagrangeVariant(desc.lattice_type),
+                                             basix.DPCVariant(desc.dpc_variant), bool(desc.discontinuous))
+                    t = e.tabulate(2, points)[desc.derivative, :, :, desc.component]
+                    tables.append(np.ascontiguousarray(t))
+                table_ptrs = runner.ffi.new("double*[]", [ptr(t) for t in tables])
+                runtime_address = int(ffi.cast("uintptr_t", runtime.tabulate_tensor_runtime_tables_float64))
+                kernels.append(("runtime", lambda: runner.lib.run_runtime_kernel(
+                    runner.ffi.cast("void *", runtime_address), num_cells, num_distinct, ptr(A), A_size, ptr(w),
+                    w_size, ptr(c), ptr(xs), xs.shape[1], points.shape[0], ptr(points), ptr(weights),
+                    table_ptrs)))
+
+            for variant, run in kernels:
+                run()  # warm up the caches
+                seconds = run()
+                rows.append({"form": name, "cell": cell, "degree": degree, "integral": integral_type,
+                             "kernel": variant, "cells_per_second": num_cells / seconds,
+                             "ns_per_cell": 1e9 * seconds / num_cells, "flops": flops[integral_name],
+                             "gflops_per_second": 1e-9 * flops[integral_name] * num_cells / seconds})
+    return rows
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("forms", nargs="*", help=f"forms to benchmark, from {', '.join(forms)}")
+    parser.add_argument("--cell", nargs="+", default=["triangle"],
+                        choices=["interval", "triangle", "tetrahedron", "quadrilateral", "hexahedron"])
+    parser.add_argument("--degree", type=int, nargs="+", default=[1, 2], help="degrees of the Lagrange elements")
+    parser.add_argument("--num-cells", type=int, default=1000000, help="number of kernel calls")
+    parser.add_argument("--num-distinct", type=int, default=1000, help="number of cells with different data")
+    parser.add_argument("--cflags", default="-O2", help="flags for compiling the kernels")
+    parser.add_argument("--cell-batch-size", type=int, default=0,
+                        help="number of cells per call of the interleaved kernels, 0 to not run them")
+    parser.add_argument("--no-sum-factorization", action="store_true",
+                        help="generate dense kernels on quadrilaterals and hexahedra")
+    parser.add_argument("--loop-fusion-registers", type=int, default=16,
+                        help="register budget of fused loops over the dofs, 0 to fuse all of them")
+    xargs = parser.parse_args(args)
+    for name in xargs.forms:
+        if name not in forms:
+            parser.error(f"unknown form {name}, choose from {', '.join(forms)}")
+
+    extra_compile_args = xargs.cflags.split()
+    t0 = time.perf_counter()
+    with tempfile.TemporaryDirectory() as build_dir:
+        runner = compile_runner(build_dir, extra_compile_args)
+        print(f"{'form':16}{'cell':14}{'degree':>6} {'integral':16}{'kernel':12}{'cells/s':>12}{'ns/cell':>10}"
+              f"{'flops':>10}{'GFLOP/s':>9}")
+        for name in xargs.forms or forms:
+            for cell in xargs.cell:
+                for degree in xargs.degree:
+                    for r in benchmark(name, cell, degree, xargs.num_cells, xargs.num_distinct, extra_compile_args,
+                                       runner, xargs.cell_batch_size, not xargs.no_sum_factorization,
+                                       xargs.loop_fusion_registers):
+                        print(f"{r['form']:16}{r['cell']:14}{r['degree']:>6} {r['integral']:16}{r['kernel']:12}"
+                              f"{r['cells_per_second']:12.4g}{r['ns_per_cell']:10.1f}{r['flops']:10d}"
+                              f"{r['gflops_per_second']:9.3f}")
+    print(f"Total benchmark time {time.perf_counter() - t0:.1f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
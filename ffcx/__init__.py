@@ -12,13 +12,25 @@ FFCx compiles finite element variational forms into C code.
 
 import logging
 
-import pkg_resources
-
 # Import default options
 from ffcx.options import get_options  # noqa: F401
 
-__version__ = pkg_resources.get_distribution("fenics-ffcx").version
-
 logging.basicConfig()
 logger = logging.getLogger("ffcx")
 logging.captureWarnings(capture=True)
+
+
+def __getattr__(name):
+    # The version is looked up on first use, as importing the package
+    # metadata takes longer than importing FFCx
+    if name == "__version__":
+        global __version__
+        try:
+            from importlib.metadata import version
+        except ImportError:
+            import pkg_resources
+            __version__ = pkg_resources.get_distribution("fenics-ffcx").version
+        else:
+            __version__ = version("fenics-ffcx")
+        return __version__
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
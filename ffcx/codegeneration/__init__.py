@@ -1,3 +1,4 @@
+import functools
 import hashlib
 import os
 
@@ -16,20 +17,13 @@ def get_include_path():
     return _include_path
 
 
-def _compute_signature():
-    # Compute signature of ufc header files
-    h = hashlib.sha1()
-    with open(os.path.join(get_include_path(), "ufcx.h")) as f:
-        h.update(f.read().encode("utf-8"))
-    return h.hexdigest()
-
-
-_signature = _compute_signature()
-
-
+@functools.lru_cache(maxsize=None)
 def get_signature():
     """Return SHA-1 hash of the contents of ufcx.h.
 
-    In this implementation, the value is computed on import.
+    In this implementation, the value is computed on first use.
     """
-    return _signature
+    h = hashlib.sha1()
+    with open(os.path.join(get_include_path(), "ufcx.h")) as f:
+        h.update(f.read().encode("utf-8"))
+    return h.hexdigest()
@@ -30,7 +30,9 @@ class FFCXBackend(object):
         original_constant_offsets = ir.original_constant_offsets
 
         self.symbols = FFCXBackendSymbols(self.language, coefficient_numbering,
-                                          coefficient_offsets, original_constant_offsets)
+                                          coefficient_offsets, original_constant_offsets,
+                                          getattr(ir, "has_runtime_qr", False),
+                                          1 if options["runtime_pretabulated_tables"] else options["padlen"])
         self.definitions = FFCXBackendDefinitions(ir, self.language,
                                                   self.symbols, options)
         self.access = FFCXBackendAccess(ir, self.language, self.symbols,
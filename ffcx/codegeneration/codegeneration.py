@@ -14,12 +14,14 @@ UFC function from an intermediate representation (IR).
 import logging
 import typing
 
+from ffcx import instrumentation
 from ffcx.codegeneration.dofmap import generator as dofmap_generator
 from ffcx.codegeneration.expressions import generator as expression_generator
 from ffcx.codegeneration.finite_element import \
     generator as finite_element_generator
 from ffcx.codegeneration.form import generator as form_generator
 from ffcx.codegeneration.integrals import generator as integral_generator
+from ffcx.parallel import fork_map
 
 logger = logging.getLogger("ffcx")
 
@@ -47,8 +49,22 @@ def generate_code(ir, options) -> CodeBlocks:
     # Generate code for finite_elements
     code_finite_elements = [finite_element_generator(element_ir, options) for element_ir in ir.elements]
     code_dofmaps = [dofmap_generator(dofmap_ir, options) for dofmap_ir in ir.dofmaps]
-    code_integrals = [integral_generator(integral_ir, options, ir.elements) for integral_ir in ir.integrals]
+
+    # Integrals and expressions are generated in a process pool, if
+    # enabled, as they usually dominate code generation time
+    num_integrals = len(ir.integrals)
+
+    def generate(i):
+        if i < num_integrals:
+            with instrumentation.span("integral_code", integral=ir.integrals[i].name,
+                                      integral_type=ir.integrals[i].integral_type):
+                return integral_generator(ir.integrals[i], options)
+        with instrumentation.span("expression_code", expression=ir.expressions[i - num_integrals].name):
+            return expression_generator(ir.expressions[i - num_integrals], options)
+
+    code = fork_map(generate, num_integrals + len(ir.expressions), options["codegen_processes"])
+    code_integrals = code[:num_integrals]
+    code_expressions = code[num_integrals:]
     code_forms = [form_generator(form_ir, options) for form_ir in ir.forms]
-    code_expressions = [expression_generator(expression_ir, options) for expression_ir in ir.expressions]
     return CodeBlocks(elements=code_finite_elements, dofmaps=code_dofmaps,
                       integrals=code_integrals, forms=code_forms, expressions=code_expressions)
@@ -82,9 +82,11 @@ class FFCXBackendDefinitions(object):
 
         assert begin < end
 
-        # Get access to element table
+        # Get access to element table, and the dofs of its columns
         FE = self.symbols.element_table(tabledata, self.entitytype, mt.restriction)
         ic = self.symbols.coefficient_dof_sum_index()
+        num_columns = self.symbols.element_table_num_dofs(tabledata)
+        dof = self.symbols.element_table_dof(tabledata, self.entitytype, mt.restriction, ic)
 
         code = []
         pre_code = []
@@ -102,12 +104,13 @@ class FFCXBackendDefinitions(object):
                 pre_code += [L.ArrayDecl(self.options["scalar_type"], dof_access.array, num_dofs)]
                 pre_body = L.Assign(dof_access, dof_access_map)
                 pre_code += [L.ForRange(ic, 0, num_dofs, pre_body)]
+            dof_access = dof_access.array[dof]
         else:
-            dof_access = self.symbols.coefficient_dof_access(mt.terminal, ic * bs + begin)
+            dof_access = self.symbols.coefficient_dof_access(mt.terminal, dof * bs + begin)
 
         body = [L.AssignAdd(access, dof_access * FE[ic])]
         code += [L.VariableDecl(self.options["scalar_type"], access, 0.0)]
-        code += [L.ForRange(ic, 0, num_dofs, body)]
+        code += [L.ForRange(ic, 0, num_columns, body)]
 
         return pre_code, code
 
@@ -140,6 +143,8 @@ class FFCXBackendDefinitions(object):
         # Get access to element table
         FE = self.symbols.element_table(tabledata, self.entitytype, mt.restriction)
         ic = self.symbols.coefficient_dof_sum_index()
+        num_columns = self.symbols.element_table_num_dofs(tabledata)
+        dof = self.symbols.element_table_dof(tabledata, self.entitytype, mt.restriction, ic)
         dof_access = self.symbols.S("coordinate_dofs")
 
         # coordinate dofs is always 3d
@@ -151,9 +156,9 @@ class FFCXBackendDefinitions(object):
         value_type = scalar_to_value_type(self.options["scalar_type"])
 
         code = []
-        body = [L.AssignAdd(access, dof_access[ic * dim + begin + offset] * FE[ic])]
+        body = [L.AssignAdd(access, dof_access[dof * dim + begin + offset] * FE[ic])]
         code += [L.VariableDecl(f"{value_type}", access, 0.0)]
-        code += [L.ForRange(ic, 0, num_scalar_dofs, body)]
+        code += [L.ForRange(ic, 0, num_columns, body)]
 
         return [], code
 
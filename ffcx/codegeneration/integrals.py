@@ -5,16 +5,23 @@
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 
 import collections
+import hashlib
 import logging
 from typing import Any, Dict, List, Set, Tuple
 
+import numpy
+
 import ufl
 from ffcx.codegeneration import geometry
 from ffcx.codegeneration import integrals_template as ufcx_integrals
+from ffcx.codegeneration import loopfusion
+from ffcx.codegeneration import sumfactorization
 from ffcx.codegeneration.backend import FFCXBackend
 from ffcx.codegeneration.C.cnodes import BinOp, CNode
 from ffcx.codegeneration.C.format_lines import format_indented_lines
-from ffcx.ir.elementtables import piecewise_ttypes
+from ffcx.codegeneration.interleave import CellInterleaver
+from ffcx.element_interface import basix_index
+from ffcx.ir.elementtables import compress_table, piecewise_ttypes
 from ffcx.ir.integral import BlockDataT
 from ffcx.ir.representationutils import QuadratureRule
 from ffcx.naming import cdtype_to_numpy, scalar_to_value_type
@@ -22,7 +29,12 @@ from ffcx.naming import cdtype_to_numpy, scalar_to_value_type
 logger = logging.getLogger("ffcx")
 
 
-def generator(ir, options, ir_elements):
+def basix_variant(variant):
+    """Return the value of a basix Lagrange or DPC variant in generated code, -1 if unset."""
+    return -1 if variant is None else int(variant)
+
+
+def generator(ir, options):
     logger.info("Generating code for integral:")
     logger.info(f"--- type: {ir.integral_type}")
     logger.info(f"--- name: {ir.name}")
@@ -40,7 +52,7 @@ def generator(ir, options, ir_elements):
     ig = IntegralGenerator(ir, backend)
 
     # Generate code ast for the tabulate_tensor body
-    parts = ig.generate(ir_elements)
+    parts = ig.generate()
 
     # Format code as string
     body = format_indented_lines(parts.cs_format(ir.precision), 1)
@@ -71,20 +83,101 @@ def generator(ir, options, ir_elements):
     if options["tabulate_tensor_void"]:
         code["tabulate_tensor"] = ""
 
-    if ir.has_runtime_qr:
+    if ir.has_runtime_qr and options["runtime_pretabulated_tables"]:
+        factory = ufcx_integrals.factory_runtime_tables
+    elif ir.has_runtime_qr:
         factory = ufcx_integrals.factory_runtime
     else:
         factory = ufcx_integrals.factory
 
+    runtime_tables = ""
+    runtime_tables_init = ""
+    cell_tables = ""
+    num_tables = 0
+    if ir.has_runtime_qr and options["runtime_pretabulated_tables"]:
+        specs = ig.runtime_table_specs()
+        num_tables = len(specs)
+        # Offset tables to the quadrature points of each cell in a batch
+        cell_tables = "\n".join(f"    cell_tables[{i}] = tables[{i}] + q0 * {s['num_dofs']};"
+                                for i, s in enumerate(specs))
+        if specs:
+            runtime_tables = f"runtime_tables_{factory_name}"
+            values = ",\n".join(
+                f"  {{\"{s['name']}\", {s['family']}, {s['cell_type']}, {s['degree']}, {s['lattice_type']}, "
+                f"{s['dpc_variant']}, {s['discontinuous']}, {s['nd']}, {s['component']}, {s['num_dofs']}}}"
+                for s in specs)
+            runtime_tables_init = f"static const ufcx_runtime_table {runtime_tables}[{num_tables}] = {{\n{values}\n}};"
+        else:
+            runtime_tables = L.Null()
+    elif ir.has_runtime_qr:
+        specs = ig.runtime_table_specs()
+        if specs:
+            # Tables are aligned in blocks of whole doubles
+            alignment = options["assume_aligned"]
+            block = max(alignment // 8, 1) if alignment != -1 else 1
+            tabulate_tables = "\n".join(
+                f"  tabulate_table_{factory_name}(tables + table_offset_{factory_name}(num_points, {i}), "
+                f"table_strides_{factory_name}[{i}], num_points, points, {s['num_dofs']}, {s['nd']}, {s['family']}, "
+                f"{s['cell_type']}, {s['degree']}, {s['lattice_type']}, {s['gdim']});"
+                for i, s in enumerate(specs))
+            runtime_tables = ufcx_integrals.runtime_tables.format(
+                factory_name=factory_name, num_tables=len(specs), alignment=8 * block, block=block,
+                strides=", ".join(str(s["stride"]) for s in specs),
+                tabulate_tables=tabulate_tables)
+            if options["runtime_table_cache_size"] > 0:
+                # Unique seed for the table cache keys of this integral
+                seed = int(hashlib.sha1(repr(specs).encode("utf-8")).hexdigest()[:16], 16)
+                runtime_tables += ufcx_integrals.runtime_table_cache.format(
+                    factory_name=factory_name, cache_size=options["runtime_table_cache_size"],
+                    gdim=ir.geometric_dimension, seed=seed)
+
+    # Number of entities, and entity permutations, given per cell
+    num_entities = 2 if ir.integral_type == "interior_facet" else 1
+
+    tensor_size = int(numpy.prod(ir.tensor_shape, dtype=int))
+    coordinate_dofs_size = 3 * num_entities * ir.num_coordinate_dofs
+    np_scalar_type = cdtype_to_numpy(options["scalar_type"])
+    geom_type = scalar_to_value_type(options["scalar_type"])
+
+    interleaved = ""
+    interleaved_fields = ""
+    cell_batch_size = options["cell_batch_size"]
+    if cell_batch_size > 0 and not ir.has_runtime_qr:
+        if np_scalar_type not in ("float32", "float64"):
+            raise RuntimeError(f"Interleaved kernels are not supported for scalar type {options['scalar_type']}.")
+        if options["tabulate_tensor_void"]:
+            tabulate_tensor_cells = ""
+        else:
+            tabulate_tensor_cells = format_indented_lines(
+                L.StatementList(ig.interleave_cells(parts, cell_batch_size)).cs_format(ir.precision), 1)
+        format_args = dict(factory_name=factory_name, cell_batch_size=cell_batch_size,
+                           np_scalar_type=np_scalar_type, scalar_type=options["scalar_type"], geom_type=geom_type)
+        interleaved = ufcx_integrals.interleaved.format(
+            tabulate_tensor_cells=tabulate_tensor_cells, tensor_size=tensor_size,
+            coefficients_size=ir.coefficients_size, coordinate_dofs_size=coordinate_dofs_size,
+            num_entities=num_entities, **format_args)
+        interleaved_fields = ufcx_integrals.interleaved_fields.format(**format_args)
+
     implementation = factory.format(
         factory_name=factory_name,
+        runtime_tables=runtime_tables,
+        runtime_tables_init=runtime_tables_init,
+        cell_tables=cell_tables,
+        num_tables=num_tables,
+        interleaved=interleaved,
+        interleaved_fields=interleaved_fields,
+        tensor_size=tensor_size,
+        coefficients_size=ir.coefficients_size,
+        coordinate_dofs_size=coordinate_dofs_size,
+        num_entities=num_entities,
+        gdim=ir.geometric_dimension,
         enabled_coefficients=code["enabled_coefficients"],
         enabled_coefficients_init=code["enabled_coefficients_init"],
         tabulate_tensor=code["tabulate_tensor"],
         needs_facet_permutations="true" if ir.needs_facet_permutations else "false",
         scalar_type=options["scalar_type"],
-        geom_type=scalar_to_value_type(options["scalar_type"]),
-        np_scalar_type=cdtype_to_numpy(options["scalar_type"]),
+        geom_type=geom_type,
+        np_scalar_type=np_scalar_type,
         coordinate_element=L.AddressOf(L.Symbol(ir.coordinate_element)))
 
     return declaration, implementation
@@ -168,7 +261,7 @@ class IntegralGenerator(object):
             self.shared_symbols[key] = s
         return s, defined
 
-    def generate(self, ir_elements):
+    def generate(self):
         """Generate entire tabulate_tensor body.
 
         Assumes that the code returned from here will be wrapped in a
@@ -197,7 +290,7 @@ class IntegralGenerator(object):
 
         # Generate the tables of basis function values and
         # pre-integrated blocks
-        parts += self.generate_element_tables(value_type, ir_elements)
+        parts += self.generate_element_tables(value_type)
 
         # Generate the tables of geometry data that are needed
         parts += self.generate_geometry_tables(value_type)
@@ -215,6 +308,10 @@ class IntegralGenerator(object):
             # Generate code to compute piecewise constant scalar factors
             all_preparts += self.generate_piecewise_partition(rule)
 
+            # Generate code to contract piecewise constant factors with
+            # precomputed reference tensors
+            all_preparts += self.generate_reference_tensor_parts(rule)
+
             # Generate code to integrate reusable blocks of final
             # element tensor
             pre_definitions, preparts, quadparts = self.generate_quadrature_loop(rule)
@@ -229,8 +326,23 @@ class IntegralGenerator(object):
         parts += all_preparts
         parts += all_quadparts
 
+        if self.ir.has_runtime_qr and self.owns_runtime_tables():
+            # Release the tables tabulated by this call
+            parts += [L.VerbatimStatement("free(tables);")]
+
         return L.StatementList(parts)
 
+    def interleave_cells(self, parts, width: int):
+        """Rewrite the generated tabulate_tensor body for a kernel tabulating width cells per call.
+
+        The kernel takes the data of the cells interleaved, and loops
+        over the cells innermost, see
+        ffcx.codegeneration.interleave.CellInterleaver.
+        """
+        if self.ir.has_runtime_qr:
+            raise RuntimeError("Interleaved kernels are not supported for runtime quadrature rules.")
+        return CellInterleaver(self.backend.language, width).statements([parts])
+
     def generate_quadrature_tables(self, value_type: str) -> List[str]:
         """Generate static tables of quadrature points and weights."""
         L = self.backend.language
@@ -256,6 +368,8 @@ class IntegralGenerator(object):
                 parts += [L.VariableDecl("const double*", wsym, qrwsym)]
         else:
             for quadrature_rule, integrand in self.ir.integrand.items():
+                if not self.uses_weights(quadrature_rule):
+                    continue
                 num_points = quadrature_rule.weights.shape[0]
 
                 # Generate quadrature weights array
@@ -302,7 +416,7 @@ class IntegralGenerator(object):
 
         return parts
 
-    def generate_element_tables(self, float_type: str, ir_elements):
+    def generate_element_tables(self, float_type: str):
         """Generate static tables with precomputed element basisfunction values in quadrature points."""
         L = self.backend.language
         parts = []
@@ -317,62 +431,223 @@ class IntegralGenerator(object):
             table_names = sorted(tables)
 
         if self.ir.has_runtime_qr:
-            # Only declare. For debugging, also include the non-runtime basis
-            for name in table_names:
-                parts += [L.VerbatimStatement(f"{float_type}**** {name};")]
+            # Look up tables tabulated at the runtime quadrature points
+            specs = self.runtime_table_specs()
+            if self.ir.options["runtime_pretabulated_tables"]:
+                # Tables are given by the caller
+                for i, spec in enumerate(specs):
+                    parts += [L.VerbatimStatement(f"const {float_type}* {spec['name']} = tables[{i}];")]
+            elif specs:
+                factory_name = self.ir.name
+                qp = self.backend.symbols.runtime_quadrature_points()
+                num_points = self.backend.symbols.num_runtime_quadrature_points()
+                if self.owns_runtime_tables():
+                    parts += [L.VerbatimStatement(f"double* tables = "
+                                                  f"tabulate_tables_{factory_name}({num_points}, {qp});")]
+                else:
+                    parts += [L.VerbatimStatement(f"const double* tables = "
+                                                  f"lookup_tables_{factory_name}({num_points}, {qp});")]
+                alignment = self.ir.options["assume_aligned"]
+                for i, spec in enumerate(specs):
+                    table = f"tables + table_offset_{factory_name}({num_points}, {i})"
+                    if alignment != -1:
+                        table = f"(const {float_type}*)__builtin_assume_aligned({table}, {alignment})"
+                    parts += [L.VerbatimStatement(f"const {float_type}* {spec['name']} = {table};")]
         else:
+            # Tables only used in sum factorised loops are replaced by
+            # their 1D factors, and tables only integrated into
+            # reference tensors are not needed
+            dense_names, factorized_names = self.table_uses()
+            # Tables with zero columns are compressed to the others,
+            # with maps from the remaining columns to dofs, which are
+            # also used by reference tensors
+            sparsity = self.table_sparsity()
             for name in table_names:
+                if name not in dense_names:
+                    continue
                 table = tables[name]
+                if name in sparsity:
+                    table = compress_table(table, sparsity[name])
                 parts += self.declare_table(name, table, padlen, float_type)
+            dof_maps = {sparsity[name].name: sparsity[name].dofs
+                        for name in dense_names | self.reference_tensor_table_names()
+                        if name in sparsity and sparsity[name].begin is None}
+            for name, dofs in sorted(dof_maps.items()):
+                parts += [L.ArrayDecl("static const int", name, dofs.shape, dofs)]
+            parts += self.generate_sum_factorization_tables(factorized_names, float_type)
+            parts += self.generate_reference_tensor_tables(float_type)
 
-        # Call basix
+        # Add leading comment if there are any tables
         if self.ir.has_runtime_qr:
-            # Comment
-            parts += [L.VerbatimStatement("// Compute basis and/or derivatives using basix")]
+            dimensions = "FE* dimensions: [points][dofs]"
+        else:
+            dimensions = "FE* dimensions: [permutation][entities][points][dofs]"
+        parts = L.commented_code_list(parts, [
+            "Precomputed values of basis functions and precomputations", dimensions])
+        return parts
 
-            # Compute using basix
-            for name in table_names:
-                if name.count("_") == 2:
-                    # Basis only
-                    nd = 0
-                else:
-                # FIXME Do something better than this hack (see generate_psi_table_name)
-                    if "_D10_" in name:
-                        # x derivative
-                        nd = 1
-                    elif "_D01_" in name:
-                        # y derivative
-                        nd = 2
-                    elif "_D100_" in name:
-                        nd = 1
-                    elif "_D010_" in name:
-                        nd = 2
-                    elif "_D001_" in name:
-                        nd = 3
-                    else:
-                        raise RuntimeError(f"Couldn't get derivative (name = {name})")
-                # FIXME Which ir_elements should we pick data from?
-                # Just take the one with highest degree...
-                ir_idx = -1
-                max_degree = -1
-                for k, ir_element in enumerate(ir_elements):
-                    if ir_element.degree > max_degree:
-                        ir_idx = k
-                        max_degree = ir_element.degree
-
-                family = ir_elements[ir_idx].basix_family.value
-                cell_type = ir_elements[ir_idx].basix_cell.value
-                degree = max_degree
-                lattice_type = 0 # equispaced (see element-families.h)
-                gdim = self.ir.geometric_dimension
-                parts += [L.VerbatimStatement(f"call_basix(&{name}, num_quadrature_points, quadrature_points, {nd}, {family}, {cell_type}, {degree}, {lattice_type}, {gdim});")]
+    def table_sparsity(self):
+        """Return the dofs with nonzero values of the compressed element tables, by table name."""
+        sparsity = {}
+        for tr in self.ir.unique_table_references.values():
+            tr_sparsity = self.backend.symbols.element_table_sparsity(tr)
+            if tr_sparsity is not None:
+                sparsity[tr.name] = tr_sparsity
+        return sparsity
+
+    def owns_runtime_tables(self):
+        """Check if the kernel tabulates its runtime tables itself and must release them."""
+        return (not self.ir.options["runtime_pretabulated_tables"]
+                and self.ir.options["runtime_table_cache_size"] == 0
+                and len(self.runtime_table_specs()) > 0)
+
+    def runtime_table_specs(self):
+        """Return the element, derivative and component to tabulate for each table at runtime quadrature points."""
+        tables = self.ir.unique_tables
+        specs = []
+        for name in sorted(tables):
+            tr = self.ir.unique_table_references[name]
+            # The lattice type is the basix Lagrange variant of the element
+            lagrange_variant = basix_variant(tr.element.lagrange_variant)
+            dpc_variant = basix_variant(tr.element.dpc_variant)
+            if not self.ir.options["runtime_pretabulated_tables"]:
+                if tr.component != 0:
+                    raise RuntimeError(f"Cannot tabulate value component {tr.component} of table {name} at "
+                                       "runtime quadrature points with call_basix.")
+                if dpc_variant != -1:
+                    raise RuntimeError(f"Cannot tabulate DPC variant {dpc_variant} of table {name} at "
+                                       "runtime quadrature points with call_basix.")
+
+            # Tables given by the caller are unpadded
+            num_dofs = tables[name].shape[3]
+            if self.ir.options["runtime_pretabulated_tables"]:
+                stride = num_dofs
+            else:
+                stride = self.backend.language.pad_dim(num_dofs, self.ir.options["padlen"])
+
+            specs.append({"name": name,
+                          "num_dofs": num_dofs,
+                          "stride": stride,
+                          "nd": basix_index(tr.derivatives),
+                          "component": tr.component,
+                          "family": tr.element.element_family.value,
+                          "cell_type": tr.element.cell_type.value,
+                          "degree": tr.element.degree(),
+                          "lattice_type": lagrange_variant,
+                          "dpc_variant": dpc_variant,
+                          "discontinuous": int(tr.element.discontinuous),
+                          "gdim": self.ir.geometric_dimension})
+        return specs
+
+    def generate_sum_factorization_tables(self, table_names, float_type: str):
+        """Generate static tables of the 1D factors of the given tables, and of the positions of points in grids."""
+        L = self.backend.language
+        padlen = self.ir.options["padlen"]
+        parts = []
+        for rule in self.ir.integrand.keys():
+            sf = self.sum_factorization(rule)
+            if sf is None:
+                continue
+            factors = sorted(set(f for name in table_names if name in sf.tables for f in sf.tables[name].factors))
+            dofs = sorted(set(sf.tables[name].dofs for name in table_names if name in sf.tables))
+            if not dofs:
+                continue
+            for name in factors:
+                parts += self.declare_table(name, sf.factors[name], padlen, float_type)
+            for name in dofs:
+                parts += [L.ArrayDecl("static const int", name, sf.dofs[name].shape, sf.dofs[name])]
+            point = self.sum_factorization_point(rule)
+            if isinstance(point, L.ArrayAccess):
+                parts += [L.ArrayDecl("static const int", point.array, sf.points.shape, sf.points)]
+        return parts
 
-        # Add leading comment if there are any tables
-        parts = L.commented_code_list(parts, [
-            "Precomputed values of basis functions and precomputations",
-            "FE* dimensions: [permutation][entities][points][dofs]"])
+    def generate_reference_tensor_tables(self, float_type: str):
+        """Generate static tables of the reference tensors of blocks with piecewise constant factors."""
+        padlen = self.ir.options["padlen"]
+        parts = []
+        for rule, integrand in self.ir.integrand.items():
+            used = set(blockdata.reference_tensor
+                       for contributions in integrand["block_contributions"].values()
+                       for blockdata in contributions if self.is_reference_tensor_block(blockdata))
+            for name in sorted(used):
+                parts += self.declare_table(name, integrand["reference_tensors"][name], padlen, float_type)
         return parts
 
+    def reference_tensor_table_names(self):
+        """Return the names of the argument tables of blocks contracted with reference tensors."""
+        return set(mad.tabledata.name
+                   for integrand in self.ir.integrand.values()
+                   for contributions in integrand["block_contributions"].values()
+                   for blockdata in contributions if self.is_reference_tensor_block(blockdata)
+                   for mad in blockdata.ma_data)
+
+    def sum_factorization(self, quadrature_rule):
+        """Return the tensor product structure of the tables of a quadrature rule, or None if there is none."""
+        if quadrature_rule is None or self.ir.has_runtime_qr:
+            return None
+        return self.ir.integrand[quadrature_rule]["sum_factorization"]
+
+    def sum_factorization_point(self, quadrature_rule):
+        """Return the position of the current quadrature point in the grid of points."""
+        L = self.backend.language
+        iq = self.backend.symbols.quadrature_loop_index()
+        points = self.sum_factorization(quadrature_rule).points
+        if numpy.array_equal(points, numpy.arange(len(points))):
+            return iq
+        return L.Symbol(f"PT_Q{quadrature_rule.id()}")[iq]
+
+    def is_reference_tensor_block(self, blockdata: BlockDataT):
+        """Check if a block is its factors contracted with a precomputed reference tensor."""
+        return blockdata.reference_tensor is not None and not self.ir.has_runtime_qr
+
+    def uses_weights(self, quadrature_rule):
+        """Check if the quadrature weights of a rule are read, by blocks not contracted with reference tensors."""
+        return any(not self.is_reference_tensor_block(blockdata)
+                   for contributions in self.ir.integrand[quadrature_rule]["block_contributions"].values()
+                   for blockdata in contributions)
+
+    def is_sum_factorized_block(self, quadrature_rule, blockdata: BlockDataT):
+        """Check if a block is integrated by sum factorisation."""
+        sf = self.sum_factorization(quadrature_rule)
+        return (sf is not None and len(blockdata.ma_data) > 0 and not blockdata.transposed
+                and not self.is_reference_tensor_block(blockdata)
+                and len(blockdata.factor_indices_comp_indices) == 1
+                and all(mad.tabledata.name in sf.tables for mad in blockdata.ma_data))
+
+    def is_sum_factorized_terminal(self, quadrature_rule, mt, tabledata):
+        """Check if a modified terminal is evaluated by sum factorisation."""
+        sf = self.sum_factorization(quadrature_rule)
+        return (sf is not None and tabledata is not None and isinstance(mt.terminal, ufl.classes.Coefficient)
+                and tabledata.name in sf.tables)
+
+    def table_uses(self):
+        """Return the names of the element tables used in dense loops, and in sum factorised loops.
+
+        Tables of blocks contracted with reference tensors are not used
+        in either.
+        """
+        dense = set()
+        factorized = set()
+        for rule, integrand in self.ir.integrand.items():
+            for attr in integrand["factorization"].nodes.values():
+                tr = attr.get("tr")
+                if tr is None or attr["status"] == "inactive":
+                    continue
+                if attr["status"] == "varying" and self.is_sum_factorized_terminal(rule, attr["mt"], tr):
+                    factorized.add(tr.name)
+                else:
+                    dense.add(tr.name)
+            for contributions in integrand["block_contributions"].values():
+                for blockdata in contributions:
+                    names = set(mad.tabledata.name for mad in blockdata.ma_data)
+                    if self.is_reference_tensor_block(blockdata):
+                        continue
+                    if self.is_sum_factorized_block(rule, blockdata):
+                        factorized.update(names)
+                    else:
+                        dense.update(names)
+        return dense, factorized
+
     def declare_table(self, name, table, padlen, value_type: str):
         """Declare a table.
 
@@ -393,7 +668,7 @@ class IntegralGenerator(object):
 
         # Generate dofblock parts, some of this will be placed before or
         # after quadloop
-        preparts, quadparts = self.generate_dofblock_partition(quadrature_rule)
+        preparts, quadparts, postparts = self.generate_dofblock_partition(quadrature_rule)
         body += quadparts
 
         # Wrap body in loop or scope
@@ -410,6 +685,7 @@ class IntegralGenerator(object):
                 quadparts = [L.ForRange(iq, 0, "num_quadrature_points", body=body)]
             else:
                 quadparts = [L.ForRange(iq, 0, num_points, body=body)]
+            quadparts += postparts
         return pre_definitions, preparts, quadparts
 
     def generate_piecewise_partition(self, quadrature_rule):
@@ -466,7 +742,11 @@ class IntegralGenerator(object):
 
                     # Backend specific modified terminal translation
                     vaccess = self.backend.access.get(mt.terminal, mt, tabledata, quadrature_rule)
-                    predef, vdef = self.backend.definitions.get(mt.terminal, mt, tabledata, quadrature_rule, vaccess)
+                    if mode == "varying" and self.is_sum_factorized_terminal(quadrature_rule, mt, tabledata):
+                        predef, vdef = self.sum_factorized_coefficient(mt, tabledata, quadrature_rule, vaccess)
+                    else:
+                        predef, vdef = self.backend.definitions.get(mt.terminal, mt, tabledata, quadrature_rule,
+                                                                    vaccess)
                     if predef:
                         access = predef[0].symbol.name
                         pre_definitions[str(access)] = predef
@@ -534,18 +814,56 @@ class IntegralGenerator(object):
             parts += intermediates
         return pre_definitions, parts
 
+    def sum_factorized_coefficient(self, mt, tabledata, quadrature_rule, access):
+        """Define a coefficient by its values in all quadrature points, evaluated by sum factorisation.
+
+        Returns the code evaluating the values before the quadrature
+        loops, and the definition in the quadrature loop.
+        """
+        L = self.backend.language
+        scalar_type = self.backend.access.options["scalar_type"]
+        sf = self.sum_factorization(quadrature_rule)
+        factors = sf.tables[tabledata.name]
+        dofs = L.Symbol(factors.dofs)
+        tdim = len(sf.shape)
+
+        def dof_value(indices):
+            dof = dofs[indices] * tabledata.block_size + tabledata.offset
+            return self.backend.symbols.coefficient_dof_access(mt.terminal, dof)
+
+        iq = self.backend.symbols.quadrature_loop_index()
+        ic = self.backend.symbols.coefficient_dof_sum_index()
+        points = [L.Symbol(f"{iq.name}{i}") for i in range(tdim)]
+        dof_indices = [L.Symbol(f"{ic.name}{i}") for i in range(tdim)]
+        values = L.Symbol(f"{access.name}_Q{quadrature_rule.id()}")
+        code = sumfactorization.evaluate(
+            L, scalar_type, values, sf.shape, [L.Symbol(f) for f in factors.factors], sf.dofs[factors.dofs].shape,
+            dof_value, points, dof_indices, lambda: self.new_temp_symbol("sf"))
+
+        predef = [L.ArrayDecl(scalar_type, values, len(sf.points)), L.StatementList(code)]
+        vdef = [L.VariableDecl(f"const {scalar_type}", access, values[self.sum_factorization_point(quadrature_rule)])]
+        return predef, vdef
+
     def generate_dofblock_partition(self, quadrature_rule: QuadratureRule):
         block_contributions = self.ir.integrand[quadrature_rule]["block_contributions"]
         preparts = []
         quadparts = []
+        postparts = []
         blocks = [(blockmap, blockdata)
                   for blockmap, contributions in sorted(block_contributions.items())
-                  for blockdata in contributions]
+                  for blockdata in contributions
+                  if not self.is_sum_factorized_block(quadrature_rule, blockdata)
+                  and not self.is_reference_tensor_block(blockdata)]
+        factorized_blocks = [blockdata
+                             for blockmap, contributions in sorted(block_contributions.items())
+                             for blockdata in contributions
+                             if self.is_sum_factorized_block(quadrature_rule, blockdata)]
 
         block_groups = collections.defaultdict(list)
 
         # Group loops by blockmap, in Vector elements each component has
-        # a different blockmap
+        # a different blockmap, and by the dofs of the columns of
+        # compressed argument tables
         for blockmap, blockdata in blocks:
             scalar_blockmap = []
             assert len(blockdata.ma_data) == len(blockmap)
@@ -554,11 +872,12 @@ class IntegralGenerator(object):
                 offset = blockdata.ma_data[i].tabledata.offset
                 b = tuple([(idx - offset) // bs for idx in b])
                 scalar_blockmap.append(b)
-            block_groups[tuple(scalar_blockmap)].append(blockdata)
+            dofs = tuple(self.argument_table_dofs(quadrature_rule, mad) for mad in blockdata.ma_data)
+            block_groups[(tuple(scalar_blockmap), dofs)].append(blockdata)
 
-        for blockmap in block_groups:
+        for (blockmap, _), blocklist in block_groups.items():
             block_preparts, block_quadparts = self.generate_block_parts(
-                quadrature_rule, blockmap, block_groups[blockmap])
+                quadrature_rule, blockmap, blocklist)
 
             # Add definitions
             preparts.extend(block_preparts)
@@ -566,7 +885,24 @@ class IntegralGenerator(object):
             # Add computations
             quadparts.extend(block_quadparts)
 
-        return preparts, quadparts
+        if factorized_blocks:
+            block_preparts, block_quadparts, postparts = self.generate_sum_factorized_block_parts(
+                quadrature_rule, factorized_blocks)
+            preparts.extend(block_preparts)
+            quadparts.extend(block_quadparts)
+
+        return preparts, quadparts, postparts
+
+    def argument_table_dofs(self, quadrature_rule, mad):
+        """Return the name of the map from the columns of a compressed argument table to dofs, and the restriction.
+
+        Returns None if the table is not compressed.
+        """
+        sparsity = self.backend.symbols.element_table_sparsity(mad.tabledata)
+        if sparsity is None:
+            return None
+        mt = self.ir.integrand[quadrature_rule]["modified_arguments"][mad.ma_index]
+        return sparsity.name, mt.restriction
 
     def get_arg_factors(self, blockdata, block_rank, quadrature_rule, iq, indices):
         arg_factors = []
@@ -593,6 +929,110 @@ class IntegralGenerator(object):
             arg_factors.append(arg_factor)
         return arg_factors
 
+    def generate_block_factor(self, quadrature_rule: QuadratureRule, blockdata: BlockDataT, quadparts: List[CNode]):
+        """Return the factor of a block in the current quadrature point, including the quadrature weight.
+
+        The factor is defined as a temporary variable in quadparts
+        unless it is a single value.
+        """
+        L = self.backend.language
+        iq = self.backend.symbols.quadrature_loop_index()
+
+        if len(blockdata.factor_indices_comp_indices) > 1:
+            raise RuntimeError("Code generation for non-scalar integrals unsupported")
+
+        # We have scalar integrand here, take just the factor index
+        factor_index = blockdata.factor_indices_comp_indices[0][0]
+
+        # Get factor expression
+        F = self.ir.integrand[quadrature_rule]["factorization"]
+
+        v = F.nodes[factor_index]['expression']
+        f = self.get_var(quadrature_rule, v)
+
+        # FIXME
+        # Quadrature weight was removed in representation, add it back now
+        if self.ir.integral_type in ufl.custom_integral_types:
+            weights = self.backend.symbols.custom_weights_table()
+            weight = weights[iq]
+        else:
+            weights = self.backend.symbols.weights_table(quadrature_rule)
+            weight = weights[iq]
+
+        # Define fw = f * weight
+        fw_rhs = L.float_product([f, weight])
+        if not isinstance(fw_rhs, L.Product):
+            fw = fw_rhs
+        else:
+            # Define and cache scalar temp variable
+            key = (quadrature_rule, factor_index, blockdata.all_factors_piecewise)
+            fw, defined = self.get_temp_symbol("fw", key)
+            if not defined:
+                scalar_type = self.backend.access.options["scalar_type"]
+                quadparts.append(L.VariableDecl(f"const {scalar_type}", fw, fw_rhs))
+
+        return fw
+
+    def generate_reference_tensor_parts(self, quadrature_rule: QuadratureRule):
+        """Generate code adding the blocks with piecewise constant factors to the element tensor.
+
+        The quadrature weights and argument tables of these blocks are
+        integrated into reference tensors in the representation, so
+        each block is its factor times a reference tensor. Blocks with
+        the same dofs are contracted in a single loop over the dofs,
+        outside the quadrature loops.
+        """
+        L = self.backend.language
+        block_contributions = self.ir.integrand[quadrature_rule]["block_contributions"]
+        F = self.ir.integrand[quadrature_rule]["factorization"]
+
+        # Products of factors and reference tensors grouped by the dofs
+        # of the arguments, and of the columns of compressed argument
+        # tables
+        terms = collections.defaultdict(list)
+        arguments: Dict[tuple, tuple] = {}
+        for blockmap, contributions in sorted(block_contributions.items()):
+            for blockdata in contributions:
+                if not self.is_reference_tensor_block(blockdata):
+                    continue
+                if len(blockdata.factor_indices_comp_indices) > 1:
+                    raise RuntimeError("Code generation for non-scalar integrals unsupported")
+                factor_index = blockdata.factor_indices_comp_indices[0][0]
+                f = self.get_var(quadrature_rule, F.nodes[factor_index]['expression'])
+                key = tuple((mad.tabledata.offset, mad.tabledata.block_size, len(dofmap),
+                             self.argument_table_dofs(quadrature_rule, mad))
+                            for mad, dofmap in zip(blockdata.ma_data, blockmap))
+                terms[key].append((f, blockdata.reference_tensor))
+                arguments.setdefault(key, blockdata.ma_data)
+
+        reference_tensors = self.ir.integrand[quadrature_rule]["reference_tensors"]
+        modified_arguments = self.ir.integrand[quadrature_rule]["modified_arguments"]
+
+        A = L.FlattenedArray(self.backend.symbols.element_tensor(), dims=self.ir.tensor_shape)
+        entity = self.backend.symbols.entity(self.ir.entitytype, None)
+        parts: List[CNode] = []
+        for key, products in terms.items():
+            indices = [self.backend.symbols.argument_loop_index(i) for i in range(len(key))]
+            dofs = [self.backend.symbols.element_table_dof(mad.tabledata, self.ir.entitytype,
+                                                           modified_arguments[mad.ma_index].restriction, index)
+                    for mad, index in zip(arguments[key], indices)]
+            A_indices = [offset + block_size * dof if num_dofs > 1 else offset + dof
+                         for (offset, block_size, num_dofs, _), dof in zip(key, dofs)]
+            rhs = []
+            for f, name in products:
+                # Reference tensors of uniform tables are stored for
+                # one entity
+                e = entity if reference_tensors[name].shape[0] > 1 else 0
+                rhs.append(L.float_product([f, L.Symbol(name)[[e] + indices]]))
+            rhs = L.Sum(rhs)
+            body: List[CNode] = [L.AssignAdd(A[A_indices], rhs)]
+            for i in reversed(range(len(key))):
+                body = [L.ForRange(indices[i], 0, reference_tensors[products[0][1]].shape[i + 1], body=body)]
+            parts += body
+
+        return L.commented_code_list(
+            parts, f"Contractions with reference tensors for quadrature rule {quadrature_rule.id()}")
+
     def generate_block_parts(self, quadrature_rule: QuadratureRule, blockmap: Tuple, blocklist: List[BlockDataT]):
         """Generate and return code parts for a given block.
 
@@ -611,10 +1051,15 @@ class IntegralGenerator(object):
         # RHS expressions grouped by LHS "dofmap"
         rhs_expressions = collections.defaultdict(list)
 
+        # The blocks share the columns of compressed argument tables,
+        # so the loops run over the columns of the first
         block_rank = len(blockmap)
-        blockdims = tuple(len(dofmap) for dofmap in blockmap)
+        blockdims = tuple(len(dofmap) if self.backend.symbols.element_table_sparsity(mad.tabledata) is None
+                          else self.backend.symbols.element_table_num_dofs(mad.tabledata)
+                          for dofmap, mad in zip(blockmap, blocklist[0].ma_data))
 
         iq = self.backend.symbols.quadrature_loop_index()
+        arguments = self.ir.integrand[quadrature_rule]["modified_arguments"]
 
         # Override dof index with quadrature loop index for arguments
         # with quadrature element, to index B like B[iq*num_dofs + iq]
@@ -629,38 +1074,7 @@ class IntegralGenerator(object):
             if "zeros" in ttypes:
                 raise RuntimeError("Not expecting zero arguments to be left in dofblock generation.")
 
-            if len(blockdata.factor_indices_comp_indices) > 1:
-                raise RuntimeError("Code generation for non-scalar integrals unsupported")
-
-            # We have scalar integrand here, take just the factor index
-            factor_index = blockdata.factor_indices_comp_indices[0][0]
-
-            # Get factor expression
-            F = self.ir.integrand[quadrature_rule]["factorization"]
-
-            v = F.nodes[factor_index]['expression']
-            f = self.get_var(quadrature_rule, v)
-
-            # FIXME
-            # Quadrature weight was removed in representation, add it back now
-            if self.ir.integral_type in ufl.custom_integral_types:
-                weights = self.backend.symbols.custom_weights_table()
-                weight = weights[iq]
-            else:
-                weights = self.backend.symbols.weights_table(quadrature_rule)
-                weight = weights[iq]
-
-            # Define fw = f * weight
-            fw_rhs = L.float_product([f, weight])
-            if not isinstance(fw_rhs, L.Product):
-                fw = fw_rhs
-            else:
-                # Define and cache scalar temp variable
-                key = (quadrature_rule, factor_index, blockdata.all_factors_piecewise)
-                fw, defined = self.get_temp_symbol("fw", key)
-                if not defined:
-                    scalar_type = self.backend.access.options["scalar_type"]
-                    quadparts.append(L.VariableDecl(f"const {scalar_type}", fw, fw_rhs))
+            fw = self.generate_block_factor(quadrature_rule, blockdata, quadparts)
 
             assert not blockdata.transposed, "Not handled yet"
             A_shape = self.ir.tensor_shape
@@ -675,8 +1089,10 @@ class IntegralGenerator(object):
 
             A_indices = []
             for i in range(block_rank):
-                offset = blockdata.ma_data[i].tabledata.offset
-                index = arg_indices[i]
+                td = blockdata.ma_data[i].tabledata
+                offset = td.offset
+                restriction = arguments[blockdata.ma_data[i].ma_index].restriction
+                index = self.backend.symbols.element_table_dof(td, self.ir.entitytype, restriction, arg_indices[i])
                 if len(blockmap[i]) == 1:
                     A_indices.append(index + offset)
                 else:
@@ -751,15 +1167,68 @@ class IntegralGenerator(object):
 
         return preparts, quadparts
 
+    def generate_sum_factorized_block_parts(self, quadrature_rule: QuadratureRule, blocklist: List[BlockDataT]):
+        """Generate code integrating blocks by sum factorisation.
+
+        The factors of the blocks are stored in each quadrature point,
+        summed over blocks with the same argument tables, and integrated
+        against the 1D factors of the argument tables after the
+        quadrature loop.
+
+        Returns parts occurring before, inside, and after the quadrature
+        loop.
+        """
+        L = self.backend.language
+        scalar_type = self.backend.access.options["scalar_type"]
+        sf = self.sum_factorization(quadrature_rule)
+        tdim = len(sf.shape)
+
+        preparts: List[CNode] = []
+        quadparts: List[CNode] = []
+        postparts: List[CNode] = []
+
+        # Factors grouped by the tables and dofs of the arguments
+        factors = collections.defaultdict(list)
+        for blockdata in blocklist:
+            fw = self.generate_block_factor(quadrature_rule, blockdata, quadparts)
+            key = tuple((mad.tabledata.name, mad.tabledata.offset, mad.tabledata.block_size)
+                        for mad in blockdata.ma_data)
+            factors[key].append(fw)
+
+        A = L.FlattenedArray(self.backend.symbols.element_tensor(), dims=self.ir.tensor_shape)
+        iq = self.backend.symbols.quadrature_loop_index()
+        points = [L.Symbol(f"{iq.name}{i}") for i in range(tdim)]
+        point = self.sum_factorization_point(quadrature_rule)
+        for key, fws in factors.items():
+            values = self.new_temp_symbol("fq")
+            preparts += [L.ArrayDecl(scalar_type, values, len(sf.points))]
+            quadparts += [L.Assign(values[point], L.Sum(fws))]
+
+            arguments = [sf.tables[name] for name, offset, block_size in key]
+            dofs = [[L.Symbol(f"{self.backend.symbols.argument_loop_index(r).name}{i}") for i in range(tdim)]
+                    for r in range(len(key))]
+
+            def update(value, indices):
+                A_indices = [offset + block_size * L.Symbol(tf.dofs)[index]
+                             for (name, offset, block_size), tf, index in zip(key, arguments, indices)]
+                return L.AssignAdd(A[A_indices], value)
+
+            postparts += sumfactorization.integrate(
+                L, scalar_type, values, sf.shape, [[L.Symbol(f) for f in tf.factors] for tf in arguments],
+                [sf.dofs[tf.dofs].shape for tf in arguments], update, points, dofs,
+                lambda: self.new_temp_symbol("sf"))
+
+        return preparts, quadparts, postparts
+
     def fuse_loops(self, definitions):
-        """Merge a sequence of loops with the same iteration space into a single loop.
+        """Merge a sequence of loops with the same iteration space into fewer loops.
 
         Loop fusion improves data locality, cache reuse and decreases
-        the loop control overhead.
-
-        NOTE: Loop fusion might increase the pressure on register
-        allocation. Ideally, we should define a cost function to
-        determine how many loops should fuse at a time.
+        the loop control overhead, but increases the pressure on
+        register allocation. The loops are fused into groups whose
+        estimated register use stays within the loop_fusion_registers
+        option, and loops above it are split, see
+        ffcx.codegeneration.loopfusion.
 
         """
         L = self.backend.language
@@ -774,9 +1243,11 @@ class IntegralGenerator(object):
                     pre_loop += [d]
         fused = []
 
+        max_registers = self.ir.options["loop_fusion_registers"]
         for info, body in loops.items():
             index, begin, end = info
-            fused += [L.ForRange(index, begin, end, body)]
+            for group in loopfusion.fusion_groups(body, index, max_registers):
+                fused += [L.ForRange(index, begin, end, group)]
 
         code = []
         code += pre_loop
@@ -19,23 +19,93 @@ void tabulate_tensor_{factory_name}({scalar_type}*  A,
 {{
 {tabulate_tensor}
 }}
-
+{interleaved}
 {enabled_coefficients_init}
 
 ufcx_integral {factory_name} =
 {{
   .enabled_coefficients = {enabled_coefficients},
   .tabulate_tensor_{np_scalar_type} = tabulate_tensor_{factory_name},
-  .needs_facet_permutations = {needs_facet_permutations},
+{interleaved_fields}  .needs_facet_permutations = {needs_facet_permutations},
   .coordinate_element = {coordinate_element},
 }};
 
 // End of code for integral {factory_name}
 """
 
+interleaved = """
+// Tabulate {cell_batch_size} cells with interleaved data, see
+// ufcx_tabulate_tensor_interleaved_{np_scalar_type}
+static void tabulate_tensor_cells_{factory_name}({scalar_type}* restrict A,
+                                               const {scalar_type}* restrict w,
+                                               const {scalar_type}* restrict c,
+                                               const {geom_type}* restrict coordinate_dofs,
+                                               const int* restrict entity_local_index,
+                                               const uint8_t* restrict quadrature_permutation)
+{{
+{tabulate_tensor_cells}
+}}
+
+void tabulate_tensor_interleaved_{factory_name}({scalar_type}* restrict A,
+                                                const {scalar_type}* restrict w,
+                                                const {scalar_type}* restrict c,
+                                                const {geom_type}* restrict coordinate_dofs,
+                                                const int* restrict entity_local_index,
+                                                const uint8_t* restrict quadrature_permutation,
+                                                int num_cells)
+{{
+  const int num_blocks = num_cells / {cell_batch_size};
+  for (int b = 0; b < num_blocks; ++b)
+  {{
+    tabulate_tensor_cells_{factory_name}(
+        A + b * {cell_batch_size} * {tensor_size}, w + b * {cell_batch_size} * {coefficients_size}, c,
+        coordinate_dofs + b * {cell_batch_size} * {coordinate_dofs_size},
+        entity_local_index ? entity_local_index + b * {cell_batch_size} * {num_entities} : NULL,
+        quadrature_permutation ? quadrature_permutation + b * {cell_batch_size} * {num_entities} : NULL);
+  }}
+
+  // Scalar fallback for the cells of the last, incomplete block, which
+  // are gathered from the interleaved data one by one
+  const int b = num_blocks;
+  {scalar_type} A_cell[{tensor_size}];
+  {scalar_type} w_cell[{coefficients_size} + 1];
+  {geom_type} coordinate_dofs_cell[{coordinate_dofs_size}];
+  int entity_local_index_cell[{num_entities}];
+  uint8_t quadrature_permutation_cell[{num_entities}];
+  for (int cell = 0; cell < num_cells - b * {cell_batch_size}; ++cell)
+  {{
+    for (int k = 0; k < {tensor_size}; ++k)
+      A_cell[k] = 0;
+    for (int k = 0; k < {coefficients_size}; ++k)
+      w_cell[k] = w[(b * {coefficients_size} + k) * {cell_batch_size} + cell];
+    for (int k = 0; k < {coordinate_dofs_size}; ++k)
+      coordinate_dofs_cell[k] = coordinate_dofs[(b * {coordinate_dofs_size} + k) * {cell_batch_size} + cell];
+    for (int k = 0; k < {num_entities}; ++k)
+    {{
+      if (entity_local_index)
+        entity_local_index_cell[k] = entity_local_index[(b * {num_entities} + k) * {cell_batch_size} + cell];
+      if (quadrature_permutation)
+        quadrature_permutation_cell[k]
+            = quadrature_permutation[(b * {num_entities} + k) * {cell_batch_size} + cell];
+    }}
+    tabulate_tensor_{factory_name}(A_cell, w_cell, c, coordinate_dofs_cell,
+                                   entity_local_index ? entity_local_index_cell : NULL,
+                                   quadrature_permutation ? quadrature_permutation_cell : NULL);
+    for (int k = 0; k < {tensor_size}; ++k)
+      A[(b * {tensor_size} + k) * {cell_batch_size} + cell] += A_cell[k];
+  }}
+}}
+"""
+
+interleaved_fields = """  .tabulate_tensor_interleaved_{np_scalar_type} = tabulate_tensor_interleaved_{factory_name},
+  .cell_batch_size = {cell_batch_size},
+"""
+
 factory_runtime = """
 // Code for runtime integral {factory_name}
 
+{runtime_tables}
+
 void tabulate_tensor_{factory_name}({scalar_type}* A,
                                     const {scalar_type}* w,
                                     const {scalar_type}* c,
@@ -50,15 +120,205 @@ void tabulate_tensor_{factory_name}({scalar_type}* A,
 {tabulate_tensor}
 }}
 
+void tabulate_tensor_batch_{factory_name}({scalar_type}* A,
+                                          const {scalar_type}* w,
+                                          const {scalar_type}* c,
+                                          const {geom_type}* coordinate_dofs,
+                                          const int* entity_local_index,
+                                          const uint8_t* quadrature_permutation,
+                                          int num_cells,
+                                          const int* quadrature_offsets,
+                                          const {scalar_type}* quadrature_points,
+                                          const {scalar_type}* quadrature_weights,
+                                          const {scalar_type}* quadrature_normals)
+{{
+  for (int cell = 0; cell < num_cells; ++cell)
+  {{
+    const int q0 = quadrature_offsets[cell];
+    tabulate_tensor_{factory_name}(
+        A + cell * {tensor_size}, w + cell * {coefficients_size}, c,
+        coordinate_dofs + cell * {coordinate_dofs_size},
+        entity_local_index ? entity_local_index + cell * {num_entities} : NULL,
+        quadrature_permutation ? quadrature_permutation + cell * {num_entities} : NULL,
+        quadrature_offsets[cell + 1] - q0, quadrature_points + q0 * {gdim},
+        quadrature_weights + q0, quadrature_normals ? quadrature_normals + q0 * {gdim} : NULL);
+  }}
+}}
+
 {enabled_coefficients_init}
 
 ufcx_integral {factory_name} =
 {{
   .enabled_coefficients = {enabled_coefficients},
   .tabulate_tensor_runtime_{np_scalar_type} = tabulate_tensor_{factory_name},
+  .tabulate_tensor_runtime_batch_{np_scalar_type} = tabulate_tensor_batch_{factory_name},
+  .needs_facet_permutations = {needs_facet_permutations},
+  .coordinate_element = {coordinate_element},
+}};
+
+// End of code for runtime integral {factory_name}
+"""
+
+factory_runtime_tables = """
+// Code for runtime integral {factory_name}
+
+{runtime_tables_init}
+
+void tabulate_tensor_{factory_name}({scalar_type}* A,
+                                    const {scalar_type}* w,
+                                    const {scalar_type}* c,
+                                    const {geom_type}* coordinate_dofs,
+                                    const int* entity_local_index,
+                                    const uint8_t* quadrature_permutation,
+                                    int num_quadrature_points,
+                                    const {scalar_type}* quadrature_points,
+                                    const {scalar_type}* quadrature_weights,
+                                    const {scalar_type}* quadrature_normals,
+                                    const {scalar_type}* const* tables)
+{{
+{tabulate_tensor}
+}}
+
+void tabulate_tensor_batch_{factory_name}({scalar_type}* A,
+                                          const {scalar_type}* w,
+                                          const {scalar_type}* c,
+                                          const {geom_type}* coordinate_dofs,
+                                          const int* entity_local_index,
+                                          const uint8_t* quadrature_permutation,
+                                          int num_cells,
+                                          const int* quadrature_offsets,
+                                          const {scalar_type}* quadrature_points,
+                                          const {scalar_type}* quadrature_weights,
+                                          const {scalar_type}* quadrature_normals,
+                                          const {scalar_type}* const* tables)
+{{
+  const {scalar_type}* cell_tables[{num_tables} + 1];
+  for (int cell = 0; cell < num_cells; ++cell)
+  {{
+    const int q0 = quadrature_offsets[cell];
+{cell_tables}
+    tabulate_tensor_{factory_name}(
+        A + cell * {tensor_size}, w + cell * {coefficients_size}, c,
+        coordinate_dofs + cell * {coordinate_dofs_size},
+        entity_local_index ? entity_local_index + cell * {num_entities} : NULL,
+        quadrature_permutation ? quadrature_permutation + cell * {num_entities} : NULL,
+        quadrature_offsets[cell + 1] - q0, quadrature_points + q0 * {gdim},
+        quadrature_weights + q0, quadrature_normals ? quadrature_normals + q0 * {gdim} : NULL,
+        cell_tables);
+  }}
+}}
+
+{enabled_coefficients_init}
+
+ufcx_integral {factory_name} =
+{{
+  .enabled_coefficients = {enabled_coefficients},
+  .tabulate_tensor_runtime_tables_{np_scalar_type} = tabulate_tensor_{factory_name},
+  .tabulate_tensor_runtime_tables_batch_{np_scalar_type} = tabulate_tensor_batch_{factory_name},
   .needs_facet_permutations = {needs_facet_permutations},
   .coordinate_element = {coordinate_element},
+  .num_runtime_tables = {num_tables},
+  .runtime_tables = {runtime_tables},
 }};
 
 // End of code for runtime integral {factory_name}
 """
+
+runtime_tables = """
+// Basis function tables for runtime integral {factory_name}, tabulated
+// at the quadrature points. All tables are stored in one buffer with
+// dimensions [tables][points][dofs], where the dofs dimension of each
+// table is padded to its stride and each table is aligned to
+// {alignment} bytes.
+static const int table_strides_{factory_name}[{num_tables}] = {{ {strides} }};
+
+static size_t table_offset_{factory_name}(int num_points, int t)
+{{
+  size_t offset = 0;
+  for (int s = 0; s < t; ++s)
+    offset += ((size_t)num_points * table_strides_{factory_name}[s] + {block} - 1) / {block} * {block};
+  return offset;
+}}
+
+// call_basix allocates FE[1][1][num_points][num_dofs] with malloc and
+// passes ownership to the caller
+static void tabulate_table_{factory_name}(double* table, int stride, int num_points, const double* points,
+                                         int num_dofs, int nd, int family, int cell_type, int degree,
+                                         int lattice_type, int gdim)
+{{
+  double**** FE;
+  call_basix(&FE, num_points, points, nd, family, cell_type, degree, lattice_type, gdim);
+  for (int p = 0; p < num_points; ++p)
+  {{
+    for (int d = 0; d < num_dofs; ++d)
+      table[p * stride + d] = FE[0][0][p][d];
+    for (int d = num_dofs; d < stride; ++d)
+      table[p * stride + d] = 0.0;
+    free(FE[0][0][p]);
+  }}
+  free(FE[0][0]);
+  free(FE[0]);
+  free(FE);
+}}
+
+static double* tabulate_tables_{factory_name}(int num_points, const double* points)
+{{
+  double* tables = aligned_alloc({alignment}, table_offset_{factory_name}(num_points, {num_tables}) * sizeof(double));
+{tabulate_tables}
+  return tables;
+}}
+"""
+
+runtime_table_cache = """
+// Thread-local cache of the basis function tables for runtime integral
+// {factory_name}, keyed on the quadrature points the tables are
+// tabulated at
+typedef struct
+{{
+  uint64_t key;
+  int num_points;
+  uint64_t last_used;
+  double* points;
+  double* tables;
+}} table_cache_{factory_name}_t;
+
+static _Thread_local table_cache_{factory_name}_t table_cache_{factory_name}[{cache_size}];
+static _Thread_local uint64_t table_cache_clock_{factory_name} = 0;
+
+static const double* lookup_tables_{factory_name}(int num_points, const double* points)
+{{
+  const size_t num_bytes = (size_t)num_points * {gdim} * sizeof(double);
+
+  // FNV-1a hash of the points, seeded with a hash of the table layout
+  uint64_t key = {seed}ULL;
+  const unsigned char* bytes = (const unsigned char*)points;
+  for (size_t i = 0; i < num_bytes; ++i)
+    key = (key ^ bytes[i]) * 1099511628211ULL;
+
+  // Look up the points, keeping track of the least recently used entry
+  table_cache_{factory_name}_t* cache = table_cache_{factory_name};
+  table_cache_{factory_name}_t* entry = &cache[0];
+  for (int i = 0; i < {cache_size}; ++i)
+  {{
+    if (cache[i].points && cache[i].key == key && cache[i].num_points == num_points
+        && memcmp(cache[i].points, points, num_bytes) == 0)
+    {{
+      cache[i].last_used = ++table_cache_clock_{factory_name};
+      return cache[i].tables;
+    }}
+    if (cache[i].last_used < entry->last_used)
+      entry = &cache[i];
+  }}
+
+  // Evict the least recently used entry and tabulate into it
+  free(entry->points);
+  free(entry->tables);
+  entry->key = key;
+  entry->num_points = num_points;
+  entry->last_used = ++table_cache_clock_{factory_name};
+  entry->points = malloc(num_bytes);
+  memcpy(entry->points, points, num_bytes);
+  entry->tables = tabulate_tables_{factory_name}(num_points, points);
+  return entry->tables;
+}}
+"""
@@ -0,0 +1,127 @@
+# Copyright (C) 2023 FEniCS Project
+#
+# This file is part of FFCx. (https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Interleaving of tabulate_tensor kernels over batches of cells.
+
+The body of a kernel for one cell is rewritten into the body of a
+kernel for a batch of W cells, whose arguments hold the data of the
+cells interleaved: value k of cell i is at k * W + i. Every local
+variable gets a trailing dimension of size W, and every statement
+computing a value is moved into a loop over the cells of the batch,
+innermost, where it is a unit-stride operation the C compiler
+vectorises. Loops over quadrature points and dofs, static tables and
+the constants are shared by the cells.
+"""
+
+import typing
+
+import numpy
+
+# Kernel arguments with data of each cell, interleaved over the cells
+interleaved_arguments = ("A", "w", "coordinate_dofs", "entity_local_index", "quadrature_permutation")
+
+
+def flatten_statements(statements):
+    """Return a list of the statements, with nested statement lists expanded."""
+    flat = []
+    for s in statements:
+        if hasattr(s, "statements"):
+            flat += flatten_statements(s.statements)
+        else:
+            flat.append(s)
+    return flat
+
+
+class CellInterleaver(object):
+    """Rewrites the body of a kernel for one cell to a kernel for a batch of cells."""
+
+    def __init__(self, language, width: int, index: str = "cell"):
+        self.L = language
+        self.width = width
+        self.cell = language.Symbol(index)
+
+        # Names of the local scalars and arrays, which are given a
+        # value per cell
+        self.scalars: typing.Set[str] = set()
+        self.arrays: typing.Set[str] = set()
+
+    def statements(self, statements):
+        """Interleave a list of statements, returning a list of statements."""
+        L = self.L
+        code = []
+        group = []
+
+        def flush():
+            # Loop over the cells for consecutive computations. Loops
+            # over few cells are kept rolled until the C compiler
+            # vectorises them, since vectorising a fully unrolled loop
+            # combines statements instead of cells.
+            if group:
+                code.append(L.Pragma("GCC unroll 1"))
+                code.append(L.ForRange(self.cell, 0, self.width, body=list(group)))
+                group.clear()
+
+        for s in flatten_statements(statements):
+            # Declarations of local variables are moved before the
+            # pending loop over the cells, which does not use them
+            if isinstance(s, L.Statement):
+                group.append(L.Statement(self.expression(s.expr)))
+            elif isinstance(s, (L.VariableDecl, L.ArrayDecl)) and s.typename.startswith("static"):
+                code.append(s)
+            elif isinstance(s, L.VariableDecl):
+                self.scalars.add(s.symbol.name)
+                typename = s.typename.replace("const ", "")
+                code.append(L.ArrayDecl(typename, s.symbol, self.width))
+                if s.value is not None:
+                    group.append(L.Statement(L.Assign(s.symbol[self.cell], self.expression(s.value))))
+            elif isinstance(s, L.ArrayDecl):
+                if s.values is not None and numpy.count_nonzero(s.values) > 0:
+                    raise RuntimeError(f"Cannot interleave initialized local array {s.symbol}.")
+                self.arrays.add(s.symbol.name)
+                code.append(L.ArrayDecl(s.typename, s.symbol, s.sizes + (self.width, ), s.values))
+            else:
+                flush()
+                if isinstance(s, (L.Comment, L.Pragma, L.VerbatimStatement)):
+                    code.append(s)
+                elif isinstance(s, L.ForRange):
+                    code.append(L.ForRange(s.index, s.begin, s.end, body=self.statements([s.body]),
+                                           index_type=s.index_type))
+                elif isinstance(s, L.Scope):
+                    code.append(L.Scope(self.statements([s.body])))
+                else:
+                    raise RuntimeError(f"Cannot interleave statement of type {type(s).__name__}.")
+        flush()
+        return code
+
+    def expression(self, e):
+        """Interleave an expression, which is evaluated for the cell with index self.cell."""
+        L = self.L
+        if isinstance(e, L.Symbol):
+            if e.name in self.scalars:
+                return e[self.cell]
+            if e.name in self.arrays or e.name in interleaved_arguments:
+                raise RuntimeError(f"Cannot interleave use of array {e.name} as a pointer.")
+            return e
+        elif isinstance(e, L.ArrayAccess):
+            indices = [self.expression(i) for i in e.indices]
+            if e.array.name in self.arrays:
+                return L.ArrayAccess(e.array, indices + [self.cell])
+            elif e.array.name in interleaved_arguments:
+                index, = indices
+                return L.ArrayAccess(e.array, index * self.width + self.cell)
+            return L.ArrayAccess(e.array, indices)
+        elif isinstance(e, L.CExprTerminal):
+            return e
+        elif isinstance(e, L.BinOp):
+            return type(e)(self.expression(e.lhs), self.expression(e.rhs))
+        elif isinstance(e, L.NaryOp):
+            return type(e)([self.expression(arg) for arg in e.args])
+        elif isinstance(e, L.UnaryOp):
+            return type(e)(self.expression(e.arg))
+        elif isinstance(e, L.Conditional):
+            return L.Conditional(self.expression(e.condition), self.expression(e.true), self.expression(e.false))
+        elif isinstance(e, L.Call):
+            return L.Call(e.function, [self.expression(arg) for arg in e.arguments])
+        raise RuntimeError(f"Cannot interleave expression of type {type(e).__name__}.")
@@ -4,119 +4,587 @@
 #
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 
+import collections
+import concurrent.futures
+import errno
+import functools
 import importlib
 import io
 import logging
 import os
 import re
+import shlex
+import shutil
+import socket
+import struct
+import subprocess
 import sysconfig
 import tempfile
+import threading
 import time
+import types
+import typing
 from contextlib import redirect_stdout
 from pathlib import Path
 
 import cffi
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # type: ignore[assignment]
+
 import ffcx
-import ffcx.naming
+from ffcx import instrumentation
 
 logger = logging.getLogger("ffcx")
 
-# Get declarations directly from ufcx.h
-file_dir = os.path.dirname(os.path.abspath(__file__))
-with open(file_dir + "/ufcx.h", "r") as f:
-    ufcx_h = ''.join(f.readlines())
 
-header = ufcx_h.split("<HEADER_DECL>")[1].split("</HEADER_DECL>")[0].strip(" /\n")
-header = header.replace("{", "{{").replace("}", "}}")
-UFC_HEADER_DECL = header + "\n"
+@functools.lru_cache(maxsize=None)
+def _ufcx_declarations():
+    """Return the declarations of ufcx.h for cffi by name, which are read from ufcx.h on first use."""
+    file_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(file_dir + "/ufcx.h", "r") as f:
+        ufcx_h = f.read()
+
+    def find(pattern):
+        return '\n'.join(re.findall(pattern, ufcx_h, re.DOTALL))
+
+    header = ufcx_h.split("<HEADER_DECL>")[1].split("</HEADER_DECL>")[0].strip(" /\n")
+    header = header.replace("{", "{{").replace("}", "}}")
+
+    integral_decl = ""
+    for kernel in ("float32", "float64", "complex64", "complex128", "longdouble", "runtime_float64",
+                   "runtime_batch_float64", "runtime_tables_float64", "runtime_tables_batch_float64",
+                   "interleaved_float32", "interleaved_float64"):
+        integral_decl += find(rf'typedef void ?\(ufcx_tabulate_tensor_{kernel}\).*?\);')
+    integral_decl += find('typedef struct ufcx_runtime_table.*?ufcx_runtime_table;')
+    integral_decl += find('typedef struct ufcx_integral.*?ufcx_integral;')
+
+    return {"UFC_HEADER_DECL": header + "\n",
+            "UFC_ELEMENT_DECL": find('typedef struct ufcx_finite_element.*?ufcx_finite_element;'),
+            "UFC_DOFMAP_DECL": find('typedef struct ufcx_dofmap.*?ufcx_dofmap;'),
+            "UFC_FORM_DECL": find('typedef struct ufcx_form.*?ufcx_form;'),
+            "UFC_INTEGRAL_DECL": integral_decl,
+            "UFC_EXPRESSION_DECL": find('typedef struct ufcx_expression.*?ufcx_expression;')}
+
+
+def __getattr__(name):
+    # The UFC_*_DECL declarations are built on first use
+    declarations = _ufcx_declarations()
+    if name in declarations:
+        return declarations[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Modules loaded in this process, by module name and cache directory.
+# The module name includes the signatures of the compiled objects, the
+# options and the compilation inputs.
+_module_registry: typing.OrderedDict = collections.OrderedDict()
+_module_registry_lock = threading.Lock()
+module_registry_size = 128
+
+
+def clear_module_registry(module_name=None):
+    """Remove a module, or all modules, from the registry of loaded modules.
+
+    The next compile of its objects loads the module again from the
+    cache directory, or compiles it if it is not cached.
+
+    Parameters
+    ----------
+    module_name
+        Name of the module to remove, e.g. ``module.__name__`` of a
+        module returned by a compile function. All modules are removed
+        if None.
+
+    """
+    with _module_registry_lock:
+        if module_name is None:
+            _module_registry.clear()
+        else:
+            for key in [key for key in _module_registry if key[0] == module_name]:
+                del _module_registry[key]
+
+
+def _registry_key(module_name, cache_dir):
+    return (module_name, None if cache_dir is None else str(Path(cache_dir).absolute()))
 
-UFC_ELEMENT_DECL = '\n'.join(re.findall('typedef struct ufcx_finite_element.*?ufcx_finite_element;', ufcx_h, re.DOTALL))
-UFC_DOFMAP_DECL = '\n'.join(re.findall('typedef struct ufcx_dofmap.*?ufcx_dofmap;', ufcx_h, re.DOTALL))
-UFC_FORM_DECL = '\n'.join(re.findall('typedef struct ufcx_form.*?ufcx_form;', ufcx_h, re.DOTALL))
 
-UFC_INTEGRAL_DECL = '\n'.join(re.findall(r'typedef void ?\(ufcx_tabulate_tensor_float32\).*?\);', ufcx_h, re.DOTALL))
-UFC_INTEGRAL_DECL += '\n'.join(re.findall(r'typedef void ?\(ufcx_tabulate_tensor_float64\).*?\);', ufcx_h, re.DOTALL))
-UFC_INTEGRAL_DECL += '\n'.join(re.findall(r'typedef void ?\(ufcx_tabulate_tensor_complex64\).*?\);', ufcx_h, re.DOTALL))
-UFC_INTEGRAL_DECL += '\n'.join(re.findall(r'typedef void ?\(ufcx_tabulate_tensor_complex128\).*?\);',
-                               ufcx_h, re.DOTALL))
-UFC_INTEGRAL_DECL += '\n'.join(re.findall(r'typedef void ?\(ufcx_tabulate_tensor_longdouble\).*?\);',
-                               ufcx_h, re.DOTALL))
-UFC_INTEGRAL_DECL += '\n'.join(re.findall(r'typedef void ?\(ufcx_tabulate_tensor_runtime_float64\).*?\);',
-                               ufcx_h, re.DOTALL))
+def _lookup_module(key):
+    """Return the compiled objects and module of a loaded module, or None."""
+    with _module_registry_lock:
+        if key in _module_registry:
+            _module_registry.move_to_end(key)
+            return _module_registry[key]
+    return None
 
-UFC_INTEGRAL_DECL += '\n'.join(re.findall('typedef struct ufcx_integral.*?ufcx_integral;',
-                                          ufcx_h, re.DOTALL))
-UFC_EXPRESSION_DECL = '\n'.join(re.findall('typedef struct ufcx_expression.*?ufcx_expression;', ufcx_h, re.DOTALL))
+
+def _register_module(key, compiled_objects, compiled_module):
+    """Add a loaded module to the registry, keeping the module_registry_size most recently used."""
+    with _module_registry_lock:
+        _module_registry[key] = (compiled_objects, compiled_module)
+        while len(_module_registry) > module_registry_size:
+            _module_registry.popitem(last=False)
 
 
 def _compute_option_signature(options):
     """Return options signature (some options should not affect signature)."""
-    return str(sorted(options.items()))
+    return str(sorted((k, v) for k, v in options.items() if k not in ffcx.options.FFCX_CODE_INVARIANT_OPTIONS))
+
+
+class _ModuleLock:
+    """Exclusive lock on compiling a module, shared by all processes using a cache directory.
+
+    The lock is an fcntl lock on ``<module_name>.lock``. Waiters block in the
+    kernel and wake up as soon as the lock is released, and the lock is
+    released by the OS if its owner dies, so that a crashed compile is taken
+    over by the next waiter. Without fcntl locks in the OS or file system, the lock is
+    the exclusively created file ``<module_name>.lock.pid``, which is polled
+    and taken over once the process that created it is no longer alive.
+
+    Lock files may be removed by their holder, see clean_cache. Waiters
+    that locked a removed file lock the new one instead.
+    """
+
+    def __init__(self, cache_dir, module_name):
+        self.filename = cache_dir.joinpath(module_name + ".lock")
+        self.pid_filename = cache_dir.joinpath(module_name + ".lock.pid")
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._fd = None
+
+    def acquire(self, timeout):
+        """Acquire the lock, waiting at most timeout seconds."""
+        if fcntl is None:
+            self._acquire_pid_file(timeout)
+            return
+
+        deadline = time.monotonic() + timeout
+        while True:
+            fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o666)
+            try:
+                acquired = _flock(fd, max(deadline - time.monotonic(), 0.0))
+            except OSError as e:
+                os.close(fd)
+                if e.errno not in (errno.ENOLCK, errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL):
+                    raise
+                logger.info(f"File locks are not supported for {self.filename}, using {self.pid_filename}")
+                self._acquire_pid_file(timeout)
+                return
+            if not acquired:
+                raise TimeoutError(f"JIT compilation of {self.filename.stem} did not finish within {timeout} s."
+                                   " Increase the timeout option.")
+            if _is_same_file(fd, self.filename):
+                break
+            # The previous holder removed the lock file
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+        # Record the owner, for inspecting hanging compiles
+        os.ftruncate(fd, 0)
+        os.write(fd, self.owner.encode())
+        self._fd = fd
+
+    def release(self):
+        """Release the lock."""
+        if self._fd is None:
+            self.pid_filename.unlink()
+            return
+        os.ftruncate(self._fd, 0)
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+    def _acquire_pid_file(self, timeout):
+        deadline = time.monotonic() + timeout
+        delay = 1e-4
+        while True:
+            try:
+                fd = os.open(self.pid_filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+            except FileExistsError:
+                owner = _read_owner(self.pid_filename)
+                if owner is not None and not _owner_alive(owner):
+                    logger.info(f"Taking over {self.pid_filename} from dead process {owner}")
+                    _remove_stale(self.pid_filename, owner)
+                    continue
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"JIT compilation of {self.filename.stem} did not finish within {timeout} s."
+                                       f" Increase the timeout option, or remove {self.pid_filename} if it is held"
+                                       f" by a process on another host ({owner}).")
+                time.sleep(delay)
+                delay = min(2 * delay, 0.05)
+            else:
+                os.write(fd, self.owner.encode())
+                os.close(fd)
+                return
+
+
+def _flock(fd, timeout):
+    """Lock a file exclusively, waiting at most timeout seconds.
+
+    Returns False on timeout, in which case the file descriptor is closed,
+    possibly later by a thread still waiting for the lock.
+    """
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        if timeout <= 0:
+            os.close(fd)
+            return False
+
+    # Wait in a thread blocked in the kernel until the lock is released. A
+    # thread still waiting after the timeout releases the lock once it gets it.
+    state = {"acquired": False, "abandoned": False, "error": None}
+    condition = threading.Condition()
+
+    def wait():
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        except OSError as e:
+            with condition:
+                state["error"] = e
+                condition.notify()
+            return
+        with condition:
+            if state["abandoned"]:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+            else:
+                state["acquired"] = True
+                condition.notify()
+
+    threading.Thread(target=wait, daemon=True).start()
+    with condition:
+        condition.wait_for(lambda: state["acquired"] or state["error"] is not None, timeout)
+        if state["error"] is not None:
+            raise state["error"]
+        if not state["acquired"]:
+            # The waiting thread now owns, and closes, the file descriptor
+            state["abandoned"] = True
+        return state["acquired"]
+
+
+def _is_same_file(fd, filename):
+    """Check if a file descriptor refers to the file with the given name."""
+    try:
+        st = os.stat(filename)
+    except FileNotFoundError:
+        return False
+    fst = os.fstat(fd)
+    return (st.st_dev, st.st_ino) == (fst.st_dev, fst.st_ino)
+
+
+def _read_owner(filename):
+    try:
+        return filename.read_text() or None
+    except FileNotFoundError:
+        return None
+
+
+def _owner_alive(owner):
+    """Check if the process that wrote owner is alive. Processes on other hosts are assumed alive."""
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _remove_stale(filename, owner):
+    """Remove a lock file of a dead owner, unless another waiter took it over first."""
+    stale = filename.with_name(f"{filename.name}.{os.getpid()}.stale")
+    try:
+        os.rename(filename, stale)
+    except FileNotFoundError:
+        return
+    if stale.read_text() != owner:
+        # A new owner created the file after we read it, put it back
+        try:
+            os.link(stale, filename)
+        except FileExistsError:
+            pass
+    stale.unlink()
 
 
 def get_cached_module(module_name, object_names, cache_dir, timeout):
-    """Look for an existing C file and wait for compilation, or if it does not exist, create it."""
+    """Load a compiled module from the cache, waiting for a compile of it in progress.
+
+    Returns
+    -------
+    The compiled objects and the module if the module is in the cache.
+    Otherwise None, None and the caller compiles the module.
+
+    """
+    compiled_objects, compiled_module, lock = _get_cached_module(module_name, object_names, cache_dir, timeout)
+    if lock is not None:
+        lock.release()
+    return compiled_objects, compiled_module
+
+
+def _get_cached_module(module_name, object_names, cache_dir, timeout, decl=None):
+    """Load a compiled module from the cache, or acquire the lock on compiling it.
+
+    The declarations decl of the objects are needed to load modules
+    built by the native backend.
+
+    Returns
+    -------
+    The compiled objects, the module and None if the module is in the
+    cache. Otherwise None, None and the held module lock, which the caller
+    releases after compiling the module and creating its ready file.
+
+    """
     cache_dir = Path(cache_dir)
-    c_filename = cache_dir.joinpath(module_name).with_suffix(".c")
-    ready_name = c_filename.with_suffix(".c.cached")
+    ready_name = cache_dir.joinpath(module_name + ".c.cached")
 
     # Ensure cache dir exists
     cache_dir.mkdir(exist_ok=True, parents=True)
 
+    if not ready_name.exists():
+        lock = _ModuleLock(cache_dir, module_name)
+        lock.acquire(timeout)
+        if not ready_name.exists():
+            # Either no one compiled the module yet, or its compile failed
+            # or died. In any case, it is compiled here.
+            _count(cache_dir, "misses")
+            return None, None, lock
+        lock.release()
+
+    logger.info("Cached module already exists: " + str(ready_name))
+    compiled_objects, compiled_module = _load_objects(cache_dir, module_name, object_names, decl)
+
+    # The modification time of the ready file is the last use of the module
+    _count(cache_dir, "hits")
+    try:
+        os.utime(ready_name)
+    except OSError:
+        pass
+    return compiled_objects, compiled_module, None
+
+
+# Files of a cached module start with its name
+_cached_module_re = re.compile(r"^(libffcx_(?:elements|forms|expressions)_[0-9a-f]+)")
+
+# Suffixes of the lock files of a module, see _ModuleLock
+_lock_suffixes = (".lock", ".lock.pid")
+
+
+class CacheEntry(typing.NamedTuple):
+    """A module in a JIT cache directory."""
+
+    module_name: str
+    size: int
+    last_used: float
+    state: str  # "ready", "failed", "incomplete" or "orphaned" (lock files only)
+    files: typing.List[str]
+
+
+class CacheInfo(typing.NamedTuple):
+    """Usage of a JIT cache directory."""
+
+    size: int
+    entries: typing.List[CacheEntry]
+    hits: int
+    misses: int
+
+
+# Cache hits and misses are counted in a file of two 64 bit integers,
+# updated under a lock. Counting waits at most this long for the lock.
+_counts_struct = struct.Struct("<qq")
+_counts_timeout = 1.0
+
+
+def _count(cache_dir, event):
+    """Count a cache hit or miss in the counts file of a cache directory."""
+    instrumentation.count(f"jit_cache_{event}")
+    lock = _ModuleLock(cache_dir, "ffcx-cache")
+    try:
+        lock.acquire(_counts_timeout)
+    except (TimeoutError, OSError):
+        return
+    try:
+        counts = list(_counts(cache_dir))
+        counts[("hits", "misses").index(event)] += 1
+        fd = os.open(cache_dir.joinpath("ffcx-cache.counts"), os.O_WRONLY | os.O_CREAT, 0o666)
+        try:
+            os.pwrite(fd, _counts_struct.pack(*counts), 0)
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
+    finally:
+        lock.release()
+
+
+def _counts(cache_dir):
+    """Return the numbers of cache hits and misses of a cache directory."""
+    try:
+        data = cache_dir.joinpath("ffcx-cache.counts").read_bytes()
+    except FileNotFoundError:
+        return 0, 0
+    if len(data) != _counts_struct.size:
+        return 0, 0
+    return _counts_struct.unpack(data)
+
+
+def _cache_entries(cache_dir):
+    files = collections.defaultdict(list)
+    with os.scandir(cache_dir) as it:
+        for f in it:
+            match = _cached_module_re.match(f.name)
+            if match and f.is_file():
+                files[match[1]].append(f)
+
+    entries = []
+    for module_name, module_files in files.items():
+        names = [f.name for f in module_files]
+        stats = [f.stat() for f in module_files]
+        if module_name + ".c.cached" in names:
+            state = "ready"
+            last_used = cache_dir.joinpath(module_name + ".c.cached").stat().st_mtime
+        elif all(name.endswith(_lock_suffixes) for name in names):
+            state = "orphaned"
+            last_used = max(s.st_mtime for s in stats)
+        else:
+            state = "failed" if module_name + ".c.failed" in names else "incomplete"
+            last_used = max(s.st_mtime for s in stats)
+        entries.append(CacheEntry(module_name, sum(s.st_size for s in stats), last_used, state, names))
+    return entries
+
+
+def cache_info(cache_dir) -> CacheInfo:
+    """Return the size, entries and hit and miss counts of a JIT cache directory.
+
+    Entries are sorted by decreasing size. Hits and misses are counted
+    by all processes using the directory.
+
+    """
+    cache_dir = Path(cache_dir)
+    entries = sorted(_cache_entries(cache_dir), key=lambda e: e.size, reverse=True)
+    hits, misses = _counts(cache_dir)
+    return CacheInfo(size=sum(e.size for e in entries), entries=entries,
+                     hits=hits, misses=misses)
+
+
+def _evict(cache_dir, entry):
+    """Remove the files of a cache entry, unless it is being compiled. Return True if removed."""
+    lock = _ModuleLock(cache_dir, entry.module_name)
     try:
-        # Create C file with exclusive access
-        open(c_filename, "x")
-        return None, None
-    except FileExistsError:
-        logger.info("Cached C file already exists: " + str(c_filename))
-        finder = importlib.machinery.FileFinder(
-            str(cache_dir), (importlib.machinery.ExtensionFileLoader, importlib.machinery.EXTENSION_SUFFIXES))
-        finder.invalidate_caches()
-
-        # Now, wait for ready
-        for i in range(timeout):
-            if os.path.exists(ready_name):
-                spec = finder.find_spec(module_name)
-                if spec is None:
-                    raise ModuleNotFoundError("Unable to find JIT module.")
-                compiled_module = importlib.util.module_from_spec(spec)
-                spec.loader.exec_module(compiled_module)
-
-                compiled_objects = [getattr(compiled_module.lib, name) for name in object_names]
-                return compiled_objects, compiled_module
-
-            logger.info(f"Waiting for {ready_name} to appear.")
-            time.sleep(1)
-        raise TimeoutError(f"""JIT compilation timed out, probably due to a failed previous compile.
-        Try cleaning cache (e.g. remove {c_filename}) or increase timeout option.""")
-
-
-def _compilation_signature(cffi_extra_compile_args=None, cffi_debug=None):
+        lock.acquire(0)
+    except TimeoutError:
+        return False
+    try:
+        # Remove the ready file first, such that the module is no longer
+        # considered cached
+        files = sorted(entry.files, key=lambda name: not name.endswith(".c.cached"))
+        for name in files:
+            if not name.endswith(_lock_suffixes):
+                try:
+                    cache_dir.joinpath(name).unlink()
+                except FileNotFoundError:
+                    pass
+
+        # Remove the lock files once no files of the module are left.
+        # Waiters on the removed lock file lock a new one, see
+        # _ModuleLock. The pid file of a dead owner is taken over by
+        # acquire, and removed by release.
+        left = [f.name for f in cache_dir.glob(entry.module_name + "*")
+                if _cached_module_re.match(f.name)[1] == entry.module_name and not f.name.endswith(_lock_suffixes)]
+        if not left and lock._fd is not None:
+            try:
+                lock.filename.unlink()
+            except FileNotFoundError:
+                pass
+            owner = _read_owner(lock.pid_filename)
+            if owner is not None and not _owner_alive(owner):
+                _remove_stale(lock.pid_filename, owner)
+    finally:
+        lock.release()
+    return True
+
+
+def clean_cache(cache_dir, max_size=0, max_entries=0) -> typing.List[str]:
+    """Remove failed and incomplete modules, and least recently used modules over the limits.
+
+    Modules being compiled are not removed. Modules loaded in a process
+    remain usable after being removed. The lock files of removed modules,
+    and orphaned lock files of modules without other files, are removed
+    too, as are the hit and miss counters of older versions, which grew
+    with every lookup.
+
+    Parameters
+    ----------
+    cache_dir
+        JIT cache directory.
+    max_size
+        Maximum total size of the cached modules in bytes, 0 for no limit.
+    max_entries
+        Maximum number of cached modules, 0 for no limit.
+
+    Returns
+    -------
+    Names of the removed modules.
+
+    """
+    cache_dir = Path(cache_dir)
+    for event in ("hits", "misses"):
+        try:
+            cache_dir.joinpath(f"ffcx-cache.{event}").unlink()
+        except FileNotFoundError:
+            pass
+
+    entries = sorted(_cache_entries(cache_dir), key=lambda e: e.last_used)
+    removed = [e.module_name for e in entries if e.state != "ready" and _evict(cache_dir, e)]
+
+    ready = [e for e in entries if e.state == "ready"]
+    size = sum(e.size for e in ready)
+    num_ready = len(ready)
+    for entry in ready:
+        if (max_size <= 0 or size <= max_size) and (max_entries <= 0 or num_ready <= max_entries):
+            break
+        if _evict(cache_dir, entry):
+            logger.info(f"Evicting {entry.module_name} from JIT cache {cache_dir}")
+            removed.append(entry.module_name)
+            size -= entry.size
+            num_ready -= 1
+    return removed
+
+
+def _compilation_signature(cffi_extra_compile_args=None, cffi_debug=None, jit_backend="cffi"):
     """Compute the compilation-inputs part of the signature.
 
     Used to avoid cache conflicts across Python versions, architectures, installs.
 
     - SOABI includes platform, Python version, debug flags
     - CFLAGS includes prefixes, arch targets
+    - the backend, as modules of different backends are loaded differently
     """
     return (
         str(cffi_extra_compile_args)
         + str(cffi_debug)
         + sysconfig.get_config_var("CFLAGS")
         + sysconfig.get_config_var("SOABI")
+        + ("" if jit_backend == "cffi" else jit_backend)
     )
 
 
 def compile_elements(elements, options=None, cache_dir=None, timeout=10, cffi_extra_compile_args=None,
                      cffi_verbose=False, cffi_debug=None, cffi_libraries=None):
     """Compile a list of UFL elements and dofmaps into Python objects."""
+    import ffcx.naming
+
     p = ffcx.options.get_options(options)
 
     # Get a signature for these elements
     module_name = 'libffcx_elements_' + \
         ffcx.naming.compute_signature(elements, _compute_option_signature(p)
-                                      + _compilation_signature(cffi_extra_compile_args, cffi_debug))
+                                      + _compilation_signature(cffi_extra_compile_args, cffi_debug, p["jit_backend"]))
 
     names = []
     for e in elements:
@@ -125,41 +593,56 @@ def compile_elements(elements, options=None, cache_dir=None, timeout=10, cffi_ex
         name = ffcx.naming.dofmap_name(e, module_name)
         names.append(name)
 
+    registry_key = _registry_key(module_name, cache_dir)
+    registered = _lookup_module(registry_key)
+    if registered is not None:
+        return registered[0], registered[1], (None, None)
+
+    d = _ufcx_declarations()
+    decl = d["UFC_HEADER_DECL"].format(p["scalar_type"]) + d["UFC_ELEMENT_DECL"] + d["UFC_DOFMAP_DECL"]
+    element_template = "extern ufcx_finite_element {name};\n"
+    dofmap_template = "extern ufcx_dofmap {name};\n"
+    for i in range(len(elements)):
+        decl += element_template.format(name=names[i * 2])
+        decl += dofmap_template.format(name=names[i * 2 + 1])
+
+    lock = None
     if cache_dir is not None:
         cache_dir = Path(cache_dir)
-        obj, mod = get_cached_module(module_name, names, cache_dir, timeout)
+        obj, mod, lock = _get_cached_module(module_name, names, cache_dir, timeout, decl)
         if obj is not None:
             # Pair up elements with dofmaps
             obj = list(zip(obj[::2], obj[1::2]))
+            _register_module(registry_key, obj, mod)
             return obj, mod, (None, None)
     else:
         cache_dir = Path(tempfile.mkdtemp())
 
     try:
-        decl = UFC_HEADER_DECL.format(p["scalar_type"]) + UFC_ELEMENT_DECL + UFC_DOFMAP_DECL
-        element_template = "extern ufcx_finite_element {name};\n"
-        dofmap_template = "extern ufcx_dofmap {name};\n"
-        for i in range(len(elements)):
-            decl += element_template.format(name=names[i * 2])
-            decl += dofmap_template.format(name=names[i * 2 + 1])
-
         impl = _compile_objects(decl, elements, names, module_name, p, cache_dir,
                                 cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries)
     except Exception:
-        # remove c file so that it will not timeout next time
+        # Keep the C file of the failed compile for inspection
         c_filename = cache_dir.joinpath(module_name + ".c")
-        os.replace(c_filename, c_filename.with_suffix(".c.failed"))
+        if c_filename.exists():
+            os.replace(c_filename, c_filename.with_suffix(".c.failed"))
         raise
+    finally:
+        if lock is not None:
+            lock.release()
 
-    objects, module = _load_objects(cache_dir, module_name, names)
+    objects, module = _load_objects(cache_dir, module_name, names, decl)
     # Pair up elements with dofmaps
     objects = list(zip(objects[::2], objects[1::2]))
+    _register_module(registry_key, objects, module)
     return objects, module, (decl, impl)
 
 
 def compile_forms(forms, options=None, cache_dir=None, timeout=10, cffi_extra_compile_args=None,
                   cffi_verbose=False, cffi_debug=None, cffi_libraries=None):
     """Compile a list of UFL forms into UFC Python objects."""
+    import ffcx.naming
+
     p = ffcx.options.get_options(options)
 
     # FIXME put this in dolfinx_jit_options.json file (see jit.py in dolfinx). Where change to c++ compiler?
@@ -172,35 +655,48 @@ def compile_forms(forms, options=None, cache_dir=None, timeout=10, cffi_extra_co
     # Get a signature for these forms
     module_name = 'libffcx_forms_' + \
         ffcx.naming.compute_signature(forms, _compute_option_signature(p)
-                                      + _compilation_signature(cffi_extra_compile_args, cffi_debug))
+                                      + _compilation_signature(cffi_extra_compile_args, cffi_debug, p["jit_backend"]))
 
     form_names = [ffcx.naming.form_name(form, i, module_name) for i, form in enumerate(forms)]
 
+    registry_key = _registry_key(module_name, cache_dir)
+    registered = _lookup_module(registry_key)
+    if registered is not None:
+        return registered[0], registered[1], (None, None)
+
+    d = _ufcx_declarations()
+    decl = d["UFC_HEADER_DECL"].format(p["scalar_type"]) + d["UFC_ELEMENT_DECL"] + d["UFC_DOFMAP_DECL"] + \
+        d["UFC_INTEGRAL_DECL"] + d["UFC_FORM_DECL"]
+
+    form_template = "extern ufcx_form {name};\n"
+    for name in form_names:
+        decl += form_template.format(name=name)
+
+    lock = None
     if cache_dir is not None:
         cache_dir = Path(cache_dir)
-        obj, mod = get_cached_module(module_name, form_names, cache_dir, timeout)
+        obj, mod, lock = _get_cached_module(module_name, form_names, cache_dir, timeout, decl)
         if obj is not None:
+            _register_module(registry_key, obj, mod)
             return obj, mod, (None, None)
     else:
         cache_dir = Path(tempfile.mkdtemp())
 
     try:
-        decl = UFC_HEADER_DECL.format(p["scalar_type"]) + UFC_ELEMENT_DECL + UFC_DOFMAP_DECL + \
-            UFC_INTEGRAL_DECL + UFC_FORM_DECL
-
-        form_template = "extern ufcx_form {name};\n"
-        for name in form_names:
-            decl += form_template.format(name=name)
-
         impl = _compile_objects(decl, forms, form_names, module_name, p, cache_dir,
                                 cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries)
     except Exception:
-        # remove c file so that it will not timeout next time
+        # Keep the C file of the failed compile for inspection
         c_filename = cache_dir.joinpath(module_name + ".c")
-        os.replace(c_filename, c_filename.with_suffix(".c.failed"))
+        if c_filename.exists():
+            os.replace(c_filename, c_filename.with_suffix(".c.failed"))
         raise
+    finally:
+        if lock is not None:
+            lock.release()
 
-    obj, module = _load_objects(cache_dir, module_name, form_names)
+    obj, module = _load_objects(cache_dir, module_name, form_names, decl)
+    _register_module(registry_key, obj, module)
     return obj, module, (decl, impl)
 
 
@@ -214,41 +710,189 @@ def compile_expressions(expressions, options=None, cache_dir=None, timeout=10, c
         List of (UFL expression, evaluation points).
 
     """
+    import ffcx.naming
+
     p = ffcx.options.get_options(options)
 
     module_name = 'libffcx_expressions_' + \
         ffcx.naming.compute_signature(expressions, _compute_option_signature(p)
-                                      + _compilation_signature(cffi_extra_compile_args, cffi_debug))
+                                      + _compilation_signature(cffi_extra_compile_args, cffi_debug, p["jit_backend"]))
     expr_names = [ffcx.naming.expression_name(expression, module_name) for expression in expressions]
 
+    registry_key = _registry_key(module_name, cache_dir)
+    registered = _lookup_module(registry_key)
+    if registered is not None:
+        return registered[0], registered[1], (None, None)
+
+    d = _ufcx_declarations()
+    decl = d["UFC_HEADER_DECL"].format(p["scalar_type"]) + d["UFC_ELEMENT_DECL"] + d["UFC_DOFMAP_DECL"] + \
+        d["UFC_INTEGRAL_DECL"] + d["UFC_FORM_DECL"] + d["UFC_EXPRESSION_DECL"]
+
+    expression_template = "extern ufcx_expression {name};\n"
+    for name in expr_names:
+        decl += expression_template.format(name=name)
+
+    lock = None
     if cache_dir is not None:
         cache_dir = Path(cache_dir)
-        obj, mod = get_cached_module(module_name, expr_names, cache_dir, timeout)
+        obj, mod, lock = _get_cached_module(module_name, expr_names, cache_dir, timeout, decl)
         if obj is not None:
+            _register_module(registry_key, obj, mod)
             return obj, mod, (None, None)
     else:
         cache_dir = Path(tempfile.mkdtemp())
 
     try:
-        decl = UFC_HEADER_DECL.format(p["scalar_type"]) + UFC_ELEMENT_DECL + UFC_DOFMAP_DECL + \
-            UFC_INTEGRAL_DECL + UFC_FORM_DECL + UFC_EXPRESSION_DECL
-
-        expression_template = "extern ufcx_expression {name};\n"
-        for name in expr_names:
-            decl += expression_template.format(name=name)
-
         impl = _compile_objects(decl, expressions, expr_names, module_name, p, cache_dir,
                                 cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries)
     except Exception:
-        # remove c file so that it will not timeout next time
+        # Keep the C file of the failed compile for inspection
         c_filename = cache_dir.joinpath(module_name + ".c")
-        os.replace(c_filename, c_filename.with_suffix(".c.failed"))
+        if c_filename.exists():
+            os.replace(c_filename, c_filename.with_suffix(".c.failed"))
         raise
+    finally:
+        if lock is not None:
+            lock.release()
 
-    obj, module = _load_objects(cache_dir, module_name, expr_names)
+    obj, module = _load_objects(cache_dir, module_name, expr_names, decl)
+    _register_module(registry_key, obj, module)
     return obj, module, (decl, impl)
 
 
+# Process pool of the asynchronous compile functions, and thread pool
+# loading the modules they compiled, created on first use
+_async_executor = None
+_async_loader = None
+_async_executor_lock = threading.Lock()
+async_compile_processes = 0
+
+
+def shutdown_async_compile(wait=True):
+    """Shut down the processes and threads of the asynchronous compile functions.
+
+    They are started again by the next asynchronous compile.
+    """
+    global _async_executor, _async_loader
+    with _async_executor_lock:
+        executor, _async_executor = _async_executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
+    # Modules compiled by the processes are loaded by the threads
+    with _async_executor_lock:
+        loader, _async_loader = _async_loader, None
+    if loader is not None:
+        loader.shutdown(wait=wait)
+
+
+def _get_async_executor():
+    import multiprocessing
+
+    global _async_executor
+    with _async_executor_lock:
+        if _async_executor is None:
+            # Forking a process with threads, such as those of the pool
+            # itself, is unsafe
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            _async_executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=async_compile_processes or None, mp_context=context)
+        return _async_executor
+
+
+def _get_async_loader():
+    global _async_loader
+    with _async_executor_lock:
+        if _async_loader is None:
+            _async_loader = concurrent.futures.ThreadPoolExecutor(thread_name_prefix="ffcx-load")
+        return _async_loader
+
+
+def _compile_in_process(compile_function, ufl_objects, options, cache_dir, timeout, *cffi_args):
+    """Compile objects into the cache directory, and return the generated code."""
+    return compile_function(ufl_objects, options, cache_dir, timeout, *cffi_args)[2]
+
+
+def _compile_async(compile_function, ufl_objects, options, cache_dir, timeout, *cffi_args):
+    """Compile objects in the process pool, and load the compiled module in this process.
+
+    The module is loaded by a thread of the loader pool, as loading may
+    wait for the module lock, or compile the module again if it was
+    removed from the cache in the meantime. A temporary cache directory
+    is removed once the module is loaded.
+    """
+    temporary = cache_dir is None
+    if temporary:
+        cache_dir = tempfile.mkdtemp()
+    future = concurrent.futures.Future()
+    future.set_running_or_notify_cancel()
+
+    def load(compiled):
+        try:
+            code = compiled.result()
+            # The module is in the cache directory now, or compiled here
+            # if it was removed in the meantime
+            obj, module, _ = compile_function(ufl_objects, options, cache_dir, timeout, *cffi_args)
+            future.set_result((obj, module, code))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            if temporary:
+                shutil.rmtree(cache_dir, ignore_errors=True)
+
+    def submit_load(compiled):
+        # Called by the management thread of the process pool, or by
+        # this thread if the compile has finished, neither of which
+        # may block
+        try:
+            _get_async_loader().submit(load, compiled)
+        except BaseException as e:
+            future.set_exception(e)
+            if temporary:
+                shutil.rmtree(cache_dir, ignore_errors=True)
+
+    compiled = _get_async_executor().submit(_compile_in_process, compile_function, ufl_objects, options,
+                                            cache_dir, timeout, *cffi_args)
+    compiled.add_done_callback(submit_load)
+    return future
+
+
+def compile_elements_async(elements, options=None, cache_dir=None, timeout=10, cffi_extra_compile_args=None,
+                           cffi_verbose=False, cffi_debug=None, cffi_libraries=None) -> concurrent.futures.Future:
+    """Compile a list of UFL elements and dofmaps in a process pool.
+
+    Returns a future of the result of compile_elements. Elements are
+    generated and compiled by a process of the pool, into the cache
+    directory, and loaded in this process. Modules compiled concurrently
+    by several processes are compiled once, as by compile_elements.
+    """
+    return _compile_async(compile_elements, elements, options, cache_dir, timeout, cffi_extra_compile_args,
+                          cffi_verbose, cffi_debug, cffi_libraries)
+
+
+def compile_forms_async(forms, options=None, cache_dir=None, timeout=10, cffi_extra_compile_args=None,
+                        cffi_verbose=False, cffi_debug=None, cffi_libraries=None) -> concurrent.futures.Future:
+    """Compile a list of UFL forms in a process pool.
+
+    Returns a future of the result of compile_forms, see
+    compile_elements_async.
+    """
+    return _compile_async(compile_forms, forms, options, cache_dir, timeout, cffi_extra_compile_args,
+                          cffi_verbose, cffi_debug, cffi_libraries)
+
+
+def compile_expressions_async(expressions, options=None, cache_dir=None, timeout=10, cffi_extra_compile_args=None,
+                              cffi_verbose=False, cffi_debug=None,
+                              cffi_libraries=None) -> concurrent.futures.Future:
+    """Compile a list of UFL expressions and evaluation points in a process pool.
+
+    Returns a future of the result of compile_expressions, see
+    compile_elements_async.
+    """
+    return _compile_async(compile_expressions, expressions, options, cache_dir, timeout, cffi_extra_compile_args,
+                          cffi_verbose, cffi_debug, cffi_libraries)
+
+
 def _compile_objects(decl, ufl_objects, object_names, module_name, options, cache_dir,
                      cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries):
 
@@ -256,12 +900,17 @@ def _compile_objects(decl, ufl_objects, object_names, module_name, options, cach
 
     # JIT uses module_name as prefix, which is needed to make names of all struct/function
     # unique across modules
-    _, code_body = ffcx.compiler.compile_ufl_objects(ufl_objects, prefix=module_name, options=options)
-
-    ffibuilder = cffi.FFI()
-    ffibuilder.set_source(module_name, code_body, include_dirs=[ffcx.codegeneration.get_include_path()],
-                          extra_compile_args=cffi_extra_compile_args, libraries=cffi_libraries)
-    ffibuilder.cdef(decl)
+    include_dirs = [ffcx.codegeneration.get_include_path()]
+    extra_objects = []
+    num_processes = options["jit_compile_processes"] or os.cpu_count() or 1
+    if num_processes == 1:
+        _, code_body = ffcx.compiler.compile_ufl_objects(ufl_objects, prefix=module_name, options=options)
+        module_source = code_body
+    else:
+        code_h, code_units = ffcx.compiler.compile_ufl_objects_to_units(ufl_objects, prefix=module_name,
+                                                                        options=options)
+        code_body = "\n".join(code_units)
+        module_source = code_h.replace("#pragma once\n", "")
 
     c_filename = cache_dir.joinpath(module_name + ".c")
     ready_name = c_filename.with_suffix(".c.cached")
@@ -273,15 +922,29 @@ def _compile_objects(decl, ufl_objects, object_names, module_name, options, cach
     logger.info("Calling JIT C compiler")
     logger.info(79 * "#")
 
-    t0 = time.time()
-    f = io.StringIO()
-    with redirect_stdout(f):
-        ffibuilder.compile(tmpdir=cache_dir, verbose=True, debug=cffi_debug)
-    s = f.getvalue()
+    with instrumentation.span("c_compile", module=module_name, backend=options["jit_backend"]) as span:
+        if options["jit_backend"] == "native":
+            s = _build_native(code_units if num_processes > 1 else [code_body], module_name, cache_dir,
+                              include_dirs, cffi_extra_compile_args, cffi_debug, cffi_libraries, num_processes)
+        else:
+            if num_processes > 1:
+                extra_objects = _compile_units(code_units, module_name, cache_dir, include_dirs,
+                                               cffi_extra_compile_args, cffi_debug, num_processes)
+
+            ffibuilder = cffi.FFI()
+            ffibuilder.set_source(module_name, module_source, include_dirs=include_dirs,
+                                  extra_compile_args=cffi_extra_compile_args, libraries=cffi_libraries,
+                                  extra_objects=extra_objects)
+            ffibuilder.cdef(decl)
+
+            f = io.StringIO()
+            with redirect_stdout(f):
+                ffibuilder.compile(tmpdir=cache_dir, verbose=True, debug=cffi_debug)
+            s = f.getvalue()
     if (cffi_verbose):
         print(s)
 
-    logger.info("JIT C compiler finished in {:.4f}".format(time.time() - t0))
+    logger.info("JIT C compiler finished in {:.4f}".format(span.duration))
 
     # Create a "status ready" file. If this fails, it is an error,
     # because it should not exist yet.
@@ -290,10 +953,103 @@ def _compile_objects(decl, ufl_objects, object_names, module_name, options, cach
     fd.write(s)
     fd.close()
 
+    if options["jit_cache_size"] > 0 or options["jit_cache_entries"] > 0:
+        clean_cache(cache_dir, max_size=options["jit_cache_size"] * 2**20, max_entries=options["jit_cache_entries"])
+
     return code_body
 
 
-def _load_objects(cache_dir, module_name, object_names):
+def _c_compiler():
+    """Return the C compiler command and flags of Python extensions, as used by setuptools."""
+    cc = os.environ.get("CC", sysconfig.get_config_var("CC") or "cc")
+    cflags = (sysconfig.get_config_var("CFLAGS") or "") + " " + os.environ.get("CFLAGS", "") + " " \
+        + os.environ.get("CPPFLAGS", "")
+    return shlex.split(cc) + shlex.split(cflags) + shlex.split(sysconfig.get_config_var("CCSHARED") or "")
+
+
+def _run_compiler(command):
+    """Run a compiler command and return its output."""
+    logger.info(" ".join(command))
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    if result.returncode != 0:
+        raise cffi.VerificationError(f"CompileError: {' '.join(command)} failed:\n{result.stdout}")
+    return " ".join(command) + "\n" + result.stdout
+
+
+def _compile_units(code_units, module_name, cache_dir, include_dirs, extra_compile_args, debug, num_processes):
+    """Compile C files to object files concurrently, with the compiler and flags of Python extensions.
+
+    Returns the object file names.
+    """
+    flags = [f"-I{d}" for d in include_dirs] + (["-g"] if debug else []) + list(extra_compile_args or [])
+
+    def compile_unit(i):
+        c_filename = cache_dir.absolute().joinpath(f"{module_name}_{i}.c")
+        o_filename = c_filename.with_suffix(".o")
+        c_filename.write_text(code_units[i])
+        _run_compiler(_c_compiler() + flags + ["-c", str(c_filename), "-o", str(o_filename)])
+        return str(o_filename)
+
+    num_workers = min(num_processes, len(code_units))
+    logger.info(f"Compiling {len(code_units)} translation units in {num_workers} processes")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as pool:
+        return list(pool.map(compile_unit, range(len(code_units))))
+
+
+def _build_native(code_units, module_name, cache_dir, include_dirs, extra_compile_args, debug, libraries,
+                  num_processes):
+    """Build a shared library from C files by calling the C compiler, without setuptools.
+
+    Returns the compiler output.
+    """
+    library = cache_dir.absolute().joinpath(module_name + ".so")
+    tmp_library = library.with_suffix(f".{os.getpid()}.tmp")
+    link_flags = ["-shared", "-o", str(tmp_library)] + [f"-l{lib}" for lib in libraries or []]
+    if len(code_units) == 1:
+        c_filename = cache_dir.absolute().joinpath(module_name + ".c")
+        c_filename.write_text(code_units[0])
+        flags = [f"-I{d}" for d in include_dirs] + (["-g"] if debug else []) + list(extra_compile_args or [])
+        output = _run_compiler(_c_compiler() + flags + [str(c_filename)] + link_flags)
+    else:
+        objects = _compile_units(code_units, module_name, cache_dir, include_dirs, extra_compile_args, debug,
+                                 num_processes)
+        output = _run_compiler(_c_compiler() + objects + link_flags)
+
+    # Replace the library atomically, in case a module with the same name is loaded
+    os.replace(tmp_library, library)
+    return output
+
+
+@functools.lru_cache(maxsize=None)
+def _header_ffi(decl):
+    """Return an FFI with the UFCx declarations, which are parsed once."""
+    ffi = cffi.FFI()
+    ffi.cdef(decl)
+    return ffi
+
+
+def _load_native(library, module_name, object_names, decl):
+    """Load a library built by the native backend, in cffi ABI mode."""
+    # The declarations of the objects follow the UFCx declarations
+    header, extern, object_decl = decl.partition("extern ")
+    ffi = cffi.FFI()
+    ffi.include(_header_ffi(header))
+    ffi.cdef(extern + object_decl)
+    lib = ffi.dlopen(str(library))
+
+    compiled_module = types.ModuleType(module_name)
+    compiled_module.__file__ = str(library)
+    compiled_module.ffi = ffi
+    compiled_module.lib = lib
+    compiled_objects = [ffi.addressof(lib, name)[0] for name in object_names]
+    return compiled_objects, compiled_module
+
+
+def _load_objects(cache_dir, module_name, object_names, decl=None):
+
+    library = Path(cache_dir).joinpath(module_name + ".so")
+    if library.exists():
+        return _load_native(library, module_name, object_names, decl)
 
     # Create module finder that searches the compile path
     finder = importlib.machinery.FileFinder(
@@ -0,0 +1,189 @@
+# Copyright (C) 2023 FEniCS Project
+#
+# This file is part of FFCx. (https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Cost model for fusing loops with the same iteration space.
+
+Loops defining modified terminals, such as the evaluation of a
+coefficient in a quadrature point, are sums over the dofs with one
+accumulator each. Fusing them into a single loop shares the loop
+control, and loads of tables used by several of them, but each
+accumulator, and each value loaded for several statements, occupies a
+register for the whole loop body. Fusing too many spills registers.
+
+The statements of the loop bodies are grouped into fused loops whose
+estimated register use stays within a budget, preferring groups that
+share loads. Loop bodies above the budget are split (loop fission) if
+their statements are independent.
+"""
+
+import typing
+
+from ffcx.codegeneration.C import cnodes as L
+
+
+class LoopCost(typing.NamedTuple):
+    live: int  # number of accumulators, live across iterations
+    loads: int  # number of distinct array values loaded per iteration
+    shared_loads: int  # number of loaded values used by more than one statement
+    flops: int  # floating point operations per iteration
+
+    @property
+    def registers(self) -> int:
+        """Estimated number of registers used by the loop body."""
+        return self.live + self.shared_loads
+
+
+def flatten_body(body) -> typing.List[L.CStatement]:
+    """Return the statements of a loop body, with nested statement lists expanded."""
+    if isinstance(body, (list, tuple)):
+        return [s for b in body for s in flatten_body(b)]
+    if isinstance(body, L.StatementList):
+        return flatten_body(body.statements)
+    return [body]
+
+
+def _expressions(e):
+    """Iterate over an expression and its subexpressions."""
+    yield e
+    if isinstance(e, L.BinOp):
+        yield from _expressions(e.lhs)
+        yield from _expressions(e.rhs)
+    elif isinstance(e, L.NaryOp):
+        for arg in e.args:
+            yield from _expressions(arg)
+    elif isinstance(e, L.UnaryOp):
+        yield from _expressions(e.arg)
+    elif isinstance(e, L.ArrayAccess):
+        for i in e.indices:
+            yield from _expressions(i)
+    elif isinstance(e, L.Conditional):
+        yield from _expressions(e.condition)
+        yield from _expressions(e.true)
+        yield from _expressions(e.false)
+    elif isinstance(e, L.Call):
+        for arg in e.arguments:
+            yield from _expressions(arg)
+
+
+def _symbols(e) -> typing.Set[str]:
+    """Return the names of the symbols and arrays used in an expression."""
+    names = set()
+    for x in _expressions(e):
+        if isinstance(x, L.Symbol):
+            names.add(x.name)
+        elif isinstance(x, L.ArrayAccess):
+            names.add(x.array.name)
+    return names
+
+
+class StatementData(typing.NamedTuple):
+    accumulator: typing.Optional[str]  # value assigned to in every iteration, if any
+    writes: typing.Set[str]  # names of the symbols and arrays assigned to
+    reads: typing.Set[str]  # names of the symbols and arrays read
+    loads: typing.Set[str]  # array values read
+    flops: int
+
+
+def analyse_statement(statement: L.CStatement, index: L.Symbol) -> typing.Optional[StatementData]:
+    """Analyse a statement of the body of a loop over index.
+
+    Returns None for statements other than assignments, which are not
+    moved between loops.
+    """
+    if not isinstance(statement, L.Statement) or not isinstance(statement.expr, L.AssignOp):
+        return None
+    lhs, rhs = statement.expr.lhs, statement.expr.rhs
+    if isinstance(lhs, L.Symbol):
+        target = lhs.name
+        accumulator = lhs.ce_format()
+    elif isinstance(lhs, L.ArrayAccess):
+        target = lhs.array.name
+        # Stores to elements indexed by the loop index are streamed,
+        # others accumulate
+        accumulator = None if index.name in _symbols(lhs) else lhs.ce_format()
+    else:
+        return None
+    try:
+        flops = statement.flops()
+    except NotImplementedError:
+        flops = 0
+    loads = set(x.ce_format() for x in _expressions(rhs) if isinstance(x, L.ArrayAccess))
+    reads = _symbols(rhs)
+    if isinstance(lhs, L.ArrayAccess):
+        reads |= set().union(*(_symbols(i) for i in lhs.indices))
+    if not isinstance(statement.expr, L.Assign):
+        reads.add(target)
+    return StatementData(accumulator, {target}, reads, loads, flops)
+
+
+def loop_cost(statements: typing.Sequence[StatementData]) -> LoopCost:
+    """Estimate the cost of a loop body with the given statements."""
+    accumulators = set(s.accumulator for s in statements if s.accumulator is not None)
+    uses: typing.Dict[str, int] = {}
+    for s in statements:
+        for load in s.loads:
+            uses[load] = uses.get(load, 0) + 1
+    shared = sum(1 for n in uses.values() if n > 1)
+    return LoopCost(len(accumulators), len(uses), shared, sum(s.flops for s in statements))
+
+
+def split_body(body, index: L.Symbol):
+    """Split a loop body into units that can be moved to different loops.
+
+    Returns a list of units, each a pair of the statements and their
+    analysed data. A body is split into its statements if each is an
+    assignment that does not read values written by the others.
+    """
+    statements = flatten_body(body)
+    data: typing.List[StatementData] = []
+    for s in statements:
+        d = analyse_statement(s, index)
+        if d is not None:
+            data.append(d)
+    if len(statements) > 1 and len(data) == len(statements):
+        writes = [d.writes for d in data]
+        independent = all(not (d.reads & w) for i, d in enumerate(data) for j, w in enumerate(writes) if i != j)
+        if independent:
+            return [([s], [d]) for s, d in zip(statements, data)]
+    return [(statements, data)]
+
+
+def fusion_groups(bodies, index: L.Symbol, max_registers: int) -> typing.List[typing.List[L.CStatement]]:
+    """Group the loop bodies of a sequence of loops with the same iteration space into fused loop bodies.
+
+    Each unit of the bodies, see split_body, is added to the first
+    group sharing the most loads with it among the groups it fits into
+    within max_registers, or to a new group. Units reading or writing
+    values written or read by a group are kept in that group. With
+    max_registers 0, all bodies are fused into one loop.
+    """
+    if max_registers <= 0:
+        return [[s for body in bodies for s in flatten_body(body)]]
+
+    groups: typing.List[typing.Tuple[typing.List[L.CStatement], typing.List[StatementData]]] = []
+    for body in bodies:
+        for statements, data in split_body(body, index):
+            best = None
+            best_shared = -1
+            loads = set().union(*(d.loads for d in data))
+            reads = set().union(*(d.reads for d in data))
+            writes = set().union(*(d.writes for d in data))
+            for group in groups:
+                group_reads = set().union(*(d.reads for d in group[1]))
+                group_writes = set().union(*(d.writes for d in group[1]))
+                if reads & group_writes or writes & (group_reads | group_writes):
+                    best = group
+                    break
+                if loop_cost(group[1] + data).registers > max_registers:
+                    continue
+                shared = len(loads & set().union(*(d.loads for d in group[1])))
+                if shared > best_shared:
+                    best, best_shared = group, shared
+            if best is None:
+                groups.append((list(statements), list(data)))
+            else:
+                best[0].extend(statements)
+                best[1].extend(data)
+    return [statements for statements, data in groups]
@@ -0,0 +1,159 @@
+# Copyright (C) 2023 FEniCS Project
+#
+# This file is part of FFCx. (https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Sum factorised evaluation and integration with tensor product tables.
+
+With tables factorised into a 1D table of each direction, see
+ffcx.ir.sumfactorization, a coefficient is evaluated in all points of
+a grid, and values in all points of a grid are integrated against
+arguments, by contracting with the 1D table of one direction at a time.
+Each contraction is a loop nest storing to a temporary array, whose
+dimensions are points in the directions not yet contracted and dofs in
+the others, or the other way around.
+"""
+
+from typing import Callable, List, Sequence
+
+
+def flat_index(indices, shape):
+    """Return the row-major flattened index of a multi-index into an array of the given shape."""
+    index = indices[0]
+    for i, n in zip(indices[1:], shape[1:]):
+        index = index * n + i
+    return index
+
+
+def contraction(L, scalar_type: str, acc, output_indices, output_ranges, reduction_index, num_reduced: int,
+                summand, store):
+    """Loop nest over the output indices, summing summand over the reduction index and storing the sum."""
+    body = [L.VariableDecl(scalar_type, acc, 0.0),
+            L.ForRange(reduction_index, 0, num_reduced, body=[L.AssignAdd(acc, summand)]),
+            store]
+    for index, n in reversed(list(zip(output_indices, output_ranges))):
+        body = [L.ForRange(index, 0, n, body=body)]
+    return body
+
+
+def evaluate(L, scalar_type: str, values, shape: Sequence[int], factors, dofs_shape: Sequence[int],
+             dof_value: Callable, points, dofs, temporary: Callable) -> List:
+    """Evaluate a function in all points of a grid.
+
+    Parameters
+    ----------
+    values
+        Array to store the values in, in the flattened points of the grid.
+    shape
+        Number of points in each direction.
+    factors
+        1D table of each direction, with axes (point, dof).
+    dofs_shape
+        Number of 1D dofs in each direction.
+    dof_value
+        Returns the value of the dof at a product of 1D dofs, given the
+        index of each direction.
+    points, dofs
+        Loop indices over the points and 1D dofs of each direction.
+    temporary
+        Returns a new symbol for a temporary array.
+
+    Returns a list of statements.
+    """
+    tdim = len(shape)
+    acc = L.Symbol("acc")
+    code = []
+
+    # Contract the last direction first. State of each direction: True
+    # when indexed by points, False when indexed by dofs
+    state = [False] * tdim
+    previous = None
+    for axis in reversed(range(tdim)):
+        state[axis] = True
+        indices = [points[b] if state[b] else dofs[b] for b in range(tdim)]
+        ranges = [shape[b] if state[b] else dofs_shape[b] for b in range(tdim)]
+        input_indices = [dofs[axis] if b == axis else indices[b] for b in range(tdim)]
+        if previous is None:
+            value = dof_value(input_indices)
+        else:
+            value = previous[input_indices]
+
+        if axis == 0:
+            store = L.Assign(values[flat_index(points, shape)], acc)
+        else:
+            previous = temporary()
+            code += [L.ArrayDecl(scalar_type, previous, tuple(ranges))]
+            store = L.Assign(previous[indices], acc)
+
+        summand = factors[axis][points[axis], dofs[axis]] * value
+        code += contraction(L, scalar_type, acc, indices, ranges, dofs[axis], dofs_shape[axis], summand, store)
+    return code
+
+
+def integrate(L, scalar_type: str, values, shape: Sequence[int], factors, dofs_shape, update: Callable,
+              points, dofs, temporary: Callable) -> List:
+    """Integrate values in all points of a grid against one or two arguments.
+
+    Parameters
+    ----------
+    values
+        Array of the values in the flattened points of the grid,
+        including the quadrature weights.
+    shape
+        Number of points in each direction.
+    factors
+        1D table of each direction of each argument, with axes (point, dof).
+    dofs_shape
+        Number of 1D dofs in each direction of each argument.
+    update
+        Returns the statement adding a value to the element tensor, given
+        the value and the index of each direction of each argument.
+    points, dofs
+        Loop indices over the points, and 1D dofs of each direction of
+        each argument.
+    temporary
+        Returns a new symbol for a temporary array.
+
+    Returns a list of statements.
+    """
+    tdim = len(shape)
+    rank = len(factors)
+    acc = L.Symbol("acc")
+    code = []
+
+    # Contract the last direction first. State of each direction: True
+    # when indexed by the dofs of the arguments, False when indexed by
+    # points
+    state = [False] * tdim
+    previous = None
+    for axis in reversed(range(tdim)):
+        state[axis] = True
+        indices = []
+        ranges = []
+        input_indices = []
+        for b in range(tdim):
+            if state[b]:
+                indices += [dofs[r][b] for r in range(rank)]
+                ranges += [dofs_shape[r][b] for r in range(rank)]
+            else:
+                indices.append(points[b])
+                ranges.append(shape[b])
+            if b == axis or not state[b]:
+                input_indices.append(points[b])
+            else:
+                input_indices += [dofs[r][b] for r in range(rank)]
+        if previous is None:
+            value = values[flat_index(input_indices, shape)]
+        else:
+            value = previous[input_indices]
+
+        if axis == 0:
+            store = update(acc, [[dofs[r][b] for b in range(tdim)] for r in range(rank)])
+        else:
+            previous = temporary()
+            code += [L.ArrayDecl(scalar_type, previous, tuple(ranges))]
+            store = L.Assign(previous[indices], acc)
+
+        summand = L.float_product([factors[r][axis][points[axis], dofs[r][axis]] for r in range(rank)] + [value])
+        code += contraction(L, scalar_type, acc, indices, ranges, points[axis], shape[axis], summand, store)
+    return code
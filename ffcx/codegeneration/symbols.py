@@ -62,13 +62,15 @@ class FFCXBackendSymbols(object):
     """FFCx specific symbol definitions. Provides non-ufl symbols."""
 
     def __init__(self, language, coefficient_numbering, coefficient_offsets,
-                 original_constant_offsets):
+                 original_constant_offsets, has_runtime_qr=False, runtime_table_padlen=1):
         self.L = language
         self.S = self.L.Symbol
         self.coefficient_numbering = coefficient_numbering
         self.coefficient_offsets = coefficient_offsets
 
         self.original_constant_offsets = original_constant_offsets
+        self.has_runtime_qr = has_runtime_qr
+        self.runtime_table_padlen = runtime_table_padlen
 
     def element_tensor(self):
         """Symbol for the element tensor itself."""
@@ -80,12 +82,11 @@ class FFCXBackendSymbols(object):
             # Always 0 for cells (even with restriction)
             return self.L.LiteralInt(0)
         elif entitytype == "facet":
-            postfix = "[0]"
             if restriction == "-":
-                postfix = "[1]"
-            return self.S("entity_local_index" + postfix)
+                return self.S("entity_local_index")[1]
+            return self.S("entity_local_index")[0]
         elif entitytype == "vertex":
-            return self.S("entity_local_index[0]")
+            return self.S("entity_local_index")[0]
         else:
             logging.exception(f"Unknown entitytype {entitytype}")
 
@@ -186,7 +187,46 @@ class FFCXBackendSymbols(object):
     def named_table(self, name):
         return self.S(name)
 
+    def element_table_sparsity(self, tabledata):
+        """Return the dofs with nonzero values of an element table, or None if the table is dense."""
+        if self.has_runtime_qr:
+            # Tables tabulated at runtime quadrature points are not
+            # compressed
+            return None
+        return tabledata.sparsity
+
+    def element_table_num_dofs(self, tabledata):
+        """Return the number of columns of an element table in the generated code."""
+        sparsity = self.element_table_sparsity(tabledata)
+        if sparsity is None:
+            return tabledata.values.shape[3]
+        return sparsity.dofs.shape[1]
+
+    def element_table_dof(self, tabledata, entitytype, restriction, index):
+        """Return the dof of column index of an element table."""
+        sparsity = self.element_table_sparsity(tabledata)
+        if sparsity is None:
+            return index
+
+        if sparsity.begin is not None:
+            return index + sparsity.begin
+        if sparsity.dofs.shape[0] == 1:
+            entity = 0
+        else:
+            entity = self.entity(entitytype, restriction)
+        return self.named_table(sparsity.name)[entity][index]
+
     def element_table(self, tabledata, entitytype, restriction):
+        if self.has_runtime_qr:
+            # Tables tabulated at runtime quadrature points are stored
+            # contiguously with dimensions [points][padded dofs]
+            if tabledata.is_piecewise:
+                iq = 0
+            else:
+                iq = self.quadrature_loop_index()
+            stride = self.L.pad_dim(tabledata.values.shape[3], self.runtime_table_padlen)
+            return self.L.FlattenedArray(self.named_table(tabledata.name), strides=(stride, 1))[iq]
+
         entity = self.entity(entitytype, restriction)
 
         if tabledata.is_uniform:
@@ -329,6 +329,145 @@ extern "C"
       const double* restrict quadrature_weights,
       const double* restrict facet_normals);
 
+  /// Tabulate integral into tensor A for a batch of cells, each with
+  /// its own runtime quadrature rule
+  ///
+  /// The quadrature rule of cell i is given by the points, weights and
+  /// facet normals in the range quadrature_offsets[i] to
+  /// quadrature_offsets[i + 1] of the concatenated arrays
+  /// quadrature_points, quadrature_weights and facet_normals.
+  ///
+  /// The arrays A, w, coordinate_dofs, entity_local_index and
+  /// quadrature_permutation hold the data of all cells one after the
+  /// other, laid out per cell as in
+  /// ufcx_tabulate_tensor_runtime_float64. The constants c are shared
+  /// by all cells.
+  ///
+  /// @param[in] num_cells Number of cells in the batch
+  /// @param[in] quadrature_offsets Offsets into the quadrature arrays.
+  /// Dimensions: quadrature_offsets[num_cells + 1]
+  ///
+  /// @see ufcx_tabulate_tensor_runtime_float64
+  typedef void(ufcx_tabulate_tensor_runtime_batch_float64)(
+      double* restrict A,
+      const double* restrict w,
+      const double* restrict c,
+      const double* restrict coordinate_dofs,
+      const int* restrict entity_local_index,
+      const uint8_t* restrict quadrature_permutation,
+      int num_cells,
+      const int* restrict quadrature_offsets,
+      const double* restrict quadrature_points,
+      const double* restrict quadrature_weights,
+      const double* restrict facet_normals);
+
+
+  /// Tabulate integral into tensor A with runtime quadrature rule and
+  /// basis function tables tabulated at the quadrature points by the
+  /// caller
+  ///
+  /// @param[in] tables Basis function tables, as described by
+  /// ufcx_integral::runtime_tables. Dimensions:
+  /// tables[num_runtime_tables][num_quadrature_points][num_dofs]
+  ///
+  /// @see ufcx_tabulate_tensor_runtime_float64
+  typedef void(ufcx_tabulate_tensor_runtime_tables_float64)(
+      double* restrict A,
+      const double* restrict w,
+      const double* restrict c,
+      const double* restrict coordinate_dofs,
+      const int* restrict entity_local_index,
+      const uint8_t* restrict quadrature_permutation,
+      int num_quadrature_points,
+      const double* restrict quadrature_points,
+      const double* restrict quadrature_weights,
+      const double* restrict facet_normals,
+      const double* const* tables);
+
+  /// Tabulate integral into tensor A for a batch of cells with runtime
+  /// quadrature rules and basis function tables tabulated by the
+  /// caller at the concatenated quadrature points of all cells
+  ///
+  /// @param[in] tables Basis function tables, as described by
+  /// ufcx_integral::runtime_tables. Dimensions:
+  /// tables[num_runtime_tables][quadrature_offsets[num_cells]][num_dofs]
+  ///
+  /// @see ufcx_tabulate_tensor_runtime_batch_float64
+  typedef void(ufcx_tabulate_tensor_runtime_tables_batch_float64)(
+      double* restrict A,
+      const double* restrict w,
+      const double* restrict c,
+      const double* restrict coordinate_dofs,
+      const int* restrict entity_local_index,
+      const uint8_t* restrict quadrature_permutation,
+      int num_cells,
+      const int* restrict quadrature_offsets,
+      const double* restrict quadrature_points,
+      const double* restrict quadrature_weights,
+      const double* restrict facet_normals,
+      const double* const* tables);
+
+  /// Tabulate integral into tensors A of num_cells cells, with the
+  /// data of the cells interleaved in blocks of
+  /// ufcx_integral::cell_batch_size cells
+  ///
+  /// With W = cell_batch_size, value k of the data of cell i in the
+  /// arrays A, w, coordinate_dofs, entity_local_index and
+  /// quadrature_permutation is at position
+  /// (i / W) * n * W + k * W + i % W, where n is the number of values
+  /// per cell as in ufcx_tabulate_tensor_float64. The last block is
+  /// laid out with the same stride W also if num_cells is not a
+  /// multiple of W. The constants c are shared by all cells.
+  ///
+  /// @param[in] num_cells Number of cells
+  ///
+  /// @see ufcx_tabulate_tensor_float64
+  typedef void(ufcx_tabulate_tensor_interleaved_float32)(
+      float* restrict A, const float* restrict w,
+      const float* restrict c, const float* restrict coordinate_dofs,
+      const int* restrict entity_local_index,
+      const uint8_t* restrict quadrature_permutation,
+      int num_cells);
+
+  /// @see ufcx_tabulate_tensor_interleaved_float32
+  typedef void(ufcx_tabulate_tensor_interleaved_float64)(
+      double* restrict A, const double* restrict w,
+      const double* restrict c, const double* restrict coordinate_dofs,
+      const int* restrict entity_local_index,
+      const uint8_t* restrict quadrature_permutation,
+      int num_cells);
+
+  /// Basis function table to be tabulated at the runtime quadrature
+  /// points by the caller. Tables with equal descriptions are equal,
+  /// also across integrals and forms.
+  typedef struct ufcx_runtime_table
+  {
+    /// Name of the table in the generated code
+    const char* name;
+
+    /// Basix element family, cell type, degree and lattice type of the
+    /// element to tabulate. The lattice type is the basix Lagrange
+    /// variant of the element, -1 if unset.
+    int family;
+    int cell_type;
+    int degree;
+    int lattice_type;
+
+    /// Basix DPC variant of the element to tabulate, -1 if unset
+    int dpc_variant;
+
+    /// 1 if the element to tabulate is discontinuous, 0 otherwise
+    int discontinuous;
+
+    /// Basix index of the derivative to tabulate
+    int derivative;
+
+    /// Value component of the element to tabulate
+    int component;
+
+    /// Number of dofs, i.e. the second table dimension
+    int num_dofs;
+  } ufcx_runtime_table;
 
   typedef struct ufcx_integral
   {
@@ -339,8 +478,26 @@ extern "C"
     ufcx_tabulate_tensor_complex64* tabulate_tensor_complex64;
     ufcx_tabulate_tensor_complex128* tabulate_tensor_complex128;
     ufcx_tabulate_tensor_runtime_float64* tabulate_tensor_runtime_float64;
+    ufcx_tabulate_tensor_runtime_batch_float64* tabulate_tensor_runtime_batch_float64;
+    ufcx_tabulate_tensor_runtime_tables_float64* tabulate_tensor_runtime_tables_float64;
+    ufcx_tabulate_tensor_runtime_tables_batch_float64* tabulate_tensor_runtime_tables_batch_float64;
+    ufcx_tabulate_tensor_interleaved_float32* tabulate_tensor_interleaved_float32;
+    ufcx_tabulate_tensor_interleaved_float64* tabulate_tensor_interleaved_float64;
     bool needs_facet_permutations;
 
+    /// Number of cells W in the blocks of interleaved cell data taken
+    /// by the interleaved kernels, or 0 if there are none
+    int cell_batch_size;
+
+    /// Number of basis function tables taken by the runtime kernels
+    /// with pretabulated tables
+    int num_runtime_tables;
+
+    /// Description of the basis function tables taken by the runtime
+    /// kernels with pretabulated tables.
+    /// Dimensions: runtime_tables[num_runtime_tables]
+    const ufcx_runtime_table* runtime_tables;
+
     /// Get the coordinate element associated with the geometry of the mesh.
     ufcx_finite_element* coordinate_element;
   } ufcx_integral;
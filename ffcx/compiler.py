@@ -64,19 +64,26 @@ Compiler stages
 """
 
 import logging
+import os
+import pickle
+import tempfile
 import typing
-from time import time
+from pathlib import Path
 
+import ufl
+from ffcx import instrumentation
 from ffcx.analysis import analyze_ufl_objects
 from ffcx.codegeneration.codegeneration import generate_code
-from ffcx.formatting import format_code
-from ffcx.ir.representation import compute_ir
+from ffcx.formatting import format_code, format_translation_units
+from ffcx.ir.representation import DataIR, compute_ir
+from ffcx.naming import compute_signature
+from ffcx.options import FFCX_IR_OPTIONS
 
 logger = logging.getLogger("ffcx")
 
 
-def _print_timing(stage: int, timing: float):
-    logger.info(f"Compiler stage {stage} finished in {timing:.4f} seconds.")
+def _log_stage(stage: int, span: instrumentation.Span):
+    logger.info(f"Compiler stage {stage} finished in {span.duration:.4f} seconds.")
 
 def compile_ufl_objects(ufl_objects: typing.List[typing.Any],
                         object_names: typing.Dict = {},
@@ -91,29 +98,125 @@ def compile_ufl_objects(ufl_objects: typing.List[typing.Any],
         Objects to be compiled. Accepts elements, forms, integrals or coordinate mappings.
 
     """
-    # Stage 1: analysis
-    cpu_time = time()
-    analysis = analyze_ufl_objects(ufl_objects, options)
-    _print_timing(1, time() - cpu_time)
+    code, has_runtime_qr = _generate_code(ufl_objects, object_names, prefix, options, visualise)
 
-    # Stage 2: intermediate representation
-    cpu_time = time()
-    ir = compute_ir(analysis, object_names, prefix, options, visualise)
-    _print_timing(2, time() - cpu_time)
+    # Stage 4: format code
+    with instrumentation.span("formatting") as span:
+        code_h, code_c = format_code(code, options, has_runtime_qr)
+    _log_stage(4, span)
+
+    return code_h, code_c
+
+
+def compile_ufl_objects_to_units(ufl_objects: typing.List[typing.Any],
+                                 object_names: typing.Dict = {},
+                                 prefix: typing.Optional[str] = None,
+                                 options: typing.Dict = {}):
+    """Generate UFC code for given UFL objects, split into C files that are compiled separately.
+
+    Returns the header and a list of source files, see
+    ffcx.formatting.format_translation_units.
+
+    """
+    code, has_runtime_qr = _generate_code(ufl_objects, object_names, prefix, options, False)
+
+    # Stage 4: format code
+    with instrumentation.span("formatting") as span:
+        code_h, code_units = format_translation_units(code, options, has_runtime_qr)
+    _log_stage(4, span)
+
+    return code_h, code_units
+
+
+def _generate_code(ufl_objects, object_names, prefix, options, visualise):
+    """Generate code blocks for UFL objects, and whether any integral has a runtime quadrature rule."""
+    # Look for the intermediate representation in the cache
+    ir = None
+    if options["ir_cache_dir"] and not visualise:
+        ir_filename = Path(options["ir_cache_dir"]).joinpath(
+            _compute_ir_signature(ufl_objects, object_names, prefix, options) + ".ir")
+        with instrumentation.span("load_ir"):
+            ir = _load_ir(ir_filename, options)
+        instrumentation.count("ir_cache_misses" if ir is None else "ir_cache_hits")
+
+    if ir is None:
+        # Stage 1: analysis
+        with instrumentation.span("analysis") as span:
+            analysis = analyze_ufl_objects(ufl_objects, options)
+        _log_stage(1, span)
+
+        # Stage 2: intermediate representation
+        with instrumentation.span("ir") as span:
+            ir = compute_ir(analysis, object_names, prefix, options, visualise)
+        _log_stage(2, span)
+
+        if options["ir_cache_dir"] and not visualise:
+            with instrumentation.span("store_ir"):
+                _store_ir(ir_filename, ir)
 
     # Stage 3: code generation
-    cpu_time = time()
-    code = generate_code(ir, options)
-    _print_timing(3, time() - cpu_time)
+    with instrumentation.span("codegen") as span:
+        code = generate_code(ir, options)
+    _log_stage(3, span)
 
-    # Stage 4: format code. Check if any integral has a runtime qr
+    # Check if any integral has a runtime qr
     has_runtime_qr = False
     for integral in ir.integrals:
         if integral.has_runtime_qr:
             has_runtime_qr = True
             break
-    cpu_time = time()
-    code_h, code_c = format_code(code, options, has_runtime_qr)
-    _print_timing(4, time() - cpu_time)
 
-    return code_h, code_c
+    return code, has_runtime_qr
+
+
+def _compute_ir_signature(ufl_objects, object_names, prefix, options) -> str:
+    """Compute the signature of the intermediate representation of UFL objects."""
+    # The IR depends on the names of the objects and their terminals
+    names = []
+    for ufl_object in ufl_objects:
+        if isinstance(ufl_object, ufl.Form):
+            terminals = ufl_object.coefficients() + tuple(ufl_object.constants()) + ufl_object.arguments()
+        elif isinstance(ufl_object, tuple):
+            ufl_object = ufl_object[0]
+            terminals = (list(ufl.algorithms.extract_coefficients(ufl_object))
+                         + list(ufl.algorithms.analysis.extract_constants(ufl_object))
+                         + list(ufl.algorithms.analysis.extract_arguments(ufl_object)))
+        else:
+            terminals = ()
+        names.append((object_names.get(id(ufl_object)), [object_names.get(id(t), str(t)) for t in terminals]))
+
+    ir_options = sorted((k, options[k]) for k in FFCX_IR_OPTIONS)
+    return compute_signature(ufl_objects, str((prefix, names, ir_options)))
+
+
+def _load_ir(filename: Path, options) -> typing.Optional[DataIR]:
+    """Load a cached intermediate representation, passing on the options for code generation."""
+    try:
+        with open(filename, "rb") as f:
+            ir = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable cached intermediate representation {filename}: {e}")
+        return None
+
+    logger.info(f"Loaded intermediate representation from {filename}")
+    return ir._replace(integrals=[integral._replace(options=options) for integral in ir.integrals],
+                       expressions=[expression._replace(options=options) for expression in ir.expressions])
+
+
+def _store_ir(filename: Path, ir: DataIR):
+    """Store an intermediate representation in the cache."""
+    try:
+        data = pickle.dumps(ir)
+    except (pickle.PicklingError, TypeError) as e:
+        logger.info(f"Not caching intermediate representation: {e}")
+        return
+
+    # Write to a temporary file first, such that readers never see a
+    # partially written file
+    filename.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_filename = tempfile.mkstemp(dir=filename.parent, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp_filename, filename)
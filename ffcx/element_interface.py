@@ -7,6 +7,8 @@
 
 from __future__ import annotations
 
+import copyreg
+import pickle
 import typing
 import warnings
 from functools import lru_cache
@@ -60,6 +62,19 @@ def create_element(element: ufl.finiteelement.FiniteElementBase) -> basix.ufl_wr
         return basix.ufl_wrapper.convert_ufl_element(element)
 
 
+def _reduce_basix_element(element):
+    """Pickle a Basix element by the arguments to create it with."""
+    if element.family == basix.ElementFamily.custom:
+        raise pickle.PicklingError("Cannot pickle custom Basix elements.")
+    return basix.create_element, (element.family, element.cell_type, element.degree, element.lagrange_variant,
+                                  element.dpc_variant, element.discontinuous)
+
+
+# Make elements, and the intermediate representation holding them,
+# picklable
+copyreg.pickle(basix._basixcpp.FiniteElement, _reduce_basix_element)
+
+
 def basix_index(indices: typing.Tuple[int]) -> int:
     """Get the Basix index of a derivative."""
     return basix.index(*indices)
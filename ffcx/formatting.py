@@ -20,6 +20,7 @@ import textwrap
 
 from ffcx import __version__ as FFCX_VERSION
 from ffcx.codegeneration import __version__ as UFC_VERSION
+from ffcx.options import FFCX_CODE_INVARIANT_OPTIONS
 
 logger = logging.getLogger("ffcx")
 
@@ -64,18 +65,7 @@ def format_code(code, options: dict, has_runtime_qr: bool):
     logger.info("Compiler stage 5: Formatting code")
     logger.info(79 * "*")
 
-    # Generate code for comment at top of file
-    code_h_pre = _generate_comment(options) + "\n"
-    code_c_pre = _generate_comment(options) + "\n"
-
-    # Generate code for header
-    code_h_pre += FORMAT_TEMPLATE["header_h"]
-    code_c_pre += FORMAT_TEMPLATE["header_c"]
-
-    # Generate includes and add to preamble
-    includes_h, includes_c = _generate_includes(options, has_runtime_qr)
-    code_h_pre += includes_h
-    code_c_pre += includes_c
+    code_h_pre, code_c_pre = _generate_preamble(options, has_runtime_qr)
 
     # Enclose header with 'extern "C"'
     code_h_pre += c_extern_pre
@@ -95,6 +85,27 @@ def format_code(code, options: dict, has_runtime_qr: bool):
     return code_h, code_c
 
 
+def format_translation_units(code, options: dict, has_runtime_qr: bool):
+    """Format given code in UFC format, split into separately compilable C files.
+
+    Returns the header and a list of source file contents: one with the
+    elements, dofmaps and forms, followed by one for each integral and
+    expression. Each source file declares all objects, such that the
+    compiled files can be linked together.
+    """
+    code_h, code_c = format_code(code, options, has_runtime_qr)
+
+    _, code_c_pre = _generate_preamble(options, has_runtime_qr)
+    declarations = "".join(c[0] for parts_code in code for c in parts_code)
+    code_c_pre += declarations
+
+    shared = code.elements + code.dofmaps + code.forms
+    code_units = [code_c_pre + "".join(c[1] for c in shared)]
+    code_units += [code_c_pre + c[1] for c in code.integrals + code.expressions]
+
+    return code_h, code_units
+
+
 def write_code(code_h, code_c, prefix, output_dir):
     _write_file(code_h, prefix, ".h", output_dir)
     _write_file(code_c, prefix, ".c", output_dir)
@@ -107,6 +118,24 @@ def _write_file(output, prefix, postfix, output_dir):
         hfile.write(output)
 
 
+def _generate_preamble(options: dict, has_runtime_qr: bool):
+    """Generate comment and includes at the top of the header and source files."""
+    # Generate code for comment at top of file
+    code_h_pre = _generate_comment(options) + "\n"
+    code_c_pre = _generate_comment(options) + "\n"
+
+    # Generate code for header
+    code_h_pre += FORMAT_TEMPLATE["header_h"]
+    code_c_pre += FORMAT_TEMPLATE["header_c"]
+
+    # Generate includes and add to preamble
+    includes_h, includes_c = _generate_includes(options, has_runtime_qr)
+    code_h_pre += includes_h
+    code_c_pre += includes_c
+
+    return code_h_pre, code_c_pre
+
+
 def _generate_comment(options):
     """Generate code for comment on top of file."""
     # Generate top level comment
@@ -116,6 +145,7 @@ def _generate_comment(options):
     comment += "//\n"
     comment += "// This code was generated with the following options:\n"
     comment += "//\n"
+    options = {k: v for k, v in options.items() if k not in FFCX_CODE_INVARIANT_OPTIONS}
     comment += textwrap.indent(pprint.pformat(options), "//  ")
     comment += "\n"
 
@@ -136,7 +166,7 @@ def _generate_includes(options: dict, has_runtime_qr: bool):
         "#include <ufcx.h>"
     ]
 
-    if has_runtime_qr:
+    if has_runtime_qr and not options["runtime_pretabulated_tables"]:
         default_c_includes += ["#include <call_basix.h>"]
 
     if "_Complex" in options["scalar_type"]:
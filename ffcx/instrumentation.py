@@ -0,0 +1,189 @@
+# Copyright (C) 2023 FEniCS Project
+#
+# This file is part of FFCx. (https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Instrumentation of the compiler with timed spans and counters.
+
+The compiler marks its stages, and the work on each integral, with
+spans, and counts events such as tabulation cache hits. Spans and
+counters are passed to the registered callbacks, for example a
+Recorder, which exports them as JSON or in the Chrome trace event
+format, viewable in chrome://tracing or https://ui.perfetto.dev::
+
+    with ffcx.instrumentation.Recorder() as recorder:
+        ffcx.compiler.compile_ufl_objects(forms)
+    recorder.write("trace.json", "chrome")
+
+Spans and counters of worker processes of the compiler are passed to
+the callbacks of the parent process. Without callbacks, a span only
+measures its duration.
+"""
+
+import json
+import os
+import threading
+import time
+import typing
+
+_callbacks: typing.List[typing.Callable] = []
+_local = threading.local()
+
+
+def add_callback(callback: typing.Callable):
+    """Register a function called with every finished Span and every Counter. Returns the callback."""
+    _callbacks.append(callback)
+    return callback
+
+
+def remove_callback(callback: typing.Callable):
+    """Unregister a callback."""
+    _callbacks.remove(callback)
+
+
+def enabled() -> bool:
+    """Return whether any callback is registered."""
+    return bool(_callbacks)
+
+
+def emit(event):
+    """Pass a span or counter, for example recorded in another process, to the callbacks."""
+    for callback in list(_callbacks):
+        callback(event)
+
+
+class Span:
+    """Timed section of the compiler, used as a context manager.
+
+    Spans opened while another span of the same thread is open are
+    nested in it, and have a larger depth. The duration in seconds is
+    available after the span is closed.
+    """
+
+    __slots__ = ("name", "attributes", "start", "duration", "depth", "pid", "thread")
+
+    def __init__(self, name: str, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.start = 0.0
+        self.duration = 0.0
+        self.depth = 0
+        self.pid = 0
+        self.thread = 0
+
+    def __enter__(self):
+        self.depth = getattr(_local, "depth", 0)
+        _local.depth = self.depth + 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.duration = time.perf_counter() - self.start
+        _local.depth = self.depth
+        if _callbacks:
+            self.pid = os.getpid()
+            self.thread = threading.get_ident()
+            emit(self)
+
+    def __getstate__(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def __setstate__(self, state):
+        for k, v in state.items():
+            setattr(self, k, v)
+
+    def __repr__(self):
+        return f"Span({self.name!r}, {self.attributes!r}, duration={self.duration:.6f})"
+
+
+def span(name: str, **attributes) -> Span:
+    """Return a span of a section of the compiler, with attributes describing its work."""
+    return Span(name, **attributes)
+
+
+class Counter(typing.NamedTuple):
+    """Increment of a named counter."""
+
+    name: str
+    value: float
+    time: float
+    attributes: dict
+    pid: int
+    thread: int
+
+
+def count(name: str, value: float = 1, **attributes):
+    """Increment a named counter."""
+    if _callbacks:
+        emit(Counter(name, value, time.perf_counter(), attributes, os.getpid(), threading.get_ident()))
+
+
+def _json_value(value):
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_json_value(v) for v in value]
+    return str(value)
+
+
+class Recorder:
+    """Record spans and counters, while used as a context manager or registered as a callback."""
+
+    def __init__(self):
+        self.spans: typing.List[Span] = []
+        self.counters: typing.List[Counter] = []
+
+    def __call__(self, event):
+        if isinstance(event, Span):
+            self.spans.append(event)
+        else:
+            self.counters.append(event)
+
+    def __enter__(self):
+        return add_callback(self)
+
+    def __exit__(self, *exc):
+        remove_callback(self)
+
+    def totals(self) -> typing.Dict[str, float]:
+        """Return the total of each counter."""
+        totals: typing.Dict[str, float] = {}
+        for c in self.counters:
+            totals[c.name] = totals.get(c.name, 0) + c.value
+        return totals
+
+    def to_json(self) -> dict:
+        """Return the spans, in order of their start, and counter totals as JSON data.
+
+        Times are in seconds, relative to the start of the first span.
+        """
+        spans = sorted(self.spans, key=lambda s: s.start)
+        t0 = spans[0].start if spans else 0.0
+        return {"spans": [{"name": s.name, "start": s.start - t0, "duration": s.duration, "depth": s.depth,
+                           "pid": s.pid, "thread": s.thread,
+                           "attributes": {k: _json_value(v) for k, v in s.attributes.items()}}
+                          for s in spans],
+                "counters": self.totals()}
+
+    def to_chrome_trace(self) -> dict:
+        """Return the spans and counters in the Chrome trace event format."""
+        events = [{"name": s.name, "ph": "X", "ts": 1e6 * s.start, "dur": 1e6 * s.duration, "pid": s.pid,
+                   "tid": s.thread, "args": {k: _json_value(v) for k, v in s.attributes.items()}}
+                  for s in self.spans]
+        totals: typing.Dict[str, float] = {}
+        for c in sorted(self.counters, key=lambda c: c.time):
+            totals[c.name] = totals.get(c.name, 0) + c.value
+            events.append({"name": c.name, "ph": "C", "ts": 1e6 * c.time, "pid": c.pid, "tid": c.thread,
+                           "args": {c.name: totals[c.name]}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, filename, format: str = "json"):
+        """Write the recording to a file, as "json" or "chrome" trace."""
+        if format == "json":
+            data = self.to_json()
+        elif format == "chrome":
+            data = self.to_chrome_trace()
+        else:
+            raise ValueError(f"Unknown instrumentation format {format}.")
+        with open(filename, "w") as f:
+            json.dump(data, f)
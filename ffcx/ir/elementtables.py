@@ -5,13 +5,18 @@
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 """Tools for precomputed tables of terminal values."""
 
+import collections
+import hashlib
 import logging
+import threading
 import typing
 
 import numpy
 
+import basix.ufl_wrapper
 import ufl
 import ufl.utils.derivativetuples
+from ffcx import instrumentation
 from ffcx.element_interface import basix_index, convert_element, QuadratureElement
 from ffcx.ir.representationutils import (create_quadrature_points_and_weights,
                                          integral_type_to_entity_dim,
@@ -26,6 +31,14 @@ default_atol = 1e-9
 piecewise_ttypes = ("piecewise", "fixed", "ones", "zeros")
 uniform_ttypes = ("fixed", "ones", "zeros", "uniform")
 
+# Table types of tables whose zero columns are skipped
+sparse_ttypes = ("piecewise", "fixed", "uniform", "varying")
+
+# Largest fraction of the columns kept in compressed tables. Loops over
+# the dofs of tables with few zero columns are not worth splitting
+# into loops over different dofs.
+sparse_table_max_fill = 0.75
+
 
 class ModifiedTerminalElement(typing.NamedTuple):
     element: ufl.FiniteElementBase
@@ -34,6 +47,20 @@ class ModifiedTerminalElement(typing.NamedTuple):
     fc: int
 
 
+class TableSparsityT(typing.NamedTuple):
+    name: str  # name of the map from the columns of the compressed table to dofs
+    dofs: numpy.typing.NDArray[numpy.int32]  # dof of each column of the compressed table, for each entity
+    num_nonzeros: typing.Tuple[int, ...]  # number of dofs with nonzero values on each entity
+
+    @property
+    def begin(self) -> typing.Optional[int]:
+        """First dof of a single entity with contiguous dofs, which need no map, or None."""
+        first = int(self.dofs[0, 0])
+        if self.dofs.shape[0] == 1 and numpy.array_equal(self.dofs[0], first + numpy.arange(self.dofs.shape[1])):
+            return first
+        return None
+
+
 class UniqueTableReferenceT(typing.NamedTuple):
     name: str
     values: numpy.typing.NDArray[numpy.float64]
@@ -43,6 +70,10 @@ class UniqueTableReferenceT(typing.NamedTuple):
     is_piecewise: bool
     is_uniform: bool
     is_permuted: bool
+    element: basix.ufl_wrapper._BasixElementBase  # element tabulated for this table
+    derivatives: typing.Tuple[int, ...]  # number of derivatives in each reference direction
+    component: int  # value component of the tabulated element
+    sparsity: typing.Optional[TableSparsityT] = None  # dofs with nonzero values, None if not compressed
 
 
 def equal_tables(a, b, rtol=default_rtol, atol=default_atol):
@@ -54,6 +85,21 @@ def equal_tables(a, b, rtol=default_rtol, atol=default_atol):
         return numpy.allclose(a, b, rtol=rtol, atol=atol)
 
 
+def table_key(table, rtol=default_rtol):
+    """Return a hashable key of a table for finding equal tables.
+
+    Table values are rounded to a relative precision of rtol before
+    hashing, such that tables that are equal up to rounding errors
+    have equal keys, unless values lie on either side of a rounding
+    boundary.
+    """
+    table = numpy.asarray(table)
+    bits = int(numpy.ceil(-numpy.log2(rtol)))
+    mantissa, exponent = numpy.frexp(table)
+    rounded = numpy.ldexp(numpy.rint(mantissa * 2**bits), exponent - bits) + 0.0
+    return table.shape, hashlib.sha1(numpy.ascontiguousarray(rounded)).hexdigest()
+
+
 def clamp_table_small_numbers(table,
                               rtol=default_rtol,
                               atol=default_atol,
@@ -66,6 +112,56 @@ def clamp_table_small_numbers(table,
     return table
 
 
+# Process-wide cache of tabulated elements, shared between integrals,
+# forms and compilations
+_tabulation_cache: typing.OrderedDict = collections.OrderedDict()
+_tabulation_cache_lock = threading.Lock()
+tabulation_cache_size = 256
+
+
+def clear_tabulation_cache():
+    """Remove all tabulated elements from the tabulation cache."""
+    with _tabulation_cache_lock:
+        _tabulation_cache.clear()
+
+
+def tabulate_entities(element, cell, integral_type, points, deriv_order):
+    """Tabulate basis functions and derivatives in points mapped to each entity of an integral.
+
+    Tabulations are cached, keeping the tabulation_cache_size most
+    recently used. The returned arrays must not be modified.
+
+    Returns a list of arrays with axes (derivative, point, dof), one
+    for each entity.
+    """
+    points = numpy.ascontiguousarray(points, dtype=numpy.float64)
+    key = (repr(element), cell.cellname(), integral_type, points.shape,
+           hashlib.sha1(points).hexdigest(), deriv_order)
+    with _tabulation_cache_lock:
+        if key in _tabulation_cache:
+            _tabulation_cache.move_to_end(key)
+            instrumentation.count("tabulation_cache_hits")
+            return _tabulation_cache[key]
+    instrumentation.count("tabulation_cache_misses")
+
+    tdim = cell.topological_dimension()
+    entity_dim = integral_type_to_entity_dim(integral_type, tdim)
+    num_entities = ufl.cell.num_cell_entities[cell.cellname()][entity_dim]
+    tables = []
+    with instrumentation.span("tabulate", element=key[0], num_points=points.shape[0], deriv_order=deriv_order):
+        for entity in range(num_entities):
+            entity_points = map_integral_points(points, integral_type, cell, entity)
+            tbl = element.tabulate(deriv_order, entity_points)
+            tbl.flags.writeable = False
+            tables.append(tbl)
+
+    with _tabulation_cache_lock:
+        _tabulation_cache[key] = tables
+        while len(_tabulation_cache) > tabulation_cache_size:
+            _tabulation_cache.popitem(last=False)
+    return tables
+
+
 def get_ffcx_table_values(points, cell, integral_type, element, avg, entitytype,
                           derivative_counts, flat_component):
     """Extract values from FFCx element table.
@@ -110,20 +206,11 @@ def get_ffcx_table_values(points, cell, integral_type, element, avg, entitytype,
             points, weights = create_quadrature_points_and_weights(
                 integral_type, cell, element.highest_degree(), "default")
 
-    # Tabulate table of basis functions and derivatives in points for each entity
-    tdim = cell.topological_dimension()
-    entity_dim = integral_type_to_entity_dim(integral_type, tdim)
-    num_entities = ufl.cell.num_cell_entities[cell.cellname()][entity_dim]
-
     # Extract arrays for the right scalar component
-    component_tables = []
     component_element, offset, stride = element.get_component_element(flat_component)
-
-    for entity in range(num_entities):
-        entity_points = map_integral_points(points, integral_type, cell, entity)
-        tbl = component_element.tabulate(deriv_order, entity_points)
-        tbl = tbl[basix_index(derivative_counts)]
-        component_tables.append(tbl)
+    component_tables = [tbl[basix_index(derivative_counts)]
+                        for tbl in tabulate_entities(component_element, cell, integral_type, points, deriv_order)]
+    num_entities = len(component_tables)
 
     if avg in ("cell", "facet"):
         # Compute numeric integral of the each component table
@@ -272,12 +359,14 @@ def permute_quadrature_quadrilateral(points, reflections=0, rotations=0):
 
 def build_optimized_tables(quadrature_rule, cell, integral_type, entitytype,
                            modified_terminals, existing_tables,
-                           rtol=default_rtol, atol=default_atol):
+                           rtol=default_rtol, atol=default_atol, sparsity=False):
     """Build the element tables needed for a list of modified terminals.
 
     Input:
       entitytype - str
       modified_terminals - ordered sequence of unique modified terminals
+      sparsity - find the dofs with nonzero values on each entity, see
+        analyse_table_sparsity
       FIXME: Document
 
     Output:
@@ -300,6 +389,15 @@ def build_optimized_tables(quadrature_rule, cell, integral_type, entitytype,
 
     _existing_tables = existing_tables.copy()
 
+    # Index existing tables by their keys, such that only tables with
+    # equal keys need to be compared
+    table_index = collections.defaultdict(list)
+    for table_name, table in _existing_tables.items():
+        table_index[table_key(table)].append(table_name)
+
+    # Names of the dof maps of sparse tables, by their dofs
+    sparsity_index = {}
+
     for mt in modified_terminals:
         res = analysis.get(mt)
         if not res:
@@ -378,7 +476,8 @@ def build_optimized_tables(quadrature_rule, cell, integral_type, entitytype,
 
         # Check for existing identical table
         new_table = True
-        for table_name in _existing_tables:
+        key = table_key(tbl)
+        for table_name in table_index[key]:
             if equal_tables(tbl, _existing_tables[table_name]):
                 name = table_name
                 tbl = _existing_tables[name]
@@ -387,6 +486,7 @@ def build_optimized_tables(quadrature_rule, cell, integral_type, entitytype,
 
         if new_table:
             _existing_tables[name] = tbl
+            table_index[key].append(name)
 
         cell_offset = 0
         element = convert_element(element)
@@ -398,14 +498,62 @@ def build_optimized_tables(quadrature_rule, cell, integral_type, entitytype,
         offset = cell_offset + t['offset']
         block_size = t['stride']
 
+        # Keep the element and value component the table values come
+        # from, so that the table can be tabulated at other points
+        component_element = element.get_component_element(flat_component)[0]
+        if isinstance(component_element, basix.ufl_wrapper.ComponentElement):
+            component = component_element.component
+            component_element = component_element.element
+        else:
+            component = 0
+
+        table_sparsity = None
+        if sparsity and tabletype in sparse_ttypes:
+            table_sparsity = analyse_table_sparsity(f"{name}_dofs", tbl)
+        if table_sparsity is not None:
+            # Share the maps of tables with the same dofs
+            sparsity_key = (table_sparsity.dofs.shape, table_sparsity.dofs.tobytes())
+            table_sparsity = table_sparsity._replace(
+                name=sparsity_index.setdefault(sparsity_key, table_sparsity.name))
+
         # tables is just np.arrays, mt_tables hold metadata too
         mt_tables[mt] = UniqueTableReferenceT(
             name, tbl, offset, block_size, tabletype,
-            tabletype in piecewise_ttypes, tabletype in uniform_ttypes, is_permuted)
+            tabletype in piecewise_ttypes, tabletype in uniform_ttypes, is_permuted,
+            component_element, tuple(local_derivatives), component, table_sparsity)
 
     return mt_tables
 
 
+def analyse_table_sparsity(name, table) -> typing.Optional[TableSparsityT]:
+    """Find the dofs with nonzero values on each entity of a table.
+
+    The table has axes (permutation, entity, point, dof), with small
+    values clamped to zero. Returns the sorted dofs of the columns of
+    the table compressed to the dofs with nonzero values on each
+    entity, or None if the table keeps more than sparse_table_max_fill
+    of its columns. Entities with fewer nonzero dofs are padded with
+    dofs with zero values, such that the compressed table has the same
+    number of columns on all entities.
+    """
+    nonzero = numpy.any(table != 0.0, axis=(0, 2))
+    num_nonzeros = tuple(int(n) for n in numpy.count_nonzero(nonzero, axis=1))
+    num_columns = max(num_nonzeros)
+    if num_columns > sparse_table_max_fill * table.shape[3]:
+        return None
+
+    dofs = numpy.zeros((table.shape[1], num_columns), dtype=numpy.int32)
+    for entity, n in enumerate(num_nonzeros):
+        padding = numpy.flatnonzero(~nonzero[entity])[:num_columns - n]
+        dofs[entity] = numpy.sort(numpy.concatenate([numpy.flatnonzero(nonzero[entity]), padding]))
+    return TableSparsityT(name, dofs, num_nonzeros)
+
+
+def compress_table(table, sparsity: TableSparsityT):
+    """Return the columns of a table of the dofs of a sparsity, for each entity."""
+    return numpy.stack([table[:, entity][..., dofs] for entity, dofs in enumerate(sparsity.dofs)], axis=1)
+
+
 def is_zeros_table(table, rtol=default_rtol, atol=default_atol):
     return (numpy.product(table.shape) == 0
             or numpy.allclose(table, numpy.zeros(table.shape), rtol=rtol, atol=atol))
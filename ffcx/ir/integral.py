@@ -13,12 +13,15 @@ import typing
 import numpy
 
 import ufl
+from ffcx import instrumentation
 from ffcx.ir.analysis.factorization import compute_argument_factorization
 from ffcx.ir.analysis.graph import build_scalar_graph
 from ffcx.ir.analysis.modified_terminals import (analyse_modified_terminal,
                                                  is_modified_terminal)
 from ffcx.ir.analysis.visualise import visualise_graph
-from ffcx.ir.elementtables import UniqueTableReferenceT, build_optimized_tables
+from ffcx.ir.elementtables import (UniqueTableReferenceT, build_optimized_tables,
+                                   clamp_table_small_numbers, equal_tables)
+from ffcx.ir.sumfactorization import compute_sum_factorization
 from ufl.algorithms.balancing import balance_modifiers
 from ufl.checks import is_cellwise_constant
 from ufl.classes import QuadratureWeight
@@ -41,6 +44,7 @@ class BlockDataT(typing.NamedTuple):
     is_uniform: bool
     ma_data: typing.Tuple[ModifiedArgumentDataT, ...]  # used in "full", "safe" and "partial"
     is_permuted: bool  # Do quad points on facets need to be permuted?
+    reference_tensor: typing.Optional[str]  # name of the precomputed reference tensor, if any
 
 
 def compute_integral_ir(cell, integral_type, entitytype, integrands, argument_shape,
@@ -55,9 +59,14 @@ def compute_integral_ir(cell, integral_type, entitytype, integrands, argument_sh
     # Shared unique tables for all quadrature loops
     ir["unique_tables"] = {}
     ir["unique_table_types"] = {}
+    ir["unique_table_references"] = {}
 
     ir["integrand"] = {}
 
+    # Reference tensors are only precomputed where the quadrature rule
+    # and the entity of each table are known at compile time
+    use_reference_tensors = p["reference_tensor"] and integral_type in ("cell", "exterior_facet")
+
     for quadrature_rule, integrand in integrands.items():
 
         expression = integrand
@@ -81,19 +90,24 @@ def compute_integral_ir(cell, integral_type, entitytype, integrands, argument_sh
                              for i, v in S.nodes.items()
                              if is_modified_terminal(v['expression'])}
 
-        mt_table_reference = build_optimized_tables(
-            quadrature_rule,
-            cell,
-            integral_type,
-            entitytype,
-            initial_terminals.values(),
-            ir["unique_tables"],
-            rtol=p["table_rtol"],
-            atol=p["table_atol"])
+        with instrumentation.span("tables", num_points=quadrature_rule.points.shape[0],
+                                  num_terminals=len(initial_terminals)):
+            mt_table_reference = build_optimized_tables(
+                quadrature_rule,
+                cell,
+                integral_type,
+                entitytype,
+                initial_terminals.values(),
+                ir["unique_tables"],
+                rtol=p["table_rtol"],
+                atol=p["table_atol"],
+                sparsity=p["sparse_tables"] and integral_type != "expression")
+        instrumentation.count("tables", len(mt_table_reference))
 
         # Fetch unique tables for this quadrature rule
         table_types = {v.name: v.ttype for v in mt_table_reference.values()}
         tables = {v.name: v.values for v in mt_table_reference.values()}
+        table_references = {v.name: v for v in mt_table_reference.values()}
 
         S_targets = [i for i, v in S.nodes.items() if v.get('target', False)]
         num_components = numpy.int32(numpy.prod(expression.ufl_shape))
@@ -176,6 +190,8 @@ def compute_integral_ir(cell, integral_type, entitytype, integrands, argument_sh
 
         # Loop over factorization terms
         block_contributions = collections.defaultdict(list)
+        reference_tensors = {}
+        reference_tensor_dofs = {}
         for ma_indices, fi_ci in sorted(argument_factorization.items()):
             # Get a bunch of information about this term
             assert rank == len(ma_indices)
@@ -217,12 +233,32 @@ def compute_integral_ir(cell, integral_type, entitytype, integrands, argument_sh
             for i, ma in enumerate(ma_indices):
                 ma_data.append(ModifiedArgumentDataT(ma, trs[i]))
 
+            # Integrate the argument tables of blocks with piecewise
+            # factors at compile time, such that the block is the
+            # factors contracted with a reference tensor. Reference
+            # tensors are restricted to the columns of compressed
+            # argument tables.
+            reference_tensor = None
+            if use_reference_tensors and all_factors_piecewise and not block_is_permuted \
+                    and "quadrature" not in ttypes:
+                ptable = integrate_block(quadrature_rule.weights, trs, rtol=p["table_rtol"], atol=p["table_atol"])
+                ptable = compress_reference_tensor(ptable, [tr.sparsity for tr in trs])
+                dofs = tuple(None if tr.sparsity is None else tr.sparsity.name for tr in trs)
+                reference_tensor = next((name for name, t in reference_tensors.items()
+                                         if reference_tensor_dofs[name] == dofs
+                                         and equal_tables(ptable, t, p["table_rtol"], p["table_atol"])), None)
+                if reference_tensor is None:
+                    reference_tensor = f"RT{len(reference_tensors)}_Q{quadrature_rule.id()}"
+                    reference_tensors[reference_tensor] = ptable
+                    reference_tensor_dofs[reference_tensor] = dofs
+
             block_is_transposed = False  # FIXME: Handle transposes for these block types
             block_unames = unames
             blockdata = BlockDataT(ttypes, fi_ci,
                                    all_factors_piecewise, block_unames,
                                    block_restrictions, block_is_transposed,
-                                   block_is_uniform, tuple(ma_data), block_is_permuted)
+                                   block_is_uniform, tuple(ma_data), block_is_permuted,
+                                   reference_tensor)
 
             # Insert in expr_ir for this quadrature loop
             block_contributions[blockmap].append(blockdata)
@@ -243,21 +279,35 @@ def compute_integral_ir(cell, integral_type, entitytype, integrands, argument_sh
 
         active_tables = {}
         active_table_types = {}
+        active_table_references = {}
 
         for name in active_table_names:
             # Drop tables not referenced from modified terminals
             if table_types[name] not in ("zeros", "ones"):
                 active_tables[name] = tables[name]
                 active_table_types[name] = table_types[name]
+                active_table_references[name] = table_references[name]
 
         # Add tables and types for this quadrature rule to global tables dict
         ir["unique_tables"].update(active_tables)
         ir["unique_table_types"].update(active_table_types)
+        ir["unique_table_references"].update(active_table_references)
+
+        # Find tables of tensor product elements in tensor product
+        # quadrature points, for sum factorised kernels
+        sum_factorization = None
+        if p["sum_factorization"] and integral_type == "cell" and \
+                cell.cellname() in ("quadrilateral", "hexahedron"):
+            sum_factorization = compute_sum_factorization(quadrature_rule, active_tables, active_table_types,
+                                                          rtol=p["table_rtol"], atol=p["table_atol"])
+
         # Build IR dict for the given expressions
         # Store final ir for this num_points
         ir["integrand"][quadrature_rule] = {"factorization": F,
                                             "modified_arguments": [F.nodes[i]['mt'] for i in argkeys],
-                                            "block_contributions": block_contributions}
+                                            "block_contributions": block_contributions,
+                                            "reference_tensors": reference_tensors,
+                                            "sum_factorization": sum_factorization}
 
         restrictions = [i.restriction for i in initial_terminals.values()]
         ir["needs_facet_permutations"] = "+" in restrictions and "-" in restrictions
@@ -265,6 +315,45 @@ def compute_integral_ir(cell, integral_type, entitytype, integrands, argument_sh
     return ir
 
 
+def integrate_block(weights, tables, rtol, atol):
+    """Integrate the product of the argument tables of a block over the quadrature points.
+
+    Tables are given by their references, with values with axes
+    (permutation, entity, point, dof). Returns the reference tensor,
+    with axes (entity, dof of each argument), which is the block of
+    the element tensor for a unit factor.
+    """
+    num_entities = max([1] + [tr.values.shape[1] for tr in tables])
+    ptable = numpy.zeros((num_entities, ) + tuple(tr.values.shape[3] for tr in tables))
+    for entity in range(num_entities):
+        for iq, w in enumerate(weights):
+            # Piecewise and uniform tables are stored for one point
+            # and one entity
+            v = numpy.asarray(w)
+            for tr in tables:
+                e = entity if tr.values.shape[1] > 1 else 0
+                q = iq if tr.values.shape[2] > 1 else 0
+                v = numpy.multiply.outer(v, tr.values[0, e, q])
+            ptable[entity] += v
+    return clamp_table_small_numbers(ptable, rtol=rtol, atol=atol)
+
+
+def compress_reference_tensor(ptable, sparsities):
+    """Restrict a reference tensor to the columns of the compressed argument tables.
+
+    The reference tensor has axes (entity, dof of each argument), and
+    sparsities are the dofs of the columns of the argument tables, or
+    None for dense tables.
+    """
+    for axis, sparsity in enumerate(sparsities):
+        if sparsity is None:
+            continue
+        ptable = numpy.stack([numpy.take(ptable[entity], sparsity.dofs[entity if len(sparsity.dofs) > 1 else 0],
+                                         axis=axis)
+                              for entity in range(ptable.shape[0])])
+    return ptable
+
+
 def analyse_dependencies(F, mt_unique_table_reference):
     # Sets 'status' of all nodes to either: 'inactive', 'piecewise' or 'varying'
     # Children of 'target' nodes are either 'piecewise' or 'varying'.
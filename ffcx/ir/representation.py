@@ -26,12 +26,14 @@ import numpy
 
 import basix
 import ufl
-from ffcx import naming
+from ffcx import instrumentation, naming
 from ffcx.analysis import UFLData
 from ffcx.element_interface import convert_element
+from ffcx.ir.elementtables import UniqueTableReferenceT
 from ffcx.ir.integral import compute_integral_ir
 from ffcx.ir.representationutils import (QuadratureRule,
                                          create_quadrature_points_and_weights)
+from ffcx.parallel import fork_map
 from ufl.classes import Integral
 from ufl.sorting import sorted_expr_sum
 
@@ -125,16 +127,19 @@ class IntegralIR(typing.NamedTuple):
     tensor_shape: typing.List[int]
     coefficient_numbering: typing.Dict[ufl.Coefficient, int]
     coefficient_offsets: typing.Dict[ufl.Coefficient, int]
+    coefficients_size: int
     original_constant_offsets: typing.Dict[ufl.Constant, int]
     options: dict
     cell_shape: str
     unique_tables: typing.Dict[str, numpy.typing.NDArray[numpy.float64]]
     unique_table_types: typing.Dict[str, str]
+    unique_table_references: typing.Dict[str, UniqueTableReferenceT]
     integrand: typing.Dict[QuadratureRule, dict]
     name: str
     precision: int
     needs_facet_permutations: bool
     coordinate_element: str
+    num_coordinate_dofs: int
     has_runtime_qr: bool
 
 
@@ -144,6 +149,7 @@ class ExpressionIR(typing.NamedTuple):
     options: dict
     unique_tables: typing.Dict[str, numpy.typing.NDArray[numpy.float64]]
     unique_table_types: typing.Dict[str, str]
+    unique_table_references: typing.Dict[str, UniqueTableReferenceT]
     integrand: typing.Dict[QuadratureRule, dict]
     coefficient_numbering: typing.Dict[ufl.Coefficient, int]
     coefficient_offsets: typing.Dict[ufl.Coefficient, int]
@@ -211,9 +217,11 @@ def compute_ir(analysis: UFLData, object_names, prefix, options, visualise):
         for (i, fd) in enumerate(analysis.form_data)
     ]
 
-    ir_expressions = [_compute_expression_ir(expr, i, prefix, analysis, options, visualise, object_names,
-                                             finite_element_names, dofmap_names)
-                      for i, expr in enumerate(analysis.expressions)]
+    ir_expressions = []
+    for i, expr in enumerate(analysis.expressions):
+        with instrumentation.span("expression_ir", expression=i):
+            ir_expressions.append(_compute_expression_ir(expr, i, prefix, analysis, options, visualise,
+                                                         object_names, finite_element_names, dofmap_names))
 
     return DataIR(elements=ir_elements, dofmaps=ir_dofmaps,
                   integrals=ir_integrals, forms=ir_forms,
@@ -352,6 +360,8 @@ def _compute_integral_ir(form_data, form_index, element_numbers, integral_names,
         tdim = cell.topological_dimension()
         assert all(tdim == itg.ufl_domain().topological_dimension() for itg in itg_data.integrals)
 
+        coordinate_element = convert_element(itg_data.domain.ufl_coordinate_element())
+
         ir = {
             "integral_type": itg_data.integral_type,
             "subdomain_id": itg_data.subdomain_id,
@@ -363,7 +373,8 @@ def _compute_integral_ir(form_data, form_index, element_numbers, integral_names,
             "num_vertices": cell.num_vertices(),
             "enabled_coefficients": itg_data.enabled_coefficients,
             "cell_shape": cellname,
-            "coordinate_element": finite_element_names[convert_element(itg_data.domain.ufl_coordinate_element())],
+            "coordinate_element": finite_element_names[coordinate_element],
+            "num_coordinate_dofs": coordinate_element.dim // coordinate_element.block_size,
             "has_runtime_qr": False
         }
 
@@ -481,6 +492,7 @@ def _compute_integral_ir(form_data, form_index, element_numbers, integral_names,
 
         # Copy offsets also into IR
         ir["coefficient_offsets"] = offsets
+        ir["coefficients_size"] = _offset
 
         # Build offsets for Constants
         original_constant_offsets = {}
@@ -495,19 +507,26 @@ def _compute_integral_ir(form_data, form_index, element_numbers, integral_names,
         # Create map from number of quadrature points -> integrand
         integrands = {rule: integral.integrand() for rule, integral in sorted_integrals.items()}
 
-        # Build more specific intermediate representation
-        integral_ir = compute_integral_ir(itg_data.domain.ufl_cell(), itg_data.integral_type,
-                                          ir["entitytype"], integrands, ir["tensor_shape"],
-                                          options, visualise)
-
-        ir.update(integral_ir)
-
         # Fetch name
         ir["name"] = integral_names[(form_index, itg_data_index)]
 
-        irs.append(IntegralIR(**ir))
+        irs.append((ir, itg_data.domain.ufl_cell(), integrands))
+
+    # Build more specific intermediate representation. Integral groups
+    # are independent, so may be computed in a process pool. Custom
+    # elements cannot be passed between processes.
+    def compute(i):
+        ir, cell, integrands = irs[i]
+        with instrumentation.span("integral_ir", integral=ir["name"], integral_type=ir["integral_type"]):
+            return compute_integral_ir(cell, ir["integral_type"], ir["entitytype"], integrands,
+                                       ir["tensor_shape"], options, visualise)
+
+    num_processes = options["ir_processes"]
+    if visualise or any(element.is_custom_element for element in element_numbers):
+        num_processes = 1
+    integral_irs = fork_map(compute, len(irs), num_processes)
 
-    return irs
+    return [IntegralIR(**{**ir, **integral_ir}) for (ir, _, _), integral_ir in zip(irs, integral_irs)]
 
 
 def _compute_form_ir(form_data, form_id, prefix, form_names, integral_names, element_numbers, finite_element_names,
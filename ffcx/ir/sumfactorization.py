@@ -0,0 +1,197 @@
+# Copyright (C) 2023 FEniCS Project
+#
+# This file is part of FFCx. (https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Tensor product structure of element tables, for sum factorisation.
+
+On quadrilaterals and hexahedra, the basis functions of Lagrange
+elements (Q and DQ) and their derivatives are products of basis
+functions of an interval, and Gauss-Jacobi and GLL quadrature points
+are a grid of points of an interval. A table of such an element at such
+points factorises into a table of each direction, with values
+FE[q][dof] = F0[q0][i0] * F1[q1][i1] * F2[q2][i2], where (q0, q1, q2)
+is the position of point q in the grid and (i0, i1, i2) the position
+of dof in the product of the 1D dofs.
+
+With the factors, evaluating a coefficient in all points or integrating
+against an argument costs O(p^(d+1)) per table instead of O(p^(2d)),
+and integrating against two arguments O(p^(2d+1)) instead of O(p^(3d)),
+by contracting one direction at a time.
+
+The factorisation is found from the table values, such that any table
+with the structure is found, and other tables are left to the dense
+code path.
+"""
+
+import typing
+
+import numpy
+
+from ffcx.ir.elementtables import equal_tables
+from ffcx.ir.representationutils import QuadratureRule
+
+# Table types of tables varying over the points of a cell
+factorized_ttypes = ("varying", "uniform")
+
+
+class TensorFactorsT(typing.NamedTuple):
+    factors: typing.Tuple[str, ...]  # name of the 1D table of each direction
+    dofs: str  # name of the table of the dof of each product of 1D dofs
+
+
+class SumFactorizationT(typing.NamedTuple):
+    shape: typing.Tuple[int, ...]  # number of points in each direction
+    points: numpy.typing.NDArray[numpy.int32]  # position of each point in the flattened grid
+    factors: typing.Dict[str, numpy.typing.NDArray[numpy.float64]]  # 1D tables, with axes (point, dof)
+    dofs: typing.Dict[str, numpy.typing.NDArray[numpy.int32]]  # dof of each product of 1D dofs
+    tables: typing.Dict[str, TensorFactorsT]  # factors of each factorised element table
+
+
+def grid_points(points, rtol, atol):
+    """Find the position of points in a grid.
+
+    Returns the shape of the grid and the flattened position of each
+    point, or None if the points are not a grid. The coordinates of
+    each direction are numbered in the order they first appear, such
+    that points listed in lexicographic order have the positions 0, 1,
+    2, ...
+    """
+    num_points, tdim = points.shape
+    positions = numpy.zeros((num_points, tdim), dtype=numpy.int32)
+    shape = []
+    for axis in range(tdim):
+        coordinates: typing.List[float] = []
+        for q, x in enumerate(points[:, axis]):
+            match = numpy.flatnonzero(numpy.isclose(coordinates, x, rtol=rtol, atol=atol))
+            if len(match) == 0:
+                coordinates.append(x)
+                positions[q, axis] = len(coordinates) - 1
+            else:
+                positions[q, axis] = match[0]
+        shape.append(len(coordinates))
+
+    flat = numpy.ravel_multi_index(positions.T, shape).astype(numpy.int32)
+    if numpy.prod(shape) != num_points or len(numpy.unique(flat)) != num_points:
+        return None
+    return tuple(shape), flat
+
+
+def rank_one_factors(values, rtol, atol):
+    """Factorise an array into a product of one vector per axis.
+
+    Vectors are scaled to have value 1 at their largest magnitude, and
+    the scale of the product is returned with the vectors, or None if
+    the array is zero or not a product.
+    """
+    k = numpy.unravel_index(numpy.argmax(abs(values)), values.shape)
+    if values[k] == 0.0:
+        return None
+
+    vectors = []
+    for axis in range(values.ndim):
+        v = values[k[:axis] + (slice(None), ) + k[axis + 1:]]
+        # First value of largest magnitude, up to rounding, for equal
+        # vectors to be scaled alike
+        i = numpy.flatnonzero(abs(v) >= (1.0 - rtol) * abs(v).max())[0]
+        vectors.append(v / v[i])
+
+    product = vectors[0]
+    for v in vectors[1:]:
+        product = numpy.multiply.outer(product, v)
+    scale = values[k] / product[k]
+    if not numpy.allclose(values, scale * product, rtol=rtol, atol=atol):
+        return None
+    return vectors, scale
+
+
+def factorize_table(table, shape, points, rtol, atol):
+    """Factorise a table, with axes (point, dof), into a 1D table of each direction.
+
+    Returns the 1D tables, and the dof of each product of 1D dofs, or
+    None if the table does not factorise.
+    """
+    num_points, num_dofs = table.shape
+    grid = numpy.zeros_like(table)
+    grid[points, :] = table
+
+    # Factorise each basis function, and number the distinct 1D basis
+    # functions of each direction
+    factors: typing.List[typing.List[numpy.typing.NDArray[numpy.float64]]] = [[] for n in shape]
+    positions = numpy.zeros((num_dofs, len(shape)), dtype=numpy.int32)
+    scales = numpy.zeros(num_dofs)
+    for dof in range(num_dofs):
+        res = rank_one_factors(grid[:, dof].reshape(shape), rtol, atol)
+        if res is None:
+            return None
+        vectors, scales[dof] = res
+        for axis, v in enumerate(vectors):
+            match = [i for i, f in enumerate(factors[axis]) if numpy.allclose(f, v, rtol=rtol, atol=atol)]
+            if match:
+                positions[dof, axis] = match[0]
+            else:
+                factors[axis].append(v)
+                positions[dof, axis] = len(factors[axis]) - 1
+
+    # The dofs must be all products of the 1D basis functions
+    dofs_shape = tuple(len(f) for f in factors)
+    flat = numpy.ravel_multi_index(positions.T, dofs_shape)
+    if numpy.prod(dofs_shape) != num_dofs or len(numpy.unique(flat)) != num_dofs:
+        return None
+    dofs = numpy.zeros(dofs_shape, dtype=numpy.int32)
+    dofs.flat[flat] = numpy.arange(num_dofs)
+
+    # Distribute the scales of the basis functions to the directions
+    scale = numpy.zeros(dofs_shape)
+    scale.flat[flat] = scales
+    res = rank_one_factors(scale, rtol, atol)
+    if res is None:
+        return None
+    vectors, s = res
+    vectors[0] = s * vectors[0]
+
+    tables = [numpy.array(f).T * v for f, v in zip(factors, vectors)]
+    return tables, dofs
+
+
+def compute_sum_factorization(quadrature_rule: QuadratureRule, tables, table_types,
+                              rtol, atol) -> typing.Optional[SumFactorizationT]:
+    """Compute the tensor product structure of the tables of a quadrature rule of a cell integral.
+
+    Tables are given with axes (permutation, entity, point, dof). Tables
+    varying over the points are factorised if possible. Returns None if
+    the points are not a grid or no table factorises.
+    """
+    grid = grid_points(quadrature_rule.points, rtol, atol)
+    if grid is None or len(grid[0]) < 2:
+        return None
+    shape, points = grid
+
+    factors: typing.Dict[str, numpy.typing.NDArray[numpy.float64]] = {}
+    dofs: typing.Dict[str, numpy.typing.NDArray[numpy.int32]] = {}
+    factorized: typing.Dict[str, TensorFactorsT] = {}
+    for name in sorted(tables):
+        table = tables[name]
+        if table_types[name] not in factorized_ttypes or table.shape[:2] != (1, 1):
+            continue
+        res = factorize_table(table[0, 0], shape, points, rtol, atol)
+        if res is None:
+            continue
+
+        # Share equal 1D tables and dof tables between tables
+        factor_names = []
+        for f in res[0]:
+            fname = next((n for n, g in factors.items() if equal_tables(f, g, rtol, atol)), None)
+            if fname is None:
+                fname = f"FT{len(factors)}_Q{quadrature_rule.id()}"
+                factors[fname] = f
+            factor_names.append(fname)
+        dname = next((n for n, g in dofs.items() if numpy.array_equal(res[1], g)), None)
+        if dname is None:
+            dname = f"DT{len(dofs)}_Q{quadrature_rule.id()}"
+            dofs[dname] = res[1]
+        factorized[name] = TensorFactorsT(tuple(factor_names), dname)
+
+    if not factorized:
+        return None
+    return SumFactorizationT(shape, points, factors, dofs, factorized)
@@ -9,15 +9,18 @@ Parse command-line arguments and generate code from input UFL form files.
 """
 
 import argparse
+import collections
 import cProfile
 import logging
 import pathlib
 import re
 import string
+import sys
+import time
 
 import ufl
 from ffcx import __version__ as FFCX_VERSION
-from ffcx import compiler, formatting
+from ffcx import compiler, formatting, instrumentation
 from ffcx.options import FFCX_DEFAULT_OPTIONS, get_options
 
 logger = logging.getLogger("ffcx")
@@ -35,6 +38,8 @@ parser.add_argument(
 )
 parser.add_argument("--visualise", action="store_true", help="visualise the IR graph")
 parser.add_argument("-p", "--profile", action='store_true', help="enable profiling")
+parser.add_argument("--trace", type=str,
+                    help="write the timings of compiler stages and integrals to this file, in Chrome trace format")
 
 # Add all options from FFCx option system
 for opt_name, (opt_val, opt_desc) in FFCX_DEFAULT_OPTIONS.items():
@@ -43,14 +48,32 @@ for opt_name, (opt_val, opt_desc) in FFCX_DEFAULT_OPTIONS.items():
 
 parser.add_argument("ufl_file", nargs='+', help="UFL file(s) to be compiled")
 
+cache_parser = argparse.ArgumentParser(
+    prog="ffcx cache", description="Report the usage of a JIT cache directory and clean it"
+)
+cache_parser.add_argument("cache_dir", help="JIT cache directory")
+cache_parser.add_argument("--clean", action="store_true",
+                          help="remove failed and incomplete modules, and modules over the limits")
+cache_parser.add_argument("--max-size", type=float, default=0, help="maximum size in MiB when cleaning")
+cache_parser.add_argument("--max-entries", type=int, default=0, help="maximum number of modules when cleaning")
+cache_parser.add_argument("--top", type=int, default=10, help="number of largest modules to list")
+
 
 def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    if args and args[0] == "cache":
+        return cache_main(args[1:])
+
     xargs = parser.parse_args(args)
 
     # Parse all other options
     priority_options = {k: v for k, v in xargs.__dict__.items() if v is not None}
     options = get_options(priority_options)
 
+    if xargs.trace:
+        recorder = instrumentation.add_callback(instrumentation.Recorder())
+
     # Call parser and compiler for each file
     for filename in xargs.ufl_file:
         file = pathlib.Path(filename)
@@ -67,7 +90,8 @@ def main(args=None):
             pr.enable()
 
         # Load UFL file
-        ufd = ufl.algorithms.load_ufl_file(filename)
+        with instrumentation.span("load", file=filename):
+            ufd = ufl.algorithms.load_ufl_file(filename)
 
         # Generate code
         code_h, code_c = compiler.compile_ufl_objects(
@@ -83,4 +107,35 @@ def main(args=None):
             pfn = f"ffcx_{prefix}.profile"
             pr.dump_stats(pfn)
 
+    if xargs.trace:
+        instrumentation.remove_callback(recorder)
+        recorder.write(xargs.trace, "chrome")
+
+    return 0
+
+
+def cache_main(args=None):
+    """Report the usage of a JIT cache directory, and optionally clean it."""
+    from ffcx.codegeneration import jit
+
+    xargs = cache_parser.parse_args(args)
+
+    if xargs.clean:
+        removed = jit.clean_cache(xargs.cache_dir, max_size=int(xargs.max_size * 2**20),
+                                  max_entries=xargs.max_entries)
+        print(f"Removed {len(removed)} modules")
+
+    info = jit.cache_info(xargs.cache_dir)
+    states = collections.Counter(e.state for e in info.entries)
+    print(f"Cache directory: {xargs.cache_dir}")
+    print(f"Size: {info.size / 2**20:.2f} MiB in {len(info.entries)} modules "
+          f"({states['ready']} ready, {states['failed']} failed, {states['incomplete']} incomplete, "
+          f"{states['orphaned']} orphaned)")
+    print(f"Hits: {info.hits}, misses: {info.misses}")
+    if info.entries and xargs.top > 0:
+        print("Largest modules:")
+        for e in info.entries[:xargs.top]:
+            last_used = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(e.last_used))
+            print(f"  {e.size / 2**20:9.2f} MiB  {last_used}  {e.state:10}  {e.module_name}")
+
     return 0
@@ -4,16 +4,23 @@
 #
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 
+from __future__ import annotations
+
 import hashlib
 import typing
 
-import numpy
-import numpy.typing
-
 import ffcx
 import ufl
 
-from .element_interface import convert_element
+if typing.TYPE_CHECKING:
+    import numpy
+    import numpy.typing
+
+
+def convert_element(element):
+    # Imported on first use, as it imports basix
+    from ffcx.element_interface import convert_element
+    return convert_element(element)
 
 
 def compute_signature(ufl_objects: typing.List[
@@ -33,10 +33,74 @@ FFCX_DEFAULT_OPTIONS = {
                (-1 means no alignment assumed, safe option)"""),
     "padlen":
         (1, "Pads every declared array in tabulation kernel such that its last dimension is divisible by given value."),
+    "runtime_table_cache_size":
+        (8, """Number of quadrature point sets for which runtime quadrature kernels keep tabulated basis
+               functions, per thread, before evicting the least recently used. Zero to tabulate them at
+               every call and release them at the end of the kernel."""),
+    "runtime_pretabulated_tables":
+        (False, """True to generate runtime quadrature kernels that take the basis function tables, tabulated
+                   at the quadrature points by the caller, as an argument instead of tabulating them."""),
+    "cell_batch_size":
+        (0, """Number of cells W tabulated per call of an additional kernel of each integral without runtime
+               quadrature, tabulate_tensor_interleaved, which takes the data of the cells interleaved such that
+               every arithmetic statement is a unit-stride loop over W cells, for the C compiler to vectorise,
+               e.g. with -O3. 0 to not generate it. Only for real scalar types float and double."""),
+    "sum_factorization":
+        (True, """True to generate sum factorised kernels for cell integrals on quadrilaterals and hexahedra, where
+                  the quadrature points are a tensor product grid. Arguments and coefficients with tabulated
+                  values that factorise into tables of each direction, such as Lagrange elements, are contracted
+                  with one direction at a time. Other terms use the dense loops over all points and dofs."""),
+    "reference_tensor":
+        (True, """True to precompute, for cell and exterior facet integrals, the integrals of the products of the
+                  argument tables of terms whose factors are constant on each cell, such as mass and stiffness
+                  terms on affine simplices with piecewise constant coefficients. Such terms are evaluated as the
+                  factors contracted with these reference tensors, without a loop over quadrature points."""),
+    "sparse_tables":
+        (True, """True to compress the element tables of integrals that are zero for many dofs on each entity, such
+                  as the dofs away from the facet in facet integrals, or the dofs whose value component of an
+                  H(div) or H(curl) element is zero. Loops over dofs run over the other dofs only, which are
+                  looked up in static maps."""),
+    "loop_fusion_registers":
+        (16, """Number of registers the loops evaluating coefficients and geometry over the dofs of an element
+                may use, estimated from their accumulators and shared loads. Loops over the same dofs are fused
+                into as few loops as fit, and loops with independent statements above it are split. 0 fuses all
+                loops over the same dofs into one."""),
+    "ir_cache_dir":
+        ("", """Directory to cache intermediate representations in, such that compiling the same UFL objects with
+               other code generation options skips analysis and intermediate representation. Empty to disable."""),
+    "ir_processes":
+        (1, """Number of processes to compute the intermediate representation of integrals in. 1 computes it
+               serially and 0 uses one process per CPU. The generated code does not depend on it."""),
+    "codegen_processes":
+        (1, """Number of processes to generate code for integrals and expressions in. 1 generates code
+               serially and 0 uses one process per CPU. The generated code does not depend on it."""),
+    "jit_compile_processes":
+        (1, """Number of processes to compile JIT modules in. Above 1, integrals and expressions are compiled as
+               separate translation units, concurrently, and linked into one module. 1 compiles a module as a
+               single translation unit and 0 uses one process per CPU. The generated code does not depend on
+               it."""),
+    "jit_backend":
+        ("cffi", """Backend building JIT modules. "cffi" builds a Python extension module with cffi and setuptools.
+                    "native" calls the C compiler directly to build a shared library, which is loaded with cffi in
+                    ABI mode, for lower build overhead."""),
+    "jit_cache_size":
+        (0, """Maximum size of a JIT cache directory in MiB. After compiling a module, failed compiles and the
+               least recently used modules over the limit are removed. 0 for no limit."""),
+    "jit_cache_entries":
+        (0, """Maximum number of modules in a JIT cache directory, see jit_cache_size. 0 for no limit."""),
     "verbosity":
         (30, "Logger verbosity. Follows standard logging library levels, i.e. INFO=20, DEBUG=10, etc.")
 }
 
+# Options that change how code is generated but not the generated code,
+# and are left out of the generated code and the JIT cache signature
+FFCX_CODE_INVARIANT_OPTIONS = ("ir_cache_dir", "ir_processes", "codegen_processes", "jit_compile_processes",
+                               "jit_backend", "jit_cache_size", "jit_cache_entries")
+
+# Options that the intermediate representation depends on
+FFCX_IR_OPTIONS = ("scalar_type", "table_rtol", "table_atol", "sum_factorization", "reference_tensor",
+                   "sparse_tables")
+
 
 @functools.lru_cache(maxsize=None)
 def _load_options():
@@ -0,0 +1,79 @@
+# Copyright (C) 2023 FEniCS Project
+#
+# This file is part of FFCx. (https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Process pools for independent compiler work items."""
+
+import concurrent.futures
+import logging
+import multiprocessing
+import typing
+
+from ffcx import instrumentation
+
+logger = logging.getLogger("ffcx")
+
+# Function evaluated by a forked worker, inherited from the parent
+_worker_function: typing.Optional[typing.Callable[[int], typing.Any]] = None
+
+# Spans and counters of the current item of a forked worker, if the
+# parent records them
+_worker_events: typing.Optional[typing.List] = None
+
+
+def _init_worker(function, record: bool):
+    global _worker_function, _worker_events
+    _worker_function = function
+    if record:
+        # The callbacks inherited from the parent would record into
+        # copies, so the events are sent back with the results instead
+        _worker_events = []
+        instrumentation._callbacks[:] = [_worker_events.append]
+
+
+def _call_worker(index: int):
+    assert _worker_function is not None, "Worker is not initialised"
+    if _worker_events is None:
+        return _worker_function(index)
+    _worker_events.clear()
+    result = _worker_function(index)
+    return result, list(_worker_events)
+
+
+def fork_map(function: typing.Callable[[int], typing.Any], num_items: int, num_processes: int) -> typing.List:
+    """Evaluate a function for each item index in a pool of forked processes.
+
+    The function, and any data it refers to, is inherited by the workers
+    by forking and is not pickled. Only the results are. Results are
+    returned in index order, as if computed serially.
+
+    Parameters
+    ----------
+    function
+        Function of the item index.
+    num_items
+        Number of items.
+    num_processes
+        Number of processes. 1 evaluates serially in this process and 0
+        uses one process per CPU.
+
+    """
+    if num_processes != 1 and "fork" not in multiprocessing.get_all_start_methods():
+        logger.warning("Process pools need the fork start method, computing serially.")
+        num_processes = 1
+    if num_processes == 1 or num_items < 2:
+        return [function(i) for i in range(num_items)]
+
+    logger.info(f"Computing {num_items} items in {num_processes or 'all available'} processes")
+    record = instrumentation.enabled()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_processes or None,
+                                                mp_context=multiprocessing.get_context("fork"),
+                                                initializer=_init_worker, initargs=(function, record)) as pool:
+        results = list(pool.map(_call_worker, range(num_items)))
+    if not record:
+        return results
+    for result, events in results:
+        for event in events:
+            instrumentation.emit(event)
+    return [result for result, events in results]
@@ -4,9 +4,17 @@
 #
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 
+import multiprocessing
+import os
+import socket
 import sys
+import threading
+import time
+
+import pytest
 
 import ffcx.codegeneration.jit
+import ffcx.naming
 import ufl
 
 
@@ -33,3 +41,224 @@ def test_cache_modes(compile_args):
 
     assert newname == tmpname
     assert newfile != tmpfile
+
+
+def _compile_in_process(cache_dir):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 2)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    a = ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx
+    compiled_forms, module, code = ffcx.codegeneration.jit.compile_forms([a], cache_dir=cache_dir, timeout=300)
+    assert compiled_forms[0].rank == 2
+    return code[0] is not None
+
+
+def test_cache_contention(tmp_path):
+    # Processes compiling the same form wait for one of them to compile it
+    num_processes = 12
+    with multiprocessing.get_context("fork").Pool(num_processes) as pool:
+        compiled = pool.map(_compile_in_process, [str(tmp_path)] * num_processes, chunksize=1)
+    assert sum(compiled) == 1
+    assert len(list(tmp_path.glob("*.c.cached"))) == 1
+    assert not list(tmp_path.glob("*.lock.pid"))
+
+
+def _hold_lock(cache_dir, acquired, release):
+    ffcx.codegeneration.jit._get_cached_module("libffcx_test", [], cache_dir, timeout=10)
+    acquired.set()
+    release.wait()
+    # Die while compiling, without releasing the lock
+    os._exit(1)
+
+
+@pytest.mark.parametrize("file_locks", [True, False])
+def test_cache_stale_lock(tmp_path, monkeypatch, file_locks):
+    if not file_locks:
+        monkeypatch.setattr(ffcx.codegeneration.jit, "fcntl", None)
+    ctx = multiprocessing.get_context("fork")
+    acquired, release = ctx.Event(), ctx.Event()
+    owner = ctx.Process(target=_hold_lock, args=(tmp_path, acquired, release))
+    owner.start()
+    assert acquired.wait(60)
+
+    # A live owner is waited for
+    with pytest.raises(TimeoutError):
+        ffcx.codegeneration.jit._get_cached_module("libffcx_test", [], tmp_path, timeout=0.2)
+
+    # The compile of a dead owner is taken over
+    release.set()
+    owner.join()
+    t0 = time.monotonic()
+    obj, mod, lock = ffcx.codegeneration.jit._get_cached_module("libffcx_test", [], tmp_path, timeout=10)
+    assert obj is None and lock is not None
+    assert time.monotonic() - t0 < 1.0
+    lock.release()
+
+
+def test_get_cached_module(tmp_path):
+    # A miss leaves the compile to the caller, without holding the lock
+    assert ffcx.codegeneration.jit.get_cached_module("libffcx_test", [], tmp_path, timeout=10) == (None, None)
+    lock = ffcx.codegeneration.jit._ModuleLock(tmp_path, "libffcx_test")
+    lock.acquire(0.2)
+    lock.release()
+
+    # A hit returns the objects and the module
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    a = ufl.TrialFunction(element) * ufl.TestFunction(element) * ufl.dx
+    compiled_forms, module, code = ffcx.codegeneration.jit.compile_forms([a], cache_dir=tmp_path)
+    names = [ffcx.naming.form_name(a, 0, module.__name__)]
+    obj, mod = ffcx.codegeneration.jit.get_cached_module(module.__name__, names, tmp_path, timeout=10)
+    assert mod.__name__ == module.__name__ and obj[0].rank == 2
+
+
+def test_module_registry(tmp_path, monkeypatch):
+    ffcx.codegeneration.jit.clear_module_registry()
+    monkeypatch.setattr(ffcx.codegeneration.jit, "module_registry_size", 1)
+    P1 = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    P2 = ufl.FiniteElement("Lagrange", ufl.triangle, 2)
+    forms = [ufl.TrialFunction(e) * ufl.TestFunction(e) * ufl.dx for e in (P1, P2)]
+
+    compiled_forms, module, code = ffcx.codegeneration.jit.compile_forms(forms[:1], cache_dir=tmp_path)
+    assert code[0] is not None
+
+    # Repeat compiles return the loaded module without looking in the cache directory
+    def fail(*args):
+        raise AssertionError("Cache directory searched")
+    with monkeypatch.context() as m:
+        m.setattr(ffcx.codegeneration.jit, "_get_cached_module", fail)
+        again = ffcx.codegeneration.jit.compile_forms(forms[:1], cache_dir=tmp_path)
+    assert again[1] is module and again[0] == compiled_forms and again[2] == (None, None)
+
+    # Invalidated and least recently used modules are loaded again from the cache directory
+    loaded = []
+    load_objects = ffcx.codegeneration.jit._load_objects
+    monkeypatch.setattr(ffcx.codegeneration.jit, "_load_objects", lambda *args: loaded.append(args[1])
+                        or load_objects(*args))
+    ffcx.codegeneration.jit.clear_module_registry(module.__name__)
+    ffcx.codegeneration.jit.compile_forms(forms[:1], cache_dir=tmp_path)
+    ffcx.codegeneration.jit.compile_forms(forms[:1], cache_dir=tmp_path)
+    assert loaded == [module.__name__]
+    ffcx.codegeneration.jit.compile_forms(forms[1:], cache_dir=tmp_path)
+    ffcx.codegeneration.jit.compile_forms(forms[:1], cache_dir=tmp_path)
+    assert loaded[-1] == module.__name__ and len(loaded) == 3
+    ffcx.codegeneration.jit.clear_module_registry()
+
+
+def test_cache_limits(tmp_path, monkeypatch):
+    ffcx.codegeneration.jit.clear_module_registry()
+    forms = []
+    for degree in (1, 2, 3):
+        element = ufl.FiniteElement("Lagrange", ufl.triangle, degree)
+        forms.append(ufl.TrialFunction(element) * ufl.TestFunction(element) * ufl.dx)
+
+    # Leftovers of a failed compile
+    tmp_path.joinpath("libffcx_forms_0123abcd.c.failed").write_text("int a;")
+    tmp_path.joinpath("libffcx_forms_0123abcd.o").write_bytes(b"0")
+
+    options = {"jit_cache_entries": 2}
+    names = [ffcx.codegeneration.jit.compile_forms(forms[:1], options=options, cache_dir=tmp_path)[1].__name__]
+    names.append(ffcx.codegeneration.jit.compile_forms(forms[1:2], options=options, cache_dir=tmp_path)[1].__name__)
+    info = ffcx.codegeneration.jit.cache_info(tmp_path)
+    assert {e.module_name for e in info.entries} == set(names)
+    assert (info.hits, info.misses) == (0, 2)
+
+    # The first module is used again, so the second is evicted. File
+    # timestamps may be coarser than the time it takes to load a module.
+    time.sleep(0.1)
+    ffcx.codegeneration.jit.clear_module_registry()
+    ffcx.codegeneration.jit.compile_forms(forms[:1], options=options, cache_dir=tmp_path)
+    names.append(ffcx.codegeneration.jit.compile_forms(forms[2:], options=options, cache_dir=tmp_path)[1].__name__)
+    info = ffcx.codegeneration.jit.cache_info(tmp_path)
+    assert {e.module_name for e in info.entries} == {names[0], names[2]}
+    assert all(e.state == "ready" for e in info.entries)
+    assert (info.hits, info.misses) == (1, 3)
+    assert info.size == sum(e.size for e in info.entries)
+    assert info.entries[0].size >= info.entries[1].size
+
+    # Counts are stored in a fixed size file
+    assert tmp_path.joinpath("ffcx-cache.counts").stat().st_size == 16
+
+    assert ffcx.codegeneration.jit.clean_cache(tmp_path, max_size=1) == [names[0], names[2]]
+    assert ffcx.codegeneration.jit.cache_info(tmp_path).entries == []
+    assert not list(tmp_path.glob("libffcx_*"))
+    ffcx.codegeneration.jit.clear_module_registry()
+
+
+def test_cache_orphaned_locks(tmp_path):
+    # Lock files left by modules removed by older versions, or by a dead
+    # process without file locks
+    tmp_path.joinpath("libffcx_forms_0123abcd.lock").write_text("")
+    tmp_path.joinpath("libffcx_forms_4567cdef.lock.pid").write_text(f"{socket.gethostname()}:999999999")
+
+    # A module being compiled keeps its lock
+    obj, mod, lock = ffcx.codegeneration.jit._get_cached_module("libffcx_forms_89abef01", [], tmp_path, timeout=10)
+    assert lock is not None
+
+    info = ffcx.codegeneration.jit.cache_info(tmp_path)
+    assert sorted((e.module_name, e.state) for e in info.entries) == [
+        ("libffcx_forms_0123abcd", "orphaned"), ("libffcx_forms_4567cdef", "orphaned"),
+        ("libffcx_forms_89abef01", "orphaned")]
+
+    removed = ffcx.codegeneration.jit.clean_cache(tmp_path)
+    assert sorted(removed) == ["libffcx_forms_0123abcd", "libffcx_forms_4567cdef"]
+    assert [e.module_name for e in ffcx.codegeneration.jit.cache_info(tmp_path).entries] == ["libffcx_forms_89abef01"]
+
+    lock.release()
+    assert ffcx.codegeneration.jit.clean_cache(tmp_path) == ["libffcx_forms_89abef01"]
+    assert not list(tmp_path.glob("libffcx_*"))
+
+
+def test_compile_async(tmp_path, monkeypatch):
+    ffcx.codegeneration.jit.clear_module_registry()
+    P1 = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    P2 = ufl.FiniteElement("Lagrange", ufl.triangle, 2)
+    forms = [ufl.TrialFunction(e) * ufl.TestFunction(e) * ufl.dx for e in (P1, P2)]
+
+    # Independent compiles overlap, the same forms are compiled once
+    futures = [ffcx.codegeneration.jit.compile_forms_async([a], cache_dir=tmp_path) for a in forms + forms[:1]]
+    futures.append(ffcx.codegeneration.jit.compile_elements_async([P2], cache_dir=tmp_path))
+    results = [f.result(timeout=300) for f in futures]
+    assert all(compiled_forms[0].rank == 2 for compiled_forms, module, code in results[:3])
+    assert results[0][1].__name__ == results[2][1].__name__
+    assert results[1][1].__name__ != results[0][1].__name__
+    (element, dofmap), = results[3][0]
+    assert element.space_dimension == 6 and dofmap.num_element_support_dofs == 6
+    assert ffcx.codegeneration.jit.cache_info(tmp_path).misses == 3
+
+    # Compile errors are raised by the future
+    with pytest.raises(Exception):
+        ffcx.codegeneration.jit.compile_forms_async([None], cache_dir=tmp_path).result(timeout=300)
+
+    # A temporary cache directory is removed once the module is loaded
+    temporary = []
+    mkdtemp = ffcx.codegeneration.jit.tempfile.mkdtemp
+    monkeypatch.setattr(ffcx.codegeneration.jit.tempfile, "mkdtemp",
+                        lambda: temporary.append(mkdtemp(dir=tmp_path)) or temporary[-1])
+    compiled_forms, module, code = ffcx.codegeneration.jit.compile_forms_async(forms[:1]).result(timeout=300)
+    assert compiled_forms[0].rank == 2
+    ffcx.codegeneration.jit.shutdown_async_compile()
+    assert len(temporary) == 1 and not os.path.exists(temporary[0])
+    ffcx.codegeneration.jit.clear_module_registry()
+
+
+def test_cache_removed_lock_file(tmp_path):
+    # A waiter on a lock file removed by its holder waits for the holder
+    # of the new lock file
+    ModuleLock = ffcx.codegeneration.jit._ModuleLock
+    holder = ModuleLock(tmp_path, "libffcx_test")
+    holder.acquire(0)
+    waiter = ModuleLock(tmp_path, "libffcx_test")
+    thread = threading.Thread(target=waiter.acquire, args=(10, ))
+    thread.start()
+    time.sleep(0.1)
+
+    holder.filename.unlink()
+    newcomer = ModuleLock(tmp_path, "libffcx_test")
+    newcomer.acquire(0)
+    holder.release()
+    thread.join(0.2)
+    assert thread.is_alive()
+
+    newcomer.release()
+    thread.join(10)
+    assert not thread.is_alive()
+    waiter.release()
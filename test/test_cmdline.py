@@ -19,3 +19,12 @@ def test_visualise():
     subprocess.run(["ffcx", "--visualise", "Poisson.py"])
     assert os.path.isfile("S.pdf")
     assert os.path.isfile("F.pdf")
+
+
+def test_cache(tmp_path):
+    tmp_path.joinpath("libffcx_forms_0123abcd.c.failed").write_text("int a;")
+    result = subprocess.run(["ffcx", "cache", str(tmp_path)], capture_output=True, text=True)
+    assert "1 failed" in result.stdout
+    result = subprocess.run(["ffcx", "cache", "--clean", str(tmp_path)], capture_output=True, text=True)
+    assert "Removed 1 modules" in result.stdout
+    assert not tmp_path.joinpath("libffcx_forms_0123abcd.c.failed").exists()
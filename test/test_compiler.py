@@ -0,0 +1,71 @@
+# Copyright (C) 2023 FEniCS Project
+#
+# This file is part of FFCx. (https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+
+import pickle
+
+import ffcx.compiler
+import ffcx.options
+import ufl
+from ffcx.analysis import analyze_ufl_objects
+from ffcx.ir.representation import compute_ir
+
+
+def forms():
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 2)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    f = ufl.Coefficient(element)
+    a = ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx + u * v * ufl.ds
+    L = f * v * ufl.dx(0) + ufl.inner(ufl.grad(f), ufl.grad(v)) * ufl.dx(1) + f("+") * v("+") * ufl.dS
+    return [a, L]
+
+
+def test_codegen_processes():
+    objects = forms()
+    serial = ffcx.compiler.compile_ufl_objects(objects, prefix="forms",
+                                               options=ffcx.options.get_options({"codegen_processes": 1}))
+    parallel = ffcx.compiler.compile_ufl_objects(objects, prefix="forms",
+                                                 options=ffcx.options.get_options({"codegen_processes": 3}))
+    assert parallel == serial
+
+
+def test_ir_processes():
+    objects = forms()
+    serial = ffcx.compiler.compile_ufl_objects(objects, prefix="forms",
+                                               options=ffcx.options.get_options({"ir_processes": 1}))
+    parallel = ffcx.compiler.compile_ufl_objects(objects, prefix="forms",
+                                                 options=ffcx.options.get_options({"ir_processes": 3}))
+    assert parallel == serial
+
+
+def test_pickle_integral_ir():
+    options = ffcx.options.get_options()
+    ir = compute_ir(analyze_ufl_objects(forms(), options), {}, "forms", options, False)
+    for integral_ir in ir.integrals:
+        copy = pickle.loads(pickle.dumps(integral_ir))
+        assert copy.name == integral_ir.name
+        assert copy.unique_table_references.keys() == integral_ir.unique_table_references.keys()
+        for name, tr in copy.unique_table_references.items():
+            assert tr.element == integral_ir.unique_table_references[name].element
+
+
+def test_ir_cache(tmp_path, monkeypatch):
+    objects = forms()
+    options = ffcx.options.get_options({"ir_cache_dir": str(tmp_path)})
+    code = ffcx.compiler.compile_ufl_objects(objects, prefix="forms", options=options)
+    assert len(list(tmp_path.glob("*.ir"))) == 1
+
+    # Only the code generation options differ, so the cached IR is used
+    padded_options = ffcx.options.get_options({"padlen": 8})
+    padded_code = ffcx.compiler.compile_ufl_objects(objects, prefix="forms", options=padded_options)
+    assert padded_code != code
+
+    def fail(*args):
+        raise AssertionError("IR recomputed")
+    monkeypatch.setattr(ffcx.compiler, "analyze_ufl_objects", fail)
+    monkeypatch.setattr(ffcx.compiler, "compute_ir", fail)
+    assert ffcx.compiler.compile_ufl_objects(objects, prefix="forms", options=options) == code
+    padded_options["ir_cache_dir"] = str(tmp_path)
+    assert ffcx.compiler.compile_ufl_objects(objects, prefix="forms", options=padded_options) == padded_code
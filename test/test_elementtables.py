@@ -0,0 +1,85 @@
+# Copyright (C) 2023 FEniCS Project
+#
+# This file is part of FFCx. (https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+
+import numpy as np
+
+import ffcx.ir.elementtables
+import ufl
+from ffcx.element_interface import convert_element
+from ffcx.ir.elementtables import (analyse_table_sparsity,
+                                   clamp_table_small_numbers,
+                                   clear_tabulation_cache, compress_table,
+                                   equal_tables, get_ffcx_table_values,
+                                   table_key, tabulate_entities)
+
+
+def test_table_key():
+    rng = np.random.default_rng(1)
+    table = rng.uniform(-10.0, 10.0, size=(1, 3, 6, 10))
+    table[0, 0, 0, :4] = [0.0, 0.5, 1.0, -2.0]
+
+    # Tables equal up to rounding errors have equal keys
+    perturbed = table * (1.0 + 1e-14 * rng.uniform(-1.0, 1.0, size=table.shape))
+    perturbed[0, 0, 0, :4] = [0.0, 0.5 - 1e-15, 1.0 + 1e-15, -2.0 + 1e-15]
+    assert equal_tables(table, perturbed)
+    assert table_key(perturbed) == table_key(table)
+
+    # Different tables, or shapes, have different keys
+    different = table.copy()
+    different[0, 1, 2, 3] += 1e-3
+    assert table_key(different) != table_key(table)
+    assert table_key(table.reshape(1, 3, 10, 6)) != table_key(table)
+
+
+def test_tabulation_cache(monkeypatch):
+    clear_tabulation_cache()
+    monkeypatch.setattr(ffcx.ir.elementtables, "tabulation_cache_size", 2)
+    P1 = convert_element(ufl.FiniteElement("Lagrange", ufl.triangle, 1))
+    P2 = convert_element(ufl.FiniteElement("Lagrange", ufl.triangle, 2))
+    points = np.array([[0.5], [0.25]])
+
+    # Facet tabulations are reused, also for other derivatives
+    tables = tabulate_entities(P2, ufl.triangle, "exterior_facet", points, 1)
+    assert len(tables) == 3 and tables[0].shape == (3, 2, 6)
+    assert tabulate_entities(P2, ufl.triangle, "exterior_facet", points.copy(), 1) is tables
+    t = get_ffcx_table_values(points, ufl.triangle, "exterior_facet", P2, None, "facet", (0, 1), 0)
+    assert np.allclose(t["array"][0], [tbl[2] for tbl in tables])
+
+    # The least recently used tabulation is evicted
+    tabulate_entities(P2, ufl.triangle, "exterior_facet", points[::-1], 1)
+    tabulate_entities(P1, ufl.triangle, "exterior_facet", points, 1)
+    assert tabulate_entities(P2, ufl.triangle, "exterior_facet", points, 1) is not tables
+    clear_tabulation_cache()
+
+
+def test_table_sparsity():
+    P2 = convert_element(ufl.FiniteElement("Lagrange", ufl.triangle, 2))
+    points = np.array([[0.2], [0.7]])
+
+    # P2 functions of the vertex and edges away from a facet are zero on it
+    t = get_ffcx_table_values(points, ufl.triangle, "exterior_facet", P2, None, "facet", (0, 0), 0)
+    table = clamp_table_small_numbers(t["array"])
+    sparsity = analyse_table_sparsity("FE_dofs", table)
+    assert sparsity.num_nonzeros == (3, 3, 3)
+    assert np.array_equal(sparsity.dofs, [[1, 2, 3], [0, 2, 4], [0, 1, 5]])
+    assert sparsity.begin is None
+    compressed = compress_table(table, sparsity)
+    assert compressed.shape == (1, 3, 2, 3)
+    for entity, dofs in enumerate(sparsity.dofs):
+        assert np.array_equal(compressed[:, entity], table[:, entity][..., dofs])
+
+    # Entities with fewer nonzero dofs are padded with zero columns
+    table = np.zeros((1, 2, 1, 5))
+    table[0, 0, 0, [1, 2]] = 1.0
+    table[0, 1, 0, 4] = 1.0
+    sparsity = analyse_table_sparsity("FE_dofs", table)
+    assert sparsity.num_nonzeros == (2, 1)
+    assert np.array_equal(sparsity.dofs, [[1, 2], [0, 4]])
+    assert np.array_equal(compress_table(table, sparsity)[0, :, 0], [[1.0, 1.0], [0.0, 1.0]])
+
+    # Contiguous dofs of a single entity need no map, and dense tables no sparsity
+    assert analyse_table_sparsity("FE_dofs", table[:, :1]).begin == 1
+    assert analyse_table_sparsity("FE_dofs", np.ones((1, 2, 1, 3))) is None
@@ -28,12 +28,30 @@ def test_flops():
     dofs1 = (k1 + 1.) * (k1 + 2.) / 2.
     dofs2 = (k2 + 1.) * (k2 + 2.) / 2.
 
-    flops_1 = count_flops(a1)
+    # Flops of the quadrature loops, without reference tensors
+    options = {"reference_tensor": False}
+    flops_1 = count_flops(a1, options)
     assert len(flops_1) == 2
 
-    flops_2 = count_flops(a2)
+    flops_2 = count_flops(a2, options)
     assert len(flops_2) == 2
 
     r = sum(flops_2, 0.) / sum(flops_1, 0.)
 
     assert r > (dofs2**2 / dofs1**2)
+
+
+def test_flops_reference_tensor():
+    a = create_form(2)
+    flops = count_flops(a, {"reference_tensor": False})
+    flops_reference_tensor = count_flops(a, {"reference_tensor": True})
+    assert all(f < g for f, g in zip(flops_reference_tensor, flops))
+
+
+def test_flops_sparse_tables():
+    a = create_form(2)
+    for reference_tensor in (False, True):
+        flops = count_flops(a, {"reference_tensor": reference_tensor, "sparse_tables": False})
+        flops_sparse = count_flops(a, {"reference_tensor": reference_tensor, "sparse_tables": True})
+        assert all(f <= g for f, g in zip(flops_sparse, flops))
+        assert sum(flops_sparse) < sum(flops)
@@ -0,0 +1,22 @@
+# Copyright (C) 2023 FEniCS Project
+#
+# This file is part of FFCx. (https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+
+import subprocess
+import sys
+
+
+def test_jit_import():
+    # Loading cached modules does not need UFL, Basix or NumPy, which
+    # are imported on first use
+    code = ("import sys; import ffcx.codegeneration.jit; "
+            "print(' '.join(m for m in ('ufl', 'basix', 'numpy', 'pkg_resources') if m in sys.modules))")
+    out = subprocess.run([sys.executable, "-c", code], check=True, stdout=subprocess.PIPE, text=True).stdout
+    assert out.split() == []
+
+    # The declarations from ufcx.h are built on first use
+    code = "import ffcx.codegeneration.jit as jit; print('ufcx_form;' in jit.UFC_FORM_DECL)"
+    out = subprocess.run([sys.executable, "-c", code], check=True, stdout=subprocess.PIPE, text=True).stdout
+    assert out.strip() == "True"
@@ -0,0 +1,75 @@
+# Copyright (C) 2023 FEniCS Project
+#
+# This file is part of FFCx. (https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+
+import json
+import pickle
+
+import pytest
+
+import ffcx.compiler
+import ffcx.options
+import ufl
+from ffcx import instrumentation
+from ffcx.ir.elementtables import clear_tabulation_cache
+
+
+def forms():
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 2)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    f = ufl.Coefficient(element)
+    a = ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx + u * v * ufl.ds
+    L = f * v * ufl.dx
+    return [a, L]
+
+
+def test_span_nesting():
+    with instrumentation.Recorder() as recorder:
+        with instrumentation.span("outer", n=1):
+            with instrumentation.span("inner") as inner:
+                instrumentation.count("things", 2)
+            instrumentation.count("things")
+    outer = recorder.spans[-1]
+    assert [s.name for s in recorder.spans] == ["inner", "outer"]
+    assert (outer.depth, inner.depth) == (0, 1)
+    assert outer.start <= inner.start and inner.duration <= outer.duration
+    assert recorder.totals() == {"things": 3}
+    assert pickle.loads(pickle.dumps(inner)).attributes == inner.attributes
+
+    # Nothing is recorded without callbacks
+    with instrumentation.span("unrecorded") as s:
+        pass
+    assert s.duration >= 0.0 and len(recorder.spans) == 2
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_compiler_spans(processes, tmp_path):
+    clear_tabulation_cache()
+    options = ffcx.options.get_options({"ir_processes": processes, "codegen_processes": processes})
+    with instrumentation.Recorder() as recorder:
+        ffcx.compiler.compile_ufl_objects(forms(), prefix="instrumented", options=options)
+
+    names = [s.name for s in recorder.spans]
+    for stage in ("analysis", "ir", "codegen", "formatting"):
+        assert names.count(stage) == 1
+
+    # Spans of each integral, also those computed in worker processes
+    integral_irs = [s for s in recorder.spans if s.name == "integral_ir"]
+    integral_codes = [s for s in recorder.spans if s.name == "integral_code"]
+    assert len(integral_irs) == len(integral_codes) == 3
+    assert {s.attributes["integral_type"] for s in integral_irs} == {"cell", "exterior_facet"}
+    ir_span = recorder.spans[names.index("ir")]
+    for s in integral_irs:
+        assert s.depth > ir_span.depth
+        assert ir_span.start <= s.start <= ir_span.start + ir_span.duration
+    assert "tables" in names and "tabulate" in names
+    assert recorder.totals()["tabulation_cache_misses"] > 0
+
+    recorder.write(tmp_path.joinpath("trace.json"), "chrome")
+    trace = json.loads(tmp_path.joinpath("trace.json").read_text())
+    assert {e["ph"] for e in trace["traceEvents"]} == {"X", "C"}
+    data = recorder.to_json()
+    assert data["spans"][0]["start"] == 0.0
+    assert data["counters"] == recorder.totals()
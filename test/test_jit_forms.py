@@ -4,12 +4,18 @@
 #
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 
+import math
+import shutil
+import subprocess
+
 import numpy as np
 import pytest
 import sympy
 from sympy.abc import x, y, z
 
 import ffcx.codegeneration.jit
+import ffcx.compiler
+import ffcx.options
 import ufl
 from ffcx.naming import cdtype_to_numpy, scalar_to_value_type
 
@@ -721,3 +727,315 @@ def test_complex_operations(compile_args):
     assert np.allclose(J_2, expected_result)
 
     assert np.allclose(J_1, J_2)
+
+
+def test_translation_units(compile_args, tmp_path):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 2)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    f = ufl.Coefficient(element)
+    a = ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx(0) + f * u * v * ufl.dx(1) + u * v * ufl.ds
+
+    tensors = []
+    for processes in (1, 3):
+        compiled_forms, module, code = ffcx.codegeneration.jit.compile_forms(
+            [a], options={"jit_compile_processes": processes}, cache_dir=tmp_path / str(processes),
+            cffi_extra_compile_args=compile_args)
+        form = compiled_forms[0]
+        ffi = module.ffi
+        A = np.zeros((2, 6, 6), dtype=np.float64)
+        w = np.arange(6, dtype=np.float64)
+        c = np.array([], dtype=np.float64)
+        coords = np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0]], dtype=np.float64)
+        for i in range(2):
+            integral = form.integrals(module.lib.cell)[i]
+            integral.tabulate_tensor_float64(ffi.cast('double *', A[i].ctypes.data),
+                                             ffi.cast('double *', w.ctypes.data),
+                                             ffi.cast('double *', c.ctypes.data),
+                                             ffi.cast('double *', coords.ctypes.data), ffi.NULL, ffi.NULL)
+        tensors.append(A)
+
+    # Elements, dofmaps and forms share a translation unit, integrals have one each
+    assert len(list(tmp_path.joinpath("1").glob("*_[0-9].o"))) == 0
+    assert len(list(tmp_path.joinpath("3").glob("*_[0-9].o"))) == 4
+    assert np.allclose(tensors[0], tensors[1])
+
+
+@pytest.mark.parametrize("processes", [1, 3])
+def test_native_backend(compile_args, tmp_path, processes):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 2)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    f = ufl.Coefficient(element)
+    a = ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx + f * u * v * ufl.ds
+
+    tensors = []
+    for backend in ("cffi", "native"):
+        options = {"jit_backend": backend, "jit_compile_processes": processes}
+        compiled_forms, module, code = ffcx.codegeneration.jit.compile_forms(
+            [a], options=options, cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+        form = compiled_forms[0]
+        ffi = module.ffi
+        assert form.rank == 2
+        assert form.num_integrals(module.lib.exterior_facet) == 1
+        integral = form.integrals(module.lib.cell)[0]
+        A = np.zeros((6, 6), dtype=np.float64)
+        w = np.arange(6, dtype=np.float64)
+        c = np.array([], dtype=np.float64)
+        coords = np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0]], dtype=np.float64)
+        integral.tabulate_tensor_float64(ffi.cast('double *', A.ctypes.data), ffi.cast('double *', w.ctypes.data),
+                                         ffi.cast('double *', c.ctypes.data),
+                                         ffi.cast('double *', coords.ctypes.data), ffi.NULL, ffi.NULL)
+        tensors.append(A)
+
+    # The native backend builds a plain shared library
+    assert module.__file__ == str(tmp_path.joinpath(module.__name__ + ".so"))
+    assert np.allclose(tensors[0], tensors[1])
+
+    # It is loaded from the cache
+    ffcx.codegeneration.jit.clear_module_registry()
+    compiled_forms, module, code = ffcx.codegeneration.jit.compile_forms(
+        [a], options=options, cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+    assert code == (None, None) and compiled_forms[0].rank == 2
+
+
+@pytest.mark.parametrize("mode", ["float", "double"])
+def test_interleaved(compile_args, mode):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 2)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    f = ufl.Coefficient(element)
+    a = (f * ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx + f * u * v * ufl.ds
+         + ufl.avg(f) * ufl.inner(ufl.jump(u), ufl.jump(v)) * ufl.dS)
+    width = 4
+    compiled_forms, module, code = ffcx.codegeneration.jit.compile_forms(
+        [a], options={"scalar_type": mode, "cell_batch_size": width}, cffi_extra_compile_args=compile_args)
+    form = compiled_forms[0]
+    ffi = module.ffi
+    np_type = cdtype_to_numpy(mode)
+
+    # Cells of two full blocks and an incomplete block
+    num_cells = 2 * width + 3
+    num_blocks = -(-num_cells // width)
+    rng = np.random.default_rng(3)
+
+    def interleave(x):
+        # Value k of cell i is at block i // width, position k * width + i % width
+        y = np.zeros((num_blocks * width, ) + x.shape[1:], dtype=x.dtype)
+        y[:num_cells] = x
+        return np.ascontiguousarray(y.reshape(num_blocks, width, -1).transpose(0, 2, 1))
+
+    for integral_type, num_entities in ((module.lib.cell, 1), (module.lib.exterior_facet, 1),
+                                        (module.lib.interior_facet, 2)):
+        integral = form.integrals(integral_type)[0]
+        assert integral.cell_batch_size == width
+        w = rng.random((num_cells, 6 * num_entities)).astype(np_type)
+        c = np.array([], dtype=np_type)
+        reference = np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
+        coords = reference + 0.1 * rng.random((num_cells, num_entities, 3, 3))
+        coords[..., 2] = 0.0
+        coords = coords.reshape(num_cells, -1).astype(np_type)
+        entities = rng.integers(0, 3, (num_cells, num_entities)).astype(np.intc)
+        perms = np.zeros((num_cells, num_entities), dtype=np.uint8)
+
+        A = np.zeros((num_cells, (6 * num_entities)**2), dtype=np_type)
+        kernel = getattr(integral, f"tabulate_tensor_{np_type}")
+        for i in range(num_cells):
+            kernel(ffi.cast(f"{mode} *", A[i].ctypes.data), ffi.cast(f"{mode} *", w[i].ctypes.data),
+                   ffi.cast(f"{mode} *", c.ctypes.data), ffi.cast(f"{mode} *", coords[i].ctypes.data),
+                   ffi.cast("int *", entities[i].ctypes.data), ffi.cast("uint8_t *", perms[i].ctypes.data))
+
+        A_interleaved = interleave(np.zeros_like(A))
+        w, coords, entities, perms = interleave(w), interleave(coords), interleave(entities), interleave(perms)
+        kernel = getattr(integral, f"tabulate_tensor_interleaved_{np_type}")
+        kernel(ffi.cast(f"{mode} *", A_interleaved.ctypes.data), ffi.cast(f"{mode} *", w.ctypes.data),
+               ffi.cast(f"{mode} *", c.ctypes.data), ffi.cast(f"{mode} *", coords.ctypes.data),
+               ffi.cast("int *", entities.ctypes.data), ffi.cast("uint8_t *", perms.ctypes.data), num_cells)
+        A_cells = A_interleaved.transpose(0, 2, 1).reshape(num_blocks * width, -1)[:num_cells]
+        assert np.allclose(A_cells, A, rtol=1e-5 if mode == "float" else 1e-12)
+
+
+@pytest.mark.parametrize("cell,degree", [(ufl.quadrilateral, 1), (ufl.quadrilateral, 3),
+                                         (ufl.hexahedron, 1), (ufl.hexahedron, 2)])
+@pytest.mark.parametrize("rule", ["default", "GLL"])
+def test_sum_factorization(compile_args, cell, degree, rule):
+    element = ufl.FiniteElement("Lagrange", cell, degree)
+    vector_element = ufl.VectorElement("Lagrange", cell, degree)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    f, g = ufl.Coefficient(element), ufl.Coefficient(vector_element)
+    dx = ufl.dx(metadata={"quadrature_rule": rule, "quadrature_degree": 2 * degree + 1})
+    a = f * ufl.inner(ufl.grad(u), ufl.grad(v)) * dx + u.dx(0) * v * dx
+    L = (f * v + ufl.inner(ufl.grad(f), ufl.grad(v)) + ufl.div(g) * v) * dx
+
+    tdim = cell.topological_dimension()
+    num_dofs = (degree + 1)**tdim
+    rng = np.random.default_rng(5)
+    vertices = np.array([[i & 1, (i >> 1) & 1, (i >> 2) & 1] for i in range(2**tdim)], dtype=np.float64)
+    if tdim == 2:
+        vertices[:, 2] = 0.0
+    coords = vertices + 0.1 * rng.random(vertices.shape)
+    if tdim == 2:
+        coords[:, 2] = 0.0
+    w = rng.random((tdim + 1) * num_dofs)
+
+    results = []
+    for sum_factorization in (False, True):
+        compiled_forms, module, code = ffcx.codegeneration.jit.compile_forms(
+            [a, L], options={"sum_factorization": sum_factorization}, cffi_extra_compile_args=compile_args)
+        assert ("FT0_Q" in code[1]) == sum_factorization
+        ffi = module.ffi
+        for form, size in zip(compiled_forms, (num_dofs**2, num_dofs)):
+            A = np.zeros(size)
+            kernel = form.integrals(module.lib.cell)[0].tabulate_tensor_float64
+            kernel(ffi.cast("double *", A.ctypes.data), ffi.cast("double *", w.ctypes.data), ffi.NULL,
+                   ffi.cast("double *", coords.ctypes.data), ffi.NULL, ffi.NULL)
+            results.append(A)
+
+    assert np.allclose(results[2], results[0])
+    assert np.allclose(results[3], results[1])
+
+
+@pytest.mark.parametrize("cell,degree", [(ufl.triangle, 1), (ufl.triangle, 2), (ufl.tetrahedron, 2)])
+def test_reference_tensor(compile_args, cell, degree):
+    element = ufl.FiniteElement("Lagrange", cell, degree)
+    vector_element = ufl.VectorElement("Lagrange", cell, degree)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    uv, vv = ufl.TrialFunction(vector_element), ufl.TestFunction(vector_element)
+    kappa = ufl.Coefficient(ufl.FiniteElement("DG", cell, 0))
+    f = ufl.Coefficient(element)
+    a = [kappa * ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx + kappa * u * v * ufl.ds + f * u * v * ufl.dx,
+         ufl.inner(ufl.grad(uv), ufl.grad(vv)) * ufl.dx]
+
+    tdim = cell.topological_dimension()
+    num_dofs = math.comb(degree + tdim, tdim)
+    rng = np.random.default_rng(7)
+    coords = np.zeros((tdim + 1, 3))
+    coords[1:, :tdim] = np.eye(tdim)
+    coords += 0.2 * rng.random(coords.shape)
+    coords[:, tdim:] = 0.0
+    w = rng.random(1 + 20)
+
+    results = []
+    for reference_tensor in (False, True):
+        compiled_forms, module, code = ffcx.codegeneration.jit.compile_forms(
+            a, options={"reference_tensor": reference_tensor}, cffi_extra_compile_args=compile_args)
+        assert ("RT0_Q" in code[1]) == reference_tensor
+        ffi = module.ffi
+        for form, size in zip(compiled_forms, (num_dofs**2, (tdim * num_dofs)**2)):
+            for integral_type, facet in ((module.lib.cell, 0), (module.lib.exterior_facet, 1)):
+                for i in range(form.num_integrals(integral_type)):
+                    integral = form.integrals(integral_type)[i]
+                    A = np.zeros(size)
+                    entity = np.array([facet], dtype=np.int32)
+                    integral.tabulate_tensor_float64(
+                        ffi.cast("double *", A.ctypes.data), ffi.cast("double *", w.ctypes.data), ffi.NULL,
+                        ffi.cast("double *", coords.ctypes.data), ffi.cast("int *", entity.ctypes.data), ffi.NULL)
+                    results.append(A)
+
+    num_kernels = len(results) // 2
+    for A, A_reference_tensor in zip(results[:num_kernels], results[num_kernels:]):
+        assert np.allclose(A_reference_tensor, A)
+
+
+@pytest.mark.skipif(shutil.which("cc") is None, reason="No C compiler")
+def test_reference_tensor_warnings(tmp_path):
+    # Kernels with all blocks contracted with reference tensors have no
+    # quadrature loop, and must not declare unused quadrature weights
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    vector_element = ufl.VectorElement("Lagrange", ufl.triangle, 2)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    uv, vv = ufl.TrialFunction(vector_element), ufl.TestFunction(vector_element)
+    kappa = ufl.Coefficient(ufl.FiniteElement("DG", ufl.triangle, 0))
+    a = [ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx, u * v * ufl.dx,
+         ufl.inner(ufl.grad(uv), ufl.grad(vv)) * ufl.dx, kappa * ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx]
+
+    options = ffcx.options.get_options({"reference_tensor": True})
+    code_h, code_c = ffcx.compiler.compile_ufl_objects(a, prefix="forms", options=options)
+    assert "RT0_Q" in code_c
+    (tmp_path / "forms.h").write_text(code_h)
+    (tmp_path / "forms.c").write_text(code_c)
+    result = subprocess.run(["cc", "-std=c17", "-Wall", "-Werror", "-c", "forms.c",
+                             "-I", ffcx.codegeneration.get_include_path()],
+                            cwd=tmp_path, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+
+@pytest.mark.parametrize("loop_fusion_registers", [0, 2, 8])
+def test_loop_fusion(compile_args, loop_fusion_registers):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 2)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    fs = [ufl.Coefficient(element) for i in range(6)]
+    a = sum(f * ufl.inner(ufl.grad(f), ufl.grad(u)) * v for f in fs) * ufl.dx
+
+    rng = np.random.default_rng(3)
+    coords = np.array([[0.1, 0.0, 0.0], [1.2, 0.1, 0.0], [0.2, 0.9, 0.0]])
+    w = rng.random(6 * 6)
+
+    results = []
+    for options in ({"loop_fusion_registers": 0}, {"loop_fusion_registers": loop_fusion_registers}):
+        # Generate the code even if the module is loaded
+        ffcx.codegeneration.jit.clear_module_registry()
+        compiled_forms, module, code = ffcx.codegeneration.jit.compile_forms(
+            [a], options=options, cffi_extra_compile_args=compile_args)
+        results.append((code[1].count("for (int ic = 0; ic < 6; ++ic)"), module, compiled_forms[0]))
+
+    # Loops of 18 coefficient values, each with an accumulator, are
+    # split to fit the register budget
+    num_loops = [r[0] for r in results]
+    if loop_fusion_registers == 0:
+        assert num_loops[1] == num_loops[0]
+    else:
+        assert num_loops[1] > num_loops[0]
+
+    A = []
+    for _, module, form in results:
+        ffi = module.ffi
+        A.append(np.zeros(36))
+        form.integrals(module.lib.cell)[0].tabulate_tensor_float64(
+            ffi.cast("double *", A[-1].ctypes.data), ffi.cast("double *", w.ctypes.data), ffi.NULL,
+            ffi.cast("double *", coords.ctypes.data), ffi.NULL, ffi.NULL)
+    assert np.allclose(A[1], A[0])
+
+
+def test_sparse_tables(compile_args):
+    P2 = ufl.FiniteElement("Lagrange", ufl.triangle, 2)
+    V2 = ufl.VectorElement("Lagrange", ufl.triangle, 2)
+    N1 = ufl.FiniteElement("N1curl", ufl.triangle, 2)
+    u, v = ufl.TrialFunction(P2), ufl.TestFunction(P2)
+    uv, vv = ufl.TrialFunction(V2), ufl.TestFunction(V2)
+    uc, vc = ufl.TrialFunction(N1), ufl.TestFunction(N1)
+    f, g, E = ufl.Coefficient(P2), ufl.Coefficient(V2), ufl.Coefficient(N1)
+    x = ufl.SpatialCoordinate(ufl.triangle)
+    a = [f * u * v * ufl.ds + ufl.inner(ufl.grad(f), ufl.grad(u)) * v * ufl.ds,
+         ufl.inner(g, uv) * ufl.inner(x, vv) * ufl.ds,
+         ufl.inner(E, uc) * ufl.inner(E, vc) * ufl.ds,
+         ufl.jump(u) * ufl.jump(v) * ufl.dS + ufl.avg(f) * u("+") * v("-") * ufl.dS]
+
+    rng = np.random.default_rng(11)
+    coords = np.array([[0.1, 0.0, 0.0], [1.2, 0.1, 0.0], [0.2, 0.9, 0.0],
+                       [1.2, 0.1, 0.0], [0.2, 0.9, 0.0], [1.3, 1.1, 0.0]])
+    w = rng.random(2 * 12)
+    perms = np.zeros(2, dtype=np.uint8)
+
+    results = []
+    for sparse_tables in (False, True):
+        ffcx.codegeneration.jit.clear_module_registry()
+        compiled_forms, module, code = ffcx.codegeneration.jit.compile_forms(
+            a, options={"sparse_tables": sparse_tables}, cffi_extra_compile_args=compile_args)
+        # Facet integrals loop over the dofs with nonzero values only
+        assert ("_dofs[entity_local_index[0]]" in code[1]) == sparse_tables
+        ffi = module.ffi
+        for form in compiled_forms:
+            for integral_type, entities in ((module.lib.exterior_facet, [[0], [1], [2]]),
+                                            (module.lib.interior_facet, [[1, 2], [2, 0]])):
+                for i in range(form.num_integrals(integral_type)):
+                    integral = form.integrals(integral_type)[i]
+                    for entity in entities:
+                        A = np.zeros((2 * 12)**2)
+                        entity = np.array(entity, dtype=np.int32)
+                        integral.tabulate_tensor_float64(
+                            ffi.cast("double *", A.ctypes.data), ffi.cast("double *", w.ctypes.data), ffi.NULL,
+                            ffi.cast("double *", coords.ctypes.data), ffi.cast("int *", entity.ctypes.data),
+                            ffi.cast("uint8_t *", perms.ctypes.data))
+                        results.append(A)
+
+    num_kernels = len(results) // 2
+    for A, A_sparse in zip(results[:num_kernels], results[num_kernels:]):
+        assert np.allclose(A_sparse, A)
@@ -0,0 +1,276 @@
+# Copyright (C) 2023 FEniCS Project
+#
+# This file is part of FFCx. (https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+
+import numpy as np
+import pytest
+
+import basix
+import ffcx.codegeneration.jit
+import ufl
+
+# Stand-in for the call_basix.h header of the runtime quadrature support
+# library. Every table value is the number of tabulations done so far,
+# such that results computed from stale and fresh tables differ.
+call_basix_h = """
+#pragma once
+#include <stdlib.h>
+
+static int num_tabulations = 0;
+
+static void call_basix(double***** FE, int num_points, const double* points, int nd, int family,
+                       int cell_type, int degree, int lattice_type, int gdim)
+{
+  ++num_tabulations;
+  const int num_dofs = 64;
+  *FE = malloc(sizeof(double***));
+  (*FE)[0] = malloc(sizeof(double**));
+  (*FE)[0][0] = malloc(num_points * sizeof(double*));
+  for (int p = 0; p < num_points; ++p)
+  {
+    (*FE)[0][0][p] = malloc(num_dofs * sizeof(double));
+    for (int d = 0; d < num_dofs; ++d)
+      (*FE)[0][0][p][d] = num_tabulations * (1 + p + nd * d);
+  }
+}
+"""
+
+
+@pytest.fixture
+def runtime_include(tmp_path, monkeypatch):
+    tmp_path.joinpath("call_basix.h").write_text(call_basix_h)
+    monkeypatch.setenv("CPATH", str(tmp_path))
+
+
+def compile_runtime_form(options):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    f = ufl.Coefficient(element)
+    dx = ufl.Measure("dx", metadata={"quadrature_rule": "runtime"})
+    a = f * u * v * dx
+    compiled_forms, module, code = ffcx.codegeneration.jit.compile_forms([a], options=options)
+    integral = compiled_forms[0].integrals(module.lib.cell)[0]
+    return integral, module.ffi
+
+
+coords = np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0]], dtype=np.float64)
+
+
+def create_element(desc):
+    """Create the basix element described by a runtime table descriptor."""
+    return basix.create_element(basix.ElementFamily(desc.family), basix.CellType(desc.cell_type), desc.degree,
+                                basix.LagrangeVariant(desc.lattice_type), basix.DPCVariant(desc.dpc_variant),
+                                bool(desc.discontinuous))
+
+
+def tabulate(integral, ffi, points, coords=coords, w=np.ones(3)):
+    A = np.zeros((3, 3), dtype=np.float64)
+    c = np.array([], dtype=np.float64)
+    weights = np.full(points.shape[0], 0.5 / points.shape[0])
+    normals = np.zeros_like(points)
+    integral.tabulate_tensor_runtime_float64(
+        ffi.cast('double *', A.ctypes.data), ffi.cast('double *', w.ctypes.data),
+        ffi.cast('double *', c.ctypes.data), ffi.cast('double *', coords.ctypes.data),
+        ffi.NULL, ffi.NULL, points.shape[0], ffi.cast('double *', points.ctypes.data),
+        ffi.cast('double *', weights.ctypes.data), ffi.cast('double *', normals.ctypes.data))
+    return A
+
+
+def test_runtime_table_cache(runtime_include):
+    integral, ffi = compile_runtime_form({"runtime_table_cache_size": 2})
+
+    p0 = np.array([[0.2, 0.2], [0.6, 0.2], [0.2, 0.6]])
+    p1 = np.array([[0.1, 0.1], [0.5, 0.1]])
+    p2 = np.array([[0.3, 0.3]])
+
+    A0 = tabulate(integral, ffi, p0)
+    assert not np.allclose(A0, 0.0)
+
+    # Tables for points seen before are reused
+    assert np.allclose(tabulate(integral, ffi, p0.copy()), A0)
+    A1 = tabulate(integral, ffi, p1)
+    assert np.allclose(tabulate(integral, ffi, p0), A0)
+    assert np.allclose(tabulate(integral, ffi, p1), A1)
+
+    # p0 is least recently used and is evicted to make room for p2
+    tabulate(integral, ffi, p2)
+    assert np.allclose(tabulate(integral, ffi, p1), A1)
+    assert not np.allclose(tabulate(integral, ffi, p0), A0)
+
+
+def test_runtime_uncached_padded_tables(runtime_include):
+    cached, cached_ffi = compile_runtime_form({"runtime_table_cache_size": 8})
+    integral, ffi = compile_runtime_form({"runtime_table_cache_size": 0, "padlen": 4})
+
+    # Padding the tables does not change the result
+    points = np.array([[0.2, 0.2], [0.6, 0.2], [0.2, 0.6]])
+    A0 = tabulate(integral, ffi, points)
+    assert np.allclose(A0, tabulate(cached, cached_ffi, points))
+
+    # Without a cache the tables are tabulated again at every call
+    assert np.allclose(tabulate(cached, cached_ffi, points), A0)
+    assert not np.allclose(tabulate(integral, ffi, points), A0)
+
+
+def test_runtime_batch(runtime_include):
+    integral, ffi = compile_runtime_form({})
+
+    points = [np.array([[0.2, 0.2], [0.6, 0.2], [0.2, 0.6]]), np.array([[0.3, 0.3]]),
+              np.array([[0.1, 0.1], [0.5, 0.1]])]
+    cell_coords = [coords, 2 * coords, coords + 1]
+    cell_w = [np.ones(3), np.array([1.0, 2.0, 3.0]), np.array([-1.0, 0.5, 0.0])]
+    expected = [tabulate(integral, ffi, p, x, w) for p, x, w in zip(points, cell_coords, cell_w)]
+
+    num_cells = len(points)
+    A = np.zeros((num_cells, 3, 3), dtype=np.float64)
+    w = np.concatenate(cell_w)
+    c = np.array([], dtype=np.float64)
+    x = np.concatenate(cell_coords)
+    offsets = np.cumsum([0] + [p.shape[0] for p in points], dtype=np.intc)
+    qp = np.concatenate(points)
+    weights = np.concatenate([np.full(p.shape[0], 0.5 / p.shape[0]) for p in points])
+    normals = np.zeros_like(qp)
+    integral.tabulate_tensor_runtime_batch_float64(
+        ffi.cast('double *', A.ctypes.data), ffi.cast('double *', w.ctypes.data),
+        ffi.cast('double *', c.ctypes.data), ffi.cast('double *', x.ctypes.data),
+        ffi.NULL, ffi.NULL, num_cells, ffi.cast('int *', offsets.ctypes.data),
+        ffi.cast('double *', qp.ctypes.data), ffi.cast('double *', weights.ctypes.data),
+        ffi.cast('double *', normals.ctypes.data))
+
+    for i in range(num_cells):
+        assert np.allclose(A[i], expected[i])
+
+
+def test_runtime_pretabulated_tables():
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    dx = ufl.Measure("dx", metadata={"quadrature_rule": "runtime"})
+    a = u * v * dx
+    compiled_forms, module, code = ffcx.codegeneration.jit.compile_forms(
+        [a], options={"runtime_pretabulated_tables": True})
+    ffi = module.ffi
+    integral = compiled_forms[0].integrals(module.lib.cell)[0]
+    assert integral.tabulate_tensor_runtime_float64 == ffi.NULL
+
+    # Tabulate the tables described by the integral at two sets of points
+    points = [np.array([[1 / 6, 1 / 6], [2 / 3, 1 / 6], [1 / 6, 2 / 3]]), np.array([[1 / 3, 1 / 3]])]
+    weights = [np.full(3, 1 / 6), np.array([0.5])]
+    qp = np.concatenate(points)
+    tables = []
+    for i in range(integral.num_runtime_tables):
+        desc = integral.runtime_tables[i]
+        e = create_element(desc)
+        t = e.tabulate(1, qp)[desc.derivative, :, :, desc.component]
+        assert t.shape[1] == desc.num_dofs
+        tables.append(np.ascontiguousarray(t))
+    table_ptrs = ffi.new("double*[]", [ffi.cast("double *", t.ctypes.data) for t in tables])
+
+    num_cells = len(points)
+    A = np.zeros((num_cells, 3, 3), dtype=np.float64)
+    w = np.array([], dtype=np.float64)
+    c = np.array([], dtype=np.float64)
+    x = np.concatenate([coords, coords])
+    offsets = np.cumsum([0] + [p.shape[0] for p in points], dtype=np.intc)
+    qw = np.concatenate(weights)
+    integral.tabulate_tensor_runtime_tables_batch_float64(
+        ffi.cast('double *', A.ctypes.data), ffi.cast('double *', w.ctypes.data),
+        ffi.cast('double *', c.ctypes.data), ffi.cast('double *', x.ctypes.data),
+        ffi.NULL, ffi.NULL, num_cells, ffi.cast('int *', offsets.ctypes.data),
+        ffi.cast('double *', qp.ctypes.data), ffi.cast('double *', qw.ctypes.data), ffi.NULL, table_ptrs)
+
+    # Degree 2 rule integrates the mass matrix exactly, the one point rule does not
+    assert np.allclose(A[0], np.array([[2.0, 1.0, 1.0], [1.0, 2.0, 1.0], [1.0, 1.0, 2.0]]) / 24)
+    assert np.allclose(A[1], np.full((3, 3), 1 / 18))
+
+
+def test_runtime_mixed_degree_tables():
+    P1 = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    P2 = ufl.FiniteElement("Lagrange", ufl.triangle, 2)
+    u, v = ufl.TrialFunction(P2), ufl.TestFunction(P2)
+    f = ufl.Coefficient(P1)
+
+    def form(dx):
+        return (ufl.inner(ufl.grad(u), ufl.grad(v)) + ufl.div(ufl.grad(u)) * v + f * u * v) * dx
+
+    dx_runtime = ufl.Measure("dx", metadata={"quadrature_rule": "runtime"})
+    dx_static = ufl.Measure("dx", metadata={"quadrature_degree": 4})
+    compiled_forms, module, code = ffcx.codegeneration.jit.compile_forms(
+        [form(dx_runtime), form(dx_static)], options={"runtime_pretabulated_tables": True})
+    ffi = module.ffi
+    runtime = compiled_forms[0].integrals(module.lib.cell)[0]
+    static = compiled_forms[1].integrals(module.lib.cell)[0]
+
+    # Each table is tabulated for its own element, including second
+    # derivatives of the P2 basis
+    descs = [runtime.runtime_tables[i] for i in range(runtime.num_runtime_tables)]
+    assert {(d.degree, d.num_dofs) for d in descs} == {(1, 3), (2, 6)}
+    assert {d.derivative for d in descs if d.degree == 2} == set(range(6))
+
+    points, weights = basix.make_quadrature(basix.CellType.triangle, 4)
+    tables = []
+    for desc in descs:
+        e = create_element(desc)
+        t = e.tabulate(2, points)[desc.derivative, :, :, desc.component]
+        tables.append(np.ascontiguousarray(t))
+    table_ptrs = ffi.new("double*[]", [ffi.cast("double *", t.ctypes.data) for t in tables])
+
+    x = np.array([[0.1, 0.0, 0.0], [1.2, 0.3, 0.0], [0.4, 0.9, 0.0]], dtype=np.float64)
+    w = np.array([1.0, 2.0, -1.0], dtype=np.float64)
+    c = np.array([], dtype=np.float64)
+    A_runtime = np.zeros((6, 6), dtype=np.float64)
+    runtime.tabulate_tensor_runtime_tables_float64(
+        ffi.cast('double *', A_runtime.ctypes.data), ffi.cast('double *', w.ctypes.data),
+        ffi.cast('double *', c.ctypes.data), ffi.cast('double *', x.ctypes.data),
+        ffi.NULL, ffi.NULL, points.shape[0], ffi.cast('double *', points.ctypes.data),
+        ffi.cast('double *', weights.ctypes.data), ffi.NULL, table_ptrs)
+    A_static = np.zeros((6, 6), dtype=np.float64)
+    static.tabulate_tensor_float64(
+        ffi.cast('double *', A_static.ctypes.data), ffi.cast('double *', w.ctypes.data),
+        ffi.cast('double *', c.ctypes.data), ffi.cast('double *', x.ctypes.data), ffi.NULL, ffi.NULL)
+
+    assert np.allclose(A_runtime, A_static)
+
+
+@pytest.mark.parametrize("family", ["Lagrange", "DG"])
+def test_runtime_tables_variant(family):
+    # Lagrange elements of degree 3 use the GLL warped variant, which
+    # the descriptors give to the caller
+    element = ufl.FiniteElement(family, ufl.triangle, 3)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    f = ufl.Coefficient(element)
+
+    dx_runtime = ufl.Measure("dx", metadata={"quadrature_rule": "runtime"})
+    dx_static = ufl.Measure("dx", metadata={"quadrature_degree": 9})
+    compiled_forms, module, code = ffcx.codegeneration.jit.compile_forms(
+        [f * u * v * dx_runtime, f * u * v * dx_static], options={"runtime_pretabulated_tables": True})
+    ffi = module.ffi
+    runtime = compiled_forms[0].integrals(module.lib.cell)[0]
+    static = compiled_forms[1].integrals(module.lib.cell)[0]
+
+    # The other tables are of the coordinate element
+    descs = [runtime.runtime_tables[i] for i in range(runtime.num_runtime_tables)]
+    variants = {(basix.LagrangeVariant(d.lattice_type), d.discontinuous) for d in descs if d.degree == 3}
+    assert variants == {(basix.LagrangeVariant.gll_warped, int(family == "DG"))}
+
+    points, weights = basix.make_quadrature(basix.CellType.triangle, 9)
+    tables = [np.ascontiguousarray(create_element(d).tabulate(1, points)[d.derivative, :, :, d.component])
+              for d in descs]
+    table_ptrs = ffi.new("double*[]", [ffi.cast("double *", t.ctypes.data) for t in tables])
+
+    x = np.array([[0.1, 0.0, 0.0], [1.2, 0.3, 0.0], [0.4, 0.9, 0.0]], dtype=np.float64)
+    w = np.linspace(-1.0, 2.0, 10)
+    c = np.array([], dtype=np.float64)
+    A_runtime = np.zeros((10, 10), dtype=np.float64)
+    runtime.tabulate_tensor_runtime_tables_float64(
+        ffi.cast('double *', A_runtime.ctypes.data), ffi.cast('double *', w.ctypes.data),
+        ffi.cast('double *', c.ctypes.data), ffi.cast('double *', x.ctypes.data),
+        ffi.NULL, ffi.NULL, points.shape[0], ffi.cast('double *', points.ctypes.data),
+        ffi.cast('double *', weights.ctypes.data), ffi.NULL, table_ptrs)
+    A_static = np.zeros((10, 10), dtype=np.float64)
+    static.tabulate_tensor_float64(
+        ffi.cast('double *', A_static.ctypes.data), ffi.cast('double *', w.ctypes.data),
+        ffi.cast('double *', c.ctypes.data), ffi.cast('double *', x.ctypes.data), ffi.NULL, ffi.NULL)
+
+    assert np.allclose(A_runtime, A_static)